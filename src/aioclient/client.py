@@ -1,6 +1,9 @@
 import logging
-from apistar import Component
-import aiohttp
+from urllib.parse import urlsplit
+from apistar import Component, Settings
+from .pool import SessionPool
+from .resilience import Resilience
+from .validators import Validators
 
 
 logger = logging.getLogger(__name__)
@@ -19,22 +22,91 @@ def mergeargs(func):
 
 
 class Client(object):
-    def __init__(self, headers={}):
-        self._session = aiohttp.ClientSession()
-        logger.debug("AIOClient init, session: %s", self._session)
-        self._headers = headers
-
-    @classmethod
-    def set_headers(cls, headers={}):
-        # A funny factory to get an instance with preset headers that are included
-        # in every requests. This makes it easy to get a new instance while keeping
-        # it's usage with the Component pattern easy.
-        return cls(headers=headers)
+    """
+    A cheap view of the app's shared :code:`SessionPool` carrying default headers.
+
+    Requests go through the app's :code:`Resilience` policy: :code:`get` is retried and
+    can be hedged, both have a deadline and fail with :code:`CircuitOpen` while their
+    host is failing.
+    """
+    def __init__(self, settings: Settings) -> None:
+        config = settings.get('HTTP_CLIENT', {})
+        self._pool = SessionPool(
+            limit=config.get('LIMIT', 100),
+            limit_per_host=config.get('LIMIT_PER_HOST', 20),
+            ttl_dns_cache=config.get('DNS_CACHE_TTL', 300),
+            keepalive_timeout=config.get('KEEPALIVE_TIMEOUT', 30),
+            timeout=config.get('TIMEOUT', 30),
+        )
+        self._resilience = Resilience(
+            deadline=config.get('DEADLINE', 10),
+            retries=config.get('RETRIES', 2),
+            backoff_base=config.get('BACKOFF_BASE', 0.1),
+            backoff_max=config.get('BACKOFF_MAX', 2.0),
+            hedge_percentile=config.get('HEDGE_PERCENTILE', 0.95),
+            breaker_failures=config.get('BREAKER_FAILURES', 5),
+            breaker_reset=config.get('BREAKER_RESET', 30),
+        )
+        self._validators = Validators()
+        self._headers = {}
+        logger.debug("AIOClient init, pool: %s", self._pool)
+
+    def set_headers(self, headers={}):
+        # A funny factory to get a view with preset headers that are included
+        # in every requests. Views share this client's pool and connections.
+        view = object.__new__(type(self))
+        view.__dict__.update(self.__dict__)
+        view._headers = dict(self._headers, **headers)
+
+        return view
+
+    @property
+    def pool(self):
+        return self._pool
+
+    @property
+    def resilience(self):
+        return self._resilience
+
+    @property
+    def validators(self):
+        return self._validators
+
+    async def _request(self, method, url, idempotent, deadline=None, hedge=False,
+                       endpoint=None, **kwargs):
+        async def request():
+            return await getattr(self._pool.session(), method)(url, **kwargs)
+
+        parts = urlsplit(str(url))
+        return await self._resilience.call(
+            parts.hostname, request,
+            idempotent=idempotent, deadline=deadline, hedge=hedge,
+            endpoint=endpoint or f'{parts.hostname}{parts.path}',
+        )
 
     @mergeargs
-    async def get(self, *args, **kwargs):
+    async def get(self, url, conditional=False, **kwargs):
+        """
+        GET :code:`url`. Takes aiohttp's arguments plus :code:`deadline`, seconds for the
+        whole call, and :code:`hedge` to send a second request if the first is slow.
+        What's slow is judged from the latencies of :code:`endpoint`, by default the
+        URL's host and path, give one when a path serves responses of very different
+        sizes.
+
+        With :code:`conditional` the response's validators are kept and sent along with
+        the next conditional request for the URL, the caller must then handle a
+        :code:`304 Not Modified`.
+        """
         logger.debug("AIOClient get")
-        resp = await self._session.get(*args, **kwargs)
+
+        if conditional:
+            key = self._validators.key(url, kwargs.get('params'))
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **self._validators.headers(key))
+
+        resp = await self._request('get', url, True, **kwargs)
+
+        if conditional:
+            self._validators.update(key, resp)
 
         logger.debug("AIOClient get resp: %s", resp)
         #  logger.debug("AIOClient get resp: %s", dir(resp))
@@ -42,9 +114,12 @@ class Client(object):
         return resp
 
     @mergeargs
-    async def post(self, *args, **kwargs):
+    async def post(self, url, **kwargs):
+        """
+        POST to :code:`url`, never retried. Takes a :code:`deadline` like :code:`get`.
+        """
         logger.debug("AIOClient post")
-        resp = await self._session.post(*args, **kwargs)
+        resp = await self._request('post', url, False, **kwargs)
 
         logger.debug("AIOClient post resp: %s", resp)
         #  logger.debug("AIOClient post resp: %s", dir(resp))
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import aiohttp
+from local_utils.shutdown import on_shutdown
+
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPool(object):
+    """
+    The one :code:`aiohttp.ClientSession`, and its connector, shared by every
+    :code:`Client` view of an app, so connections and TLS sessions to slack.com and
+    coinmarketcap are kept alive and reused.
+
+    aiohttp sessions are bound to the loop they're created on and components are built
+    before the App's loop is running, see the README, so the session is created lazily
+    on the loop of the first request and replaced if a request comes in on another loop.
+    It's closed at shutdown.
+    """
+    def __init__(self, limit=100, limit_per_host=20, ttl_dns_cache=300, keepalive_timeout=30,
+                 timeout=30):
+        """
+        :param limit: Connections open at once, across all hosts.
+        :param limit_per_host: Connections open at once to one host.
+        :param ttl_dns_cache: Seconds DNS lookups are cached for.
+        :param keepalive_timeout: Seconds an idle connection is kept open for reuse.
+        :param timeout: Default total seconds for a request.
+        """
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._ttl_dns_cache = ttl_dns_cache
+        self._keepalive_timeout = keepalive_timeout
+        self._timeout = timeout
+        self._loop = None
+        self._session = None
+        self._sessions = 0
+        self._shutdown_hooked = False
+
+    def session(self):
+        """
+        The shared session for the current loop, must be called from a coroutine.
+        """
+        loop = asyncio.get_event_loop()
+
+        if self._session is not None and not self._session.closed and self._loop is loop:
+            return self._session
+
+        if self._session is not None and not self._session.closed:
+            logger.debug("SessionPool bound to another loop, replacing the session")
+            # The old loop is gone or not ours to run, drop the session without awaiting it.
+            self._session.detach()
+
+        connector = aiohttp.TCPConnector(
+            limit=self._limit,
+            limit_per_host=self._limit_per_host,
+            ttl_dns_cache=self._ttl_dns_cache,
+            keepalive_timeout=self._keepalive_timeout,
+        )
+
+        self._loop = loop
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self._timeout),
+        )
+        self._sessions += 1
+        logger.debug("SessionPool new session: %s", self._session)
+
+        if not self._shutdown_hooked:
+            on_shutdown(self.close)
+            self._shutdown_hooked = True
+
+        return self._session
+
+    async def close(self):
+        session, self._session = self._session, None
+        self._loop = None
+
+        if session is not None and not session.closed:
+            await session.close()
+
+    def stats(self):
+        return {
+            'sessions': self._sessions,
+            'limit': self._limit,
+            'limit_per_host': self._limit_per_host,
+        }
@@ -0,0 +1,297 @@
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+import aiohttp
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Fails calls to a host fast after :code:`failures` failures in a row. Once
+    :code:`reset_timeout` seconds have passed a single trial call is let through, its
+    success closes the breaker again and its failure keeps it open. A trial that never
+    reports back is replaced by another one after :code:`reset_timeout` too.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failures=5, reset_timeout=30, timer=time.monotonic):
+        self._threshold = failures
+        self._reset_timeout = reset_timeout
+        self._timer = timer
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened = 0.0
+        self._trips = 0
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def trips(self):
+        return self._trips
+
+    def allow(self):
+        if self._state == self.CLOSED:
+            return True
+
+        now = self._timer()
+        if now - self._opened >= self._reset_timeout:
+            self._state = self.HALF_OPEN
+            self._opened = now
+            return True
+
+        return False
+
+    def record_success(self):
+        self._state = self.CLOSED
+        self._failures = 0
+
+    def record_abandoned(self):
+        """
+        A call was cancelled before it got an answer. If it was the trial call the
+        next call is let through to try again, it learned nothing about the host.
+        """
+        if self._state == self.HALF_OPEN:
+            self._opened = self._timer() - self._reset_timeout
+
+    def record_failure(self):
+        self._failures += 1
+
+        if self._state != self.CLOSED or self._failures >= self._threshold:
+            if self._state != self.OPEN:
+                self._trips += 1
+                logger.warning("CircuitBreaker open after %s failures", self._failures)
+
+            self._state = self.OPEN
+            self._opened = self._timer()
+
+
+class LatencyWindow(object):
+    """
+    The latencies of the last :code:`size` calls to an endpoint.
+    """
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, p):
+        if not self._samples:
+            return None
+
+        ordered = sorted(self._samples)
+        return ordered[min(int(p * len(ordered)), len(ordered) - 1)]
+
+
+def backoff(attempt, base=0.1, cap=2.0):
+    """
+    Seconds to wait before retry :code:`attempt`, exponential with full jitter.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# Failures worth another try, the request may well work the next time.
+RETRY_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class Resilience(object):
+    """
+    Deadlines, retries, hedging and circuit breaking for the requests of every
+    :code:`Client` view of an app, with the breakers kept per host and the latencies
+    per endpoint, so a big download and a small lookup on one host don't share what
+    counts as slow.
+
+    * Every call has a deadline covering all of its attempts.
+    * Idempotent calls are retried on connection errors, timeouts and 5xx responses,
+      with exponential backoff and jitter.
+    * A hedged call sends a second request when the first is slower than the host's
+      :code:`hedge_percentile` latency, and takes whichever answers first.
+    * A host that keeps failing has its breaker opened and calls to it fail with
+      :code:`CircuitOpen` right away, so callers can fall back to what they have.
+    """
+    def __init__(self, deadline=10, retries=2, backoff_base=0.1, backoff_max=2.0,
+                 hedge_percentile=0.95, hedge_min_samples=20, breaker_failures=5,
+                 breaker_reset=30):
+        self._deadline = deadline
+        self._retries = retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._hedge_percentile = hedge_percentile
+        self._hedge_min_samples = hedge_min_samples
+        self._breaker_failures = breaker_failures
+        self._breaker_reset = breaker_reset
+        self._breakers = {}
+        self._latencies = {}
+        self._calls = 0
+        self._retried = 0
+        self._hedged = 0
+        self._hedges_won = 0
+        self._rejected = 0
+        self._deadlines = 0
+
+    def breaker(self, host):
+        breaker = self._breakers.get(host)
+
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(
+                self._breaker_failures, self._breaker_reset)
+
+        return breaker
+
+    def latency(self, endpoint):
+        window = self._latencies.get(endpoint)
+
+        if window is None:
+            window = self._latencies[endpoint] = LatencyWindow()
+
+        return window
+
+    async def call(self, host, request, idempotent=False, deadline=None, hedge=False,
+                   endpoint=None):
+        """
+        Run :code:`request()`, a coroutine function returning a response, under this
+        policy. Raises :code:`CircuitOpen` while the host's breaker is open.
+
+        :param endpoint: What the latencies, and so when to hedge, are tracked by,
+            the host by default.
+        """
+        breaker = self.breaker(host)
+        endpoint = endpoint or host
+        self._calls += 1
+
+        if not breaker.allow():
+            self._rejected += 1
+            raise CircuitOpen(f'Circuit open for {host}')
+
+        deadline = self._deadline if deadline is None else deadline
+
+        try:
+            return await asyncio.wait_for(
+                self._call(host, endpoint, breaker, request, idempotent, hedge), deadline)
+        except asyncio.TimeoutError:
+            self._deadlines += 1
+            breaker.record_failure()
+            raise
+
+    async def _call(self, host, endpoint, breaker, request, idempotent, hedge):
+        attempts = self._retries + 1 if idempotent else 1
+        error = None
+
+        for attempt in range(attempts):
+            if attempt:
+                if not breaker.allow():
+                    # The failures so far opened the breaker, stop hammering the host.
+                    break
+
+                self._retried += 1
+                await asyncio.sleep(backoff(attempt - 1, self._backoff_base, self._backoff_max))
+
+            try:
+                if hedge and idempotent:
+                    resp = await self._hedge(endpoint, request)
+                else:
+                    resp = await self._timed(endpoint, request)
+            except RETRY_ERRORS as e:
+                logger.warning("Resilience %s attempt %s error: %s", host, attempt + 1, e)
+                breaker.record_failure()
+                error = e
+                continue
+            except asyncio.CancelledError:
+                breaker.record_abandoned()
+                raise
+            except Exception:
+                # Not worth a retry, but a trial call must still settle the breaker.
+                breaker.record_failure()
+                raise
+
+            if resp.status < 500:
+                breaker.record_success()
+                return resp
+
+            breaker.record_failure()
+            if attempt == attempts - 1 or not breaker.allow():
+                # Out of attempts, let the caller see the error response.
+                return resp
+
+            logger.warning("Resilience %s attempt %s status: %s", host, attempt + 1, resp.status)
+            await resp.release()
+
+        raise error
+
+    async def _timed(self, endpoint, request):
+        start = time.monotonic()
+        resp = await request()
+        self.latency(endpoint).add(time.monotonic() - start)
+
+        return resp
+
+    async def _hedge(self, endpoint, request):
+        window = self.latency(endpoint)
+
+        if len(window) < self._hedge_min_samples:
+            # Not enough history yet to know what slow is.
+            return await self._timed(endpoint, request)
+
+        first = asyncio.ensure_future(self._timed(endpoint, request))
+        tasks = [first]
+        winner = None
+
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=window.percentile(self._hedge_percentile))
+            if done:
+                winner = first
+                return first.result()
+
+            self._hedged += 1
+            tasks.append(asyncio.ensure_future(self._timed(endpoint, request)))
+            pending = set(tasks)
+            error = None
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        if task is not first:
+                            self._hedges_won += 1
+
+                        return task.result()
+
+                    error = task.exception()
+
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif task is not winner and not task.cancelled() and task.exception() is None:
+                    # Both answered at once, hand the loser's connection back.
+                    task.result().release()
+
+    def stats(self):
+        return {
+            'calls': self._calls,
+            'retries': self._retried,
+            'hedges': self._hedged,
+            'hedges_won': self._hedges_won,
+            'breaker_trips': sum(b.trips for b in self._breakers.values()),
+            'breaker_rejected': self._rejected,
+            'deadlines': self._deadlines,
+            'open': sorted(h for h, b in self._breakers.items() if b.state != b.CLOSED),
+        }
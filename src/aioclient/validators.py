@@ -0,0 +1,73 @@
+import logging
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class Validators(object):
+    """
+    The :code:`ETag` and :code:`Last-Modified` validators last seen for each URL, used
+    to make conditional requests. A :code:`304 Not Modified` answer costs headers only.
+    """
+    def __init__(self, maxsize=256):
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self._requests = 0
+        self._not_modified = 0
+
+    @staticmethod
+    def key(url, params=None):
+        if not params:
+            return str(url)
+
+        return str(url) + '?' + '&'.join(f'{k}={v}' for k, v in sorted(params.items()))
+
+    def headers(self, key):
+        """
+        The conditional request headers for :code:`key`, empty if we have no validators.
+        """
+        etag, modified = self._data.get(key, (None, None))
+        headers = {}
+
+        if etag:
+            headers['If-None-Match'] = etag
+
+        if modified:
+            headers['If-Modified-Since'] = modified
+
+        if headers:
+            self._requests += 1
+
+        return headers
+
+    def forget(self, key):
+        self._data.pop(key, None)
+
+    def update(self, key, resp):
+        if resp.status == 304:
+            self._not_modified += 1
+            return
+
+        if resp.status != 200:
+            return
+
+        etag = resp.headers.get('ETag')
+        modified = resp.headers.get('Last-Modified')
+
+        if not (etag or modified):
+            self._data.pop(key, None)
+            return
+
+        self._data[key] = (etag, modified)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'conditional': self._requests,
+            'not_modified': self._not_modified,
+        }
@@ -45,6 +45,7 @@ We instantiate the :code:`App` instance with
         * Our project's custom commands to be registered:
             * :doc:`backends/asyncpg`
             * :doc:`backends/redis`
+            * :doc:`slackbot/loadtest`
 
 ::
 
@@ -52,7 +53,7 @@ We instantiate the :code:`App` instance with
         routes=routes,
         settings=settings,
         components=components,
-        commands=redis.commands + asyncpg.commands
+        commands=redis.commands + asyncpg.commands + loadtest.commands
     )
 """
 
@@ -71,6 +72,7 @@ from local_utils import print_routes, print_settings, print_components
 from aioclient import client
 from backends import redis, asyncpg
 import slackbot
+from slackbot import loadtest
 
 
 logging.basicConfig(level=(settings.get('DEBUG') and logging.DEBUG) or logging.INFO)
@@ -100,7 +102,7 @@ app = App(
     routes=routes,
     settings=settings,
     components=components,
-    commands=redis.commands + asyncpg.commands
+    commands=redis.commands + asyncpg.commands + loadtest.commands
 )
 
 
@@ -81,6 +81,21 @@ class AsyncPgBackend(object):
                 logger.error("AsyncPgBackend exec error: %s", e)
                 raise
 
+    def pool_stats(self):
+        """
+        Connection counts of the pool, empty until it's been created.
+        """
+        if not self._pool:
+            return {}
+
+        size = self._pool.get_size()
+
+        return {
+            'size': size,
+            'free': self._pool.get_idle_size(),
+            'max': self._pool.get_max_size(),
+        }
+
     @property
     def url(self):
         return self._url
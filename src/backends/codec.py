@@ -0,0 +1,139 @@
+import json
+import zlib
+import logging
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+"""
+Cache Codecs
+************
+
+Codecs turn cached market data into the bytes stored in Redis and back again.
+
+Encoded values start with a version byte naming the codec that wrote them, so workers
+can read whatever any other worker wrote, including plain JSON text, while a deploy is
+rolling out. Values with an unknown version are reported as unreadable and are treated
+as a cache miss.
+
+Workers from before codecs existed :code:`json.loads` whatever they find and would fail
+on an encoded value, so encoded values are stored under new keys, see
+:code:`CryptoWorld.REDIS_KEY_TICKER`, and never under the keys those workers read.
+
+:code:`msgpack` is optional, when it isn't installed the default codec is zlib compressed
+JSON.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+class CodecError(ValueError):
+    pass
+
+
+class JSONCodec(object):
+    """
+    Plain JSON text without a version byte, the format used before codecs.
+    """
+    version = None
+    name = 'json'
+
+    def encode(self, obj):
+        return json.dumps(obj).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class ZlibJSONCodec(object):
+    version = 1
+    name = 'zlib+json'
+
+    def __init__(self, level=6):
+        self._level = level
+
+    def encode(self, obj):
+        body = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+        return bytes((self.version,)) + zlib.compress(body, self._level)
+
+    def decode(self, data):
+        return json.loads(zlib.decompress(data[1:]))
+
+    def compressor(self):
+        """
+        A zlib compressor to encode JSON text as it arrives, the encoded value is the
+        version byte followed by everything the compressor puts out.
+        """
+        return zlib.compressobj(self._level)
+
+
+class ZlibMsgpackCodec(object):
+    version = 2
+    name = 'zlib+msgpack'
+
+    def __init__(self, level=6):
+        if msgpack is None:
+            raise CodecError('The zlib+msgpack codec requires the msgpack package')
+
+        self._level = level
+
+    def encode(self, obj):
+        body = msgpack.packb(obj, use_bin_type=True)
+        return bytes((self.version,)) + zlib.compress(body, self._level)
+
+    def decode(self, data):
+        return msgpack.unpackb(zlib.decompress(data[1:]), raw=False)
+
+
+CODECS = {ZlibJSONCodec.version: ZlibJSONCodec}
+if msgpack is not None:
+    CODECS[ZlibMsgpackCodec.version] = ZlibMsgpackCodec
+
+# Legacy JSON text starts with one of these, none of them are valid version bytes.
+_JSON_START = frozenset(b'[{ \t\r\n"')
+
+
+def _as_bytes(data):
+    return data.encode('utf-8') if isinstance(data, str) else data
+
+
+def codec_for(data):
+    """
+    The codec that can decode :code:`data`, or :code:`None` when no codec in this worker can.
+    """
+    data = _as_bytes(data)
+
+    if not data:
+        return None
+
+    if data[0] in _JSON_START:
+        return JSONCodec()
+
+    cls = CODECS.get(data[0])
+    return cls() if cls else None
+
+
+def readable(data):
+    return codec_for(data) is not None
+
+
+def decode(data):
+    """
+    Decode a cached value written by any known codec.
+    """
+    codec = codec_for(data)
+
+    if codec is None:
+        raise CodecError('Unknown cache codec version: %r' % (_as_bytes(data)[:1],))
+
+    return codec.decode(_as_bytes(data))
+
+
+def default_codec():
+    if msgpack is not None:
+        return ZlibMsgpackCodec()
+
+    return ZlibJSONCodec()
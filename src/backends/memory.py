@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache(object):
+    """
+    A bounded, in process LRU cache whose entries also expire after a TTL.
+
+    Used as a first tier in front of Redis, so it should be given a TTL shorter than the
+    Redis expiry of the same data. Expired entries are dropped when they're looked up and
+    the least recently used entry is evicted once :code:`maxsize` is reached.
+    """
+    def __init__(self, maxsize=128, ttl=60, timer=time.monotonic) -> None:
+        if maxsize < 1:
+            raise ValueError('TTLCache maxsize must be at least 1')
+
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._timer = timer
+        self._data = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+
+        if item is None:
+            self._misses += 1
+            return default
+
+        value, expires = item
+        if expires is not None and expires <= self._timer():
+            del self._data[key]
+            self._expirations += 1
+            self._misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self._hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store :code:`value` under :code:`key`, :code:`ttl` overrides the cache's default TTL
+        and a TTL of :code:`None` on both means the entry never expires.
+        """
+        ttl = self._ttl if ttl is None else ttl
+        expires = None if ttl is None else self._timer() + ttl
+
+        if key in self._data:
+            self._data.move_to_end(key)
+
+        self._data[key] = (value, expires)
+
+        while len(self._data) > self._maxsize:
+            old_key, _ = self._data.popitem(last=False)
+            self._evictions += 1
+            logger.debug("TTLCache evicted %s", old_key)
+
+    def delete(self, key):
+        return self._data.pop(key, None) is not None
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self._maxsize,
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'expirations': self._expirations,
+        }
@@ -87,6 +87,77 @@ class Redis(object):
             logger.error("Redis exec error: %s", e)
             raise
 
+    async def transaction(self, *commands):
+        """
+        Run each command, a tuple of :code:`exec` arguments, in a single MULTI/EXEC
+        transaction on one connection and return the list of their results. Raises the
+        first error if any command failed.
+        """
+        logger.debug('Redis::transaction: %s commands', len(commands))
+        pool = await self.pool
+
+        try:
+            with await pool as conn:
+                await conn.execute('multi')
+
+                try:
+                    for cmd in commands:
+                        await conn.execute(*cmd)
+                except Exception:
+                    # Don't hand the connection back to the pool mid transaction.
+                    await conn.execute('discard')
+                    raise
+
+                results = await conn.execute('exec')
+        except Exception as e:
+            logger.error("Redis transaction error: %s", e)
+            raise
+
+        # EXEC hands back the error of a failed command in its place, and the rest of
+        # the transaction still ran. Raise it rather than have it mistaken for a result.
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Redis transaction command error: %s", result)
+                raise result
+
+        return results
+
+    async def publish(self, channel, message):
+        return await self.exec('publish', channel, message)
+
+    async def subscribe(self, *channels):
+        """
+        Subscribe to :code:`channels` on a new, dedicated, connection since a connection in
+        SUBSCRIBE mode can't be shared through the pool. Returns the connection, to be
+        closed by the caller, and the channel objects to read messages from.
+        """
+        address, config = self._build_config()
+        config = {k: v for k, v in config.items() if k in ('db', 'password')}
+
+        conn = await aioredis.create_connection(address, **config)
+
+        try:
+            await conn.execute_pubsub('subscribe', *channels)
+        except Exception as e:
+            logger.error("Redis subscribe error: %s", e)
+            conn.close()
+            raise
+
+        return conn, [conn.pubsub_channels[c] for c in channels]
+
+    def pool_stats(self):
+        """
+        Connection counts of the pool, empty until it's been created.
+        """
+        if not self._pool:
+            return {}
+
+        return {
+            'size': self._pool.size,
+            'free': self._pool.freesize,
+            'max': self._pool.maxsize,
+        }
+
     async def conn_info(self):
         logger.debug('Redis::conn_info')
         pool = await self.pool
@@ -0,0 +1,8 @@
+"""
+Stand alone benchmarks for the hot parts of cryptoprice.
+
+Run them from the :code:`src` directory, for example::
+
+    $ python -m benchmarks.ticker_store
+    $ python -m benchmarks.ticker_store --file ticker.json
+"""
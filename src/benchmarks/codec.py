@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import json
+import timeit
+from backends import codec
+from .market import load_ticker
+
+"""
+Cache Codec Benchmark
+*********************
+
+Compares the cache codecs against the plain JSON text that used to be stored, on a full
+:code:`limit=0` ticker. Reports bytes stored, encode and decode time and, when given a
+Redis URL, the time to :code:`GET` the stored value from Redis.
+
+::
+
+    $ python -m benchmarks.codec [--file ticker.json] [--redis redis://127.0.0.1:6379/0]
+"""
+
+
+def codecs():
+    res = [codec.JSONCodec(), codec.ZlibJSONCodec()]
+
+    if codec.msgpack is not None:
+        res.append(codec.ZlibMsgpackCodec())
+
+    return res
+
+
+async def redis_transfer(url, payloads, repeat):
+    import aioredis
+
+    redis = await aioredis.create_redis(url)
+    res = {}
+
+    try:
+        for name, data in payloads.items():
+            key = f'bench:codec:{name}'
+            await redis.set(key, data)
+
+            loop = asyncio.get_event_loop()
+            best = None
+            for _ in range(repeat):
+                start = loop.time()
+                await redis.get(key)
+                elapsed = loop.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            await redis.delete(key)
+            res[name] = best
+    finally:
+        redis.close()
+        await redis.wait_closed()
+
+    return res
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--file', help='A saved limit=0 ticker JSON file')
+    parser.add_argument('--count', type=int, default=1500, help='Synthetic coin count')
+    parser.add_argument('--redis', help='Also measure GET time against this Redis URL')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    coins = load_ticker(args.file, args.count)
+    # The upstream text, as it used to be stored.
+    upstream = json.dumps(coins, indent=4).encode('utf-8')
+    print(f'coins: {len(coins)}  upstream text: {len(upstream)} bytes')
+
+    payloads = {'upstream': upstream}
+    rows = [('upstream', upstream, lambda: json.loads(upstream), None)]
+
+    for c in codecs():
+        data = c.encode(coins)
+        payloads[c.name] = data
+        rows.append(
+            (c.name, data, lambda data=data: codec.decode(data), lambda c=c: c.encode(coins)))
+
+    transfer = {}
+    if args.redis:
+        loop = asyncio.get_event_loop()
+        transfer = loop.run_until_complete(redis_transfer(args.redis, payloads, args.repeat))
+
+    for name, data, dec, enc in rows:
+        dec_t = min(timeit.repeat(dec, number=1, repeat=args.repeat))
+        enc_t = enc and min(timeit.repeat(enc, number=1, repeat=args.repeat))
+        line = (
+            f'{name:<14} bytes: {len(data):9d} ({len(data) / len(upstream):6.1%})  '
+            f'decode: {dec_t * 1000:7.2f} ms'
+        )
+
+        if enc_t:
+            line += f'  encode: {enc_t * 1000:7.2f} ms'
+
+        if name in transfer:
+            line += f'  redis get: {transfer[name] * 1000:7.2f} ms'
+
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
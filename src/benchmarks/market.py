@@ -0,0 +1,81 @@
+import json
+import random
+import string
+import time
+
+"""
+Synthetic Market
+****************
+
+Builds coinmarketcap v1 shaped ticker and global payloads for an arbitrary number of
+coins, for benchmarks and offline tests that can't reach the real API.
+"""
+
+
+def synthetic_coin(rank, rnd=random, now=None):
+    """
+    One coinmarketcap v1 ticker record, with the same string encoded numbers the API uses.
+    """
+    now = int(now or time.time())
+    name = ''.join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(4, 12)))
+    symbol = ''.join(rnd.choice(string.ascii_uppercase) for _ in range(rnd.randint(2, 5)))
+    price = rnd.lognormvariate(0, 3)
+    supply = rnd.uniform(1e5, 1e10)
+
+    def pct():
+        return '%.2f' % rnd.gauss(0, 5)
+
+    return {
+        'id': f'{name}-{rank}',
+        'name': name.title(),
+        'symbol': symbol,
+        'rank': str(rank),
+        'price_usd': '%.6f' % price,
+        'price_btc': '%.8f' % (price / 10000.0),
+        '24h_volume_usd': '%.1f' % (price * supply * rnd.uniform(0.001, 0.1)),
+        'market_cap_usd': '%.1f' % (price * supply),
+        'available_supply': '%.1f' % supply,
+        'total_supply': '%.1f' % supply,
+        'max_supply': None if rnd.random() < 0.5 else '%.1f' % (supply * 2),
+        'percent_change_1h': pct(),
+        'percent_change_24h': pct(),
+        'percent_change_7d': pct(),
+        'last_updated': str(now - rnd.randint(0, 600)),
+    }
+
+
+def synthetic_ticker(count=1500, seed=0, now=None):
+    """
+    A list of :code:`count` ticker records, ordered by market cap like the real ticker.
+    """
+    rnd = random.Random(seed)
+    coins = [synthetic_coin(rank, rnd, now) for rank in range(1, count + 1)]
+    coins.sort(key=lambda c: float(c['market_cap_usd']), reverse=True)
+
+    for rank, coin in enumerate(coins, 1):
+        coin['rank'] = str(rank)
+
+    return coins
+
+
+def synthetic_global(coins, now=None):
+    return {
+        'total_market_cap_usd': sum(float(c['market_cap_usd']) for c in coins),
+        'total_24h_volume_usd': sum(float(c['24h_volume_usd']) for c in coins),
+        'bitcoin_percentage_of_market_cap': 40.0,
+        'active_currencies': len(coins),
+        'active_assets': 0,
+        'active_markets': len(coins) * 5,
+        'last_updated': int(now or time.time()),
+    }
+
+
+def load_ticker(path=None, count=1500):
+    """
+    Load a saved :code:`limit=0` ticker from :code:`path`, or build a synthetic one.
+    """
+    if path:
+        with open(path) as f:
+            return json.load(f)
+
+    return synthetic_ticker(count)
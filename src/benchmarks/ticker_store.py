@@ -0,0 +1,125 @@
+import argparse
+import gc
+import timeit
+import tracemalloc
+from slackbot.crypto import TickerStore
+from .market import load_ticker
+
+"""
+TickerStore Benchmark
+*********************
+
+Compares the memory use and property access time of the columnar :code:`TickerStore`
+backed :code:`Blockchain` against the original dict backed :code:`Blockchain`, over a
+full :code:`limit=0` ticker.
+
+::
+
+    $ python -m benchmarks.ticker_store [--file ticker.json] [--count 1500]
+"""
+
+
+class DictBlockchain(object):
+    """
+    The original, dict backed, Blockchain kept as the benchmark baseline.
+    """
+    def __init__(self, data={}):
+        self._data = data
+
+    def __getattr__(self, key):
+        return self._data.get(key)
+
+    @property
+    def market_cap(self):
+        return float(self._data.get('market_cap_usd') or 0)
+
+    @property
+    def usd(self):
+        return '%2.2f' % float(self._data.get('price_usd', 0))
+
+    @property
+    def one_hour(self):
+        return float(self._data.get('percent_change_1h') or 0)
+
+    @property
+    def one_day(self):
+        return float(self._data.get('percent_change_24h') or 0)
+
+    @property
+    def one_week(self):
+        return float(self._data.get('percent_change_7d') or 0)
+
+
+def build_dict(coins):
+    by_id = {}
+    by_symbol = {}
+
+    for bcd in coins:
+        bc = DictBlockchain(bcd)
+        by_id[bcd['id']] = bc
+        by_symbol[bcd['symbol'].lower()] = bc
+
+    return by_id
+
+
+def build_store(coins):
+    # Just the store and its id index, a TickerSnapshot also builds the matcher and
+    # rankings, which the dict baseline has no equivalent of.
+    return {bc['id']: bc for bc in TickerStore(coins)}
+
+
+def measure_memory(build, raw):
+    """
+    Peak and retained bytes while building an index from a freshly parsed ticker.
+    """
+    gc.collect()
+    tracemalloc.start()
+    coins = raw()
+    index = build(coins)
+    del coins
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del index
+
+    return current, peak
+
+
+def access(index):
+    total = 0.0
+    for bc in index.values():
+        total += bc.market_cap + bc.one_hour + bc.one_day + bc.one_week
+
+    return total
+
+
+def render(index):
+    return [bc.usd for bc in index.values()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--file', help='A saved limit=0 ticker JSON file')
+    parser.add_argument('--count', type=int, default=1500, help='Synthetic coin count')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    coins = load_ticker(args.file, args.count)
+    print(f'coins: {len(coins)}')
+
+    for name, build in (('dict', build_dict), ('store', build_store)):
+        current, peak = measure_memory(build, lambda: [dict(c) for c in coins])
+        index = build(coins)
+        build_t = min(timeit.repeat(lambda: build(coins), number=1, repeat=5))
+        access_t = min(timeit.repeat(lambda: access(index), number=1, repeat=args.repeat))
+        usd_t = min(timeit.repeat(lambda: render(index), number=1, repeat=args.repeat))
+
+        print(
+            f'{name:<6} retained: {current / 1024:8.1f} KiB  peak: {peak / 1024:8.1f} KiB  '
+            f'build: {build_t * 1000:6.2f} ms  numeric access: {access_t * 1000:6.2f} ms  '
+            f'usd: {usd_t * 1000:6.2f} ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+Local stand ins for the upstream services, coinmarketcap and Slack, so the bot can be
+run and load tested fully offline.
+
+Run both on one port from the :code:`src` directory::
+
+    $ python -m fakes --port 8900 --coins 1500 --latency 0.2
+
+and point the bot at them::
+
+    $ MARKET_API_URL=http://127.0.0.1:8900/v1/ SLACK_API_URL=http://127.0.0.1:8900/api/ \\
+        apistar run
+"""
+from aiohttp import web
+from .market import FakeMarket  # noqa
+from .slack import FakeSlack  # noqa
+
+
+def make_app(market=None, slack=None):
+    """
+    An :code:`aiohttp` app serving :code:`market` under :code:`/v1/` and :code:`slack`
+    under :code:`/api/`, either can be left out.
+    """
+    app = web.Application()
+
+    if market is not None:
+        market.add_routes(app)
+
+    if slack is not None:
+        slack.add_routes(app)
+
+    return app
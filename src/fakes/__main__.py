@@ -0,0 +1,50 @@
+import argparse
+import logging
+from aiohttp import web
+from . import FakeMarket, FakeSlack, make_app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fake coinmarketcap and Slack APIs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--coins', type=int, default=1500, help='Synthetic coin count')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--update-interval', type=float, default=300,
+                        help='Seconds between market updates, 0 never updates')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to answers')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Up to this many more seconds added at random')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Share of market requests failed with a 503')
+    parser.add_argument('--slack-error-rate', type=float, default=0.0,
+                        help='Share of posts failed with a 500')
+    parser.add_argument('--channel-rate', type=float, default=1.0,
+                        help='Posts per second allowed to a channel')
+    parser.add_argument('--channel-burst', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    market = FakeMarket(
+        count=args.coins,
+        seed=args.seed,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        update_interval=args.update_interval,
+    )
+    slack = FakeSlack(
+        channel_rate=args.channel_rate,
+        channel_burst=args.channel_burst,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.slack_error_rate,
+        seed=args.seed,
+    )
+
+    web.run_app(make_app(market, slack), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
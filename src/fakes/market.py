@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from email.utils import formatdate
+from aiohttp import web
+from benchmarks.market import synthetic_ticker, synthetic_global
+
+"""
+Fake coinmarketcap
+******************
+
+The coinmarketcap v1 :code:`ticker/` and :code:`global/` endpoints, serving a
+synthetic market from :code:`benchmarks.market`.
+
+The market moves to a new generation every :code:`update_interval` seconds, each with
+its own prices, :code:`ETag` and :code:`Last-Modified`, so conditional requests get a
+:code:`304 Not Modified` until it does. Latency, jitter and a rate of :code:`503`
+answers can be set to see how the bot copes with a slow or failing upstream.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+# Units of each currency per USD, for the ticker's convert= option.
+FIAT_RATES = {
+    'usd': 1.0, 'eur': 0.85, 'gbp': 0.75, 'jpy': 110.0, 'cny': 6.5, 'krw': 1100.0,
+    'cad': 1.25, 'aud': 1.3, 'inr': 65.0, 'chf': 0.97, 'rub': 58.0,
+}
+
+
+class FakeMarket(object):
+    def __init__(self, count=1500, seed=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 update_interval=300, timer=time.time):
+        """
+        :param count: Coins in the market.
+        :param latency: Seconds added to every answer.
+        :param jitter: Up to this many more seconds, at random, added to every answer.
+        :param error_rate: The share of requests answered with a :code:`503`.
+        :param update_interval: Seconds between market updates, :code:`0` never updates.
+        """
+        self._count = count
+        self._seed = seed
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._update_interval = update_interval
+        self._timer = timer
+        self._started = timer()
+        self._random = random.Random(seed)
+        self._generation = None
+        self._modified = None
+        self._coins = []
+        self._bodies = {}
+        self._requests = 0
+        self._not_modified = 0
+        self._errors = 0
+        self._bytes = 0
+
+    def add_routes(self, app, prefix='/v1'):
+        app.router.add_get(f'{prefix}/ticker/', self.ticker)
+        app.router.add_get(f'{prefix}/global/', self.global_)
+        app.router.add_get(f'{prefix}/_stats', self.stats_view)
+
+    def generation(self):
+        if not self._update_interval:
+            return 0
+
+        return int((self._timer() - self._started) // self._update_interval)
+
+    def _current(self):
+        generation = self.generation()
+
+        if generation != self._generation:
+            now = self._started + generation * self._update_interval
+            self._coins = synthetic_ticker(self._count, self._seed + generation, now)
+            self._modified = formatdate(now, usegmt=True)
+            self._generation = generation
+            self._bodies = {}
+
+        return self._coins
+
+    def _body(self, key, build):
+        """
+        The encoded body and its ETag for :code:`key` in the current generation.
+        """
+        self._current()
+        body = self._bodies.get(key)
+
+        if body is None:
+            data = json.dumps(build(), indent=4).encode('utf-8')
+            etag = '"%s"' % hashlib.sha1(data).hexdigest()
+            body = self._bodies[key] = (data, etag)
+
+        return body
+
+    async def _answer(self, request, key, build):
+        self._requests += 1
+
+        delay = self._latency + self._random.uniform(0, self._jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if self._error_rate and self._random.random() < self._error_rate:
+            self._errors += 1
+            return web.json_response({'error': 'Service Unavailable'}, status=503)
+
+        try:
+            data, etag = self._body(key, build)
+        except KeyError as e:
+            return web.json_response({'error': f'Unknown {e}'}, status=400)
+
+        headers = {
+            'ETag': etag,
+            'Last-Modified': self._modified,
+            'Cache-Control': 'max-age=300',
+        }
+
+        if request.headers.get('If-None-Match') == etag or (
+                'If-None-Match' not in request.headers and
+                request.headers.get('If-Modified-Since') == self._modified):
+            self._not_modified += 1
+            return web.Response(status=304, headers=headers)
+
+        self._bytes += len(data)
+        return web.Response(body=data, content_type='application/json', headers=headers)
+
+    async def ticker(self, request):
+        limit = int(request.query.get('limit', 100))
+        convert = request.query.get('convert', 'usd').lower()
+
+        def build():
+            coins = self._coins[:limit] if limit else self._coins
+            if convert == 'usd':
+                return coins
+
+            rate = FIAT_RATES[convert]
+            return [dict(c, **{f'price_{convert}': '%.6f' % (float(c['price_usd']) * rate)})
+                    for c in coins]
+
+        return await self._answer(request, ('ticker', limit, convert), build)
+
+    async def global_(self, request):
+        return await self._answer(request, ('global',), lambda: synthetic_global(self._coins))
+
+    async def stats_view(self, request):
+        return web.json_response(self.stats())
+
+    def stats(self):
+        return {
+            'generation': self._generation,
+            'coins': self._count,
+            'requests': self._requests,
+            'not_modified': self._not_modified,
+            'errors': self._errors,
+            'bytes': self._bytes,
+        }
@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from collections import deque
+from aiohttp import web
+from slackbot.outbound import TokenBucket
+
+"""
+Fake Slack
+**********
+
+The two Slack Web API methods the bot calls, :code:`oauth.access` and
+:code:`chat.postMessage`.
+
+Any OAuth code is accepted and gives a team and tokens derived from it. Posts are
+rate limited per channel, like Slack's roughly one message per second, and a post over
+the limit gets a :code:`429` with a :code:`Retry-After`. The last posts are kept for
+inspection at :code:`_messages`.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+class FakeSlack(object):
+    def __init__(self, channel_rate=1.0, channel_burst=3, latency=0.0, jitter=0.0,
+                 error_rate=0.0, history=1000, seed=0):
+        """
+        :param channel_rate: Posts per second allowed to a channel.
+        :param channel_burst: Posts a quiet channel can take at once.
+        :param latency: Seconds added to every answer.
+        :param jitter: Up to this many more seconds, at random, added to every answer.
+        :param error_rate: The share of posts answered with a :code:`500`.
+        :param history: Posts kept for :code:`_messages`.
+        """
+        self._channel_rate = channel_rate
+        self._channel_burst = channel_burst
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._random = random.Random(seed)
+        self._buckets = {}
+        self._messages = deque(maxlen=history)
+        self._teams = {}
+        self._posts = 0
+        self._rate_limited = 0
+        self._errors = 0
+        self._auths = 0
+
+    def add_routes(self, app, prefix='/api'):
+        app.router.add_post(f'{prefix}/oauth.access', self.oauth_access)
+        app.router.add_post(f'{prefix}/chat.postMessage', self.chat_post_message)
+        app.router.add_get(f'{prefix}/_messages', self.messages_view)
+        app.router.add_get(f'{prefix}/_stats', self.stats_view)
+
+    async def _delay(self):
+        delay = self._latency + self._random.uniform(0, self._jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _bucket(self, channel):
+        bucket = self._buckets.get(channel)
+
+        if bucket is None:
+            bucket = self._buckets[channel] = TokenBucket(self._channel_rate, self._channel_burst)
+
+        return bucket
+
+    async def oauth_access(self, request):
+        await self._delay()
+        data = await request.post()
+        code = data.get('code')
+
+        if not code or not data.get('client_id'):
+            return web.json_response({'ok': False, 'error': 'invalid_code'})
+
+        self._auths += 1
+        key = hashlib.sha1(code.encode('utf-8')).hexdigest()
+        team_id = f'T{key[:8].upper()}'
+        team = {
+            'ok': True,
+            'access_token': f'xoxp-{key[:24]}',
+            'scope': 'bot,chat:write:bot',
+            'team_name': f'Team {team_id}',
+            'team_id': team_id,
+            'bot': {
+                'bot_user_id': f'U{key[8:16].upper()}',
+                'bot_access_token': f'xoxb-{key[16:40]}',
+            },
+        }
+        self._teams[team['bot']['bot_access_token']] = team_id
+
+        return web.json_response(team)
+
+    async def chat_post_message(self, request):
+        await self._delay()
+
+        auth = request.headers.get('Authorization', '')
+        if not auth.startswith('Bearer '):
+            return web.json_response({'ok': False, 'error': 'not_authed'})
+
+        data = await request.json()
+        channel = data.get('channel')
+        if not channel:
+            return web.json_response({'ok': False, 'error': 'channel_not_found'})
+
+        if not data.get('text'):
+            return web.json_response({'ok': False, 'error': 'no_text'})
+
+        if self._error_rate and self._random.random() < self._error_rate:
+            self._errors += 1
+            return web.json_response({'ok': False, 'error': 'internal_error'}, status=500)
+
+        bucket = self._bucket(channel)
+        wait = bucket.delay()
+        if wait:
+            self._rate_limited += 1
+            return web.json_response(
+                {'ok': False, 'error': 'ratelimited'},
+                status=429,
+                headers={'Retry-After': str(max(1, int(wait + 0.999)))},
+            )
+
+        bucket.take()
+        self._posts += 1
+        ts = '%.6f' % time.time()
+        self._messages.append({
+            'team': self._teams.get(auth[7:]),
+            'channel': channel,
+            'text': data['text'],
+            'ts': ts,
+        })
+
+        return web.json_response({'ok': True, 'channel': channel, 'ts': ts})
+
+    async def messages_view(self, request):
+        return web.json_response(list(self._messages))
+
+    async def stats_view(self, request):
+        return web.json_response(self.stats())
+
+    def stats(self):
+        return {
+            'auths': self._auths,
+            'posts': self._posts,
+            'rate_limited': self._rate_limited,
+            'errors': self._errors,
+            'channels': len(self._buckets),
+        }
@@ -1 +1,3 @@
 from .printer import print_routes, print_settings, print_components  # noqa
+from .singleflight import SingleFlight  # noqa
+from .metrics import registry  # noqa
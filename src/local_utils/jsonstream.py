@@ -0,0 +1,103 @@
+import re
+import json
+
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class JSONArrayDecoder(object):
+    """
+    Incrementally decodes a top level JSON array, handing back each element as soon as
+    it's complete. Only the unparsed tail of the input is kept, so a large array can be
+    processed a chunk at a time in roughly the memory of its largest element.
+
+    ::
+
+        decoder = JSONArrayDecoder()
+        for chunk in chunks:
+            for item in decoder.feed(chunk):
+                ...
+        decoder.close()
+
+    Input that can't be decoded is taken to be an element cut off by the end of the
+    chunk, until more than :code:`max_element` characters of it are waiting. Then it's
+    malformed, or too big to hold, and :code:`feed` raises :code:`ValueError`.
+    """
+    def __init__(self, max_element=1 << 20):
+        self._decoder = json.JSONDecoder()
+        self._max_element = max_element
+        self._buf = ''
+        # What's allowed next: '[', a value or ']', ',' or ']', a value, or nothing.
+        self._expect = 'open'
+        self._count = 0
+
+    @property
+    def count(self):
+        return self._count
+
+    def feed(self, text, final=False):
+        """
+        Add :code:`text` and return the elements it completed.
+        """
+        buf = self._buf + text
+        size = len(buf)
+        pos = 0
+        items = []
+
+        while True:
+            pos = WHITESPACE.match(buf, pos).end()
+            if pos >= size:
+                break
+
+            char = buf[pos]
+            expect = self._expect
+
+            if expect == 'open':
+                if char != '[':
+                    raise ValueError(f'Expected a JSON array, got {char!r}')
+                self._expect = 'first'
+                pos += 1
+            elif expect in ('first', 'next') and char == ']':
+                self._expect = 'done'
+                pos += 1
+            elif expect == 'next':
+                if char != ',':
+                    raise ValueError(f'Expected , or ] in JSON array, got {char!r}')
+                self._expect = 'value'
+                pos += 1
+            elif expect in ('first', 'value'):
+                try:
+                    item, end = self._decoder.raw_decode(buf, pos)
+                except ValueError:
+                    # Most likely cut off by the end of the chunk, wait for more.
+                    break
+
+                if end >= size and not final:
+                    # A number at the very end may still have digits to come.
+                    break
+
+                items.append(item)
+                self._count += 1
+                self._expect = 'next'
+                pos = end
+            else:
+                raise ValueError(f'Unexpected {char!r} after the JSON array')
+
+        self._buf = buf[pos:]
+
+        if len(self._buf) > self._max_element:
+            raise ValueError(f'JSON array element over {self._max_element} characters')
+
+        return items
+
+    def close(self, text=''):
+        """
+        Finish decoding, returns the last elements. Raises :code:`ValueError` if the
+        array isn't complete.
+        """
+        items = self.feed(text, final=True)
+
+        if self._expect != 'done' or self._buf.strip():
+            raise ValueError('Truncated JSON array')
+
+        return items
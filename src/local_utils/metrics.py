@@ -0,0 +1,266 @@
+import time
+import bisect
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Timer(object):
+    __slots__ = ('_child', '_start')
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class _Count(object):
+    """
+    A single counter sample, one per combination of label values.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labelnames, labels):
+        yield f'{name}{_format_labels(labelnames, labels)} {_format_value(self.value)}'
+
+
+class _Reading(object):
+    """
+    A counter sample read from a count some component already keeps, when rendered.
+    """
+    __slots__ = ('_read',)
+
+    def __init__(self, read):
+        self._read = read
+
+    def samples(self, name, labelnames, labels):
+        yield f'{name}{_format_labels(labelnames, labels)} {_format_value(self._read())}'
+
+
+class _Value(_Count):
+    """
+    A single gauge sample, one per combination of label values.
+    """
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _Buckets(object):
+    """
+    Histogram sample. Observations are counted in their own bucket and only made
+    cumulative when rendered, so :code:`observe` is a bisect and two additions.
+    """
+    __slots__ = ('_bounds', '_counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        """
+        Context manager observing the seconds spent in its block.
+        """
+        return _Timer(self)
+
+    def samples(self, name, labelnames, labels):
+        total = 0
+
+        for bound, count in zip(self._bounds + (float('inf'),), self._counts):
+            total += count
+            le = 'le="%s"' % _format_value(float(bound))
+            yield f'{name}_bucket{_format_labels(labelnames, labels, le)} {total}'
+
+        yield f'{name}_sum{_format_labels(labelnames, labels)} {_format_value(self.sum)}'
+        yield f'{name}_count{_format_labels(labelnames, labels)} {self.count}'
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help='', labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._children = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _check(self, values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {values}')
+
+    def labels(self, *values):
+        """
+        The sample for these label values, in the order the label names were given.
+        Look it up once and keep it where it's used on a hot path.
+        """
+        child = self._children.get(values)
+
+        if child is None:
+            self._check(values)
+            child = self._children[values] = self._new_child()
+
+        return child
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+
+        for values, child in sorted(self._children.items()):
+            yield from child.samples(self.name, self.labelnames, values)
+
+
+class Counter(Metric):
+    """
+    A value that only goes up. Counts a component already keeps in its own
+    :code:`stats()` are read with :code:`read_from` rather than copied in.
+    """
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Count()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def read_from(self, read, *values):
+        """
+        Render the sample for these label values as :code:`read()`, replacing any
+        reader registered for them before.
+        """
+        self._check(values)
+        self._children[values] = _Reading(read)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help='', labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class Registry(object):
+    """
+    The metrics of a process and the collectors that fill in the ones read from
+    elsewhere, like pool sizes, just before rendering.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _get_or_create(self, cls, name, help, labels, **kwargs):
+        metric = self._metrics.get(name)
+
+        if metric is None:
+            metric = self._metrics[name] = cls(name, help, labels, **kwargs)
+        elif not isinstance(metric, cls) or metric.labelnames != tuple(labels):
+            raise ValueError(
+                f'Metric {name} already registered as {metric.kind} {metric.labelnames}')
+
+        return metric
+
+    def counter(self, name, help='', labels=()):
+        return self._get_or_create(Counter, name, help, labels)
+
+    def gauge(self, name, help='', labels=()):
+        return self._get_or_create(Gauge, name, help, labels)
+
+    def histogram(self, name, help='', labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help, labels, buckets=buckets)
+
+    def collector(self, func):
+        """
+        Register :code:`func()` to be called before every render, to update metrics
+        from state that's cheaper to read on demand than to track as it changes.
+        """
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        for func in self._collectors:
+            try:
+                func()
+            except Exception as e:
+                logger.error("Metrics collector %s error: %s", func, e)
+
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
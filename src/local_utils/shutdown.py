@@ -0,0 +1,40 @@
+import atexit
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+_hooks = []
+
+
+def on_shutdown(func, loop=None):
+    """
+    Register a coroutine function to be run on :code:`loop`, by default the current event
+    loop, at shutdown. For instance to drain a queue or close a connection pool.
+
+    API Star doesn't give us a shutdown hook, so this is best effort: the hooks are run
+    at interpreter exit if the loop that was serving requests is still usable. Hooks run
+    in the order they were registered, so work queues registered as they start are
+    drained before anything they might depend on is closed.
+    """
+    if not _hooks:
+        atexit.register(run_shutdown_hooks)
+
+    _hooks.append((func, loop or asyncio.get_event_loop()))
+    return func
+
+
+def run_shutdown_hooks():
+    while _hooks:
+        func, loop = _hooks.pop(0)
+
+        if loop.is_closed() or loop.is_running():
+            logger.debug("Shutdown hook %s skipped, its loop is closed or still running", func)
+            continue
+
+        try:
+            loop.run_until_complete(func())
+        except Exception as e:
+            logger.error("Shutdown hook %s error: %s", func, e)
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls for the same key into a single in flight call.
+
+    The first caller for a key starts the work and every caller that arrives while
+    it is still running waits on, and shares, that same result. Exceptions are shared
+    in the same way, so a failed upstream fetch fails all of its waiters once instead
+    of being retried by each of them.
+
+    ::
+
+        flight = SingleFlight()
+        data = await flight.do('coin_ticker', fetch_ticker)
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._waiters = {}
+        self._calls = 0
+        self._coalesced = 0
+
+    async def do(self, key, func, *args, **kwargs):
+        """
+        Run :code:`func(*args, **kwargs)` for :code:`key` unless a call for the same key
+        is already in flight, in which case wait for that call's result instead.
+        """
+        self._calls += 1
+        fut = self._inflight.get(key)
+
+        if fut is None:
+            fut = asyncio.ensure_future(func(*args, **kwargs))
+            self._inflight[key] = fut
+            self._waiters[key] = 0
+            fut.add_done_callback(lambda f: self._forget(key, f))
+        else:
+            self._coalesced += 1
+            self._waiters[key] += 1
+
+        # Shield the shared future so one cancelled waiter doesn't cancel it for the rest.
+        return await asyncio.shield(fut)
+
+    def _forget(self, key, fut):
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+            waiters = self._waiters.pop(key, 0)
+
+            if waiters:
+                logger.info(
+                    "SingleFlight %s coalesced %s callers, total coalesced: %s",
+                    key, waiters, self._coalesced
+                )
+
+        # Mark the exception as retrieved, if every waiter was cancelled nobody else will.
+        if not fut.cancelled():
+            fut.exception()
+
+    def inflight(self, key):
+        return key in self._inflight
+
+    @property
+    def calls(self):
+        return self._calls
+
+    @property
+    def coalesced(self):
+        return self._coalesced
+
+    def stats(self):
+        return {
+            'calls': self._calls,
+            'coalesced': self._coalesced,
+            'inflight': len(self._inflight),
+        }
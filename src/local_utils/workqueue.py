@@ -0,0 +1,143 @@
+import time
+import asyncio
+import logging
+from .shutdown import on_shutdown
+from .metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+WAIT_SECONDS = registry.histogram(
+    'workqueue_wait_seconds', 'Seconds calls waited in a work queue for a worker.', ('queue',))
+RUN_SECONDS = registry.histogram(
+    'workqueue_run_seconds', 'Seconds calls from a work queue took to run.', ('queue',))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WorkQueue(object):
+    """
+    A bounded, in process queue of coroutine calls run by a fixed pool of workers.
+
+    :code:`submit` never waits: it queues the call and returns, or raises :code:`QueueFull`
+    when :code:`maxsize` calls are already waiting so the caller can push back. Like the
+    other background work in this app the queue and its workers are created lazily on
+    the loop that's serving requests, see the README. Pending work is drained at
+    shutdown.
+    """
+    def __init__(self, concurrency=8, maxsize=256, name='work', drain_timeout=10):
+        self._concurrency = max(concurrency, 1)
+        self._maxsize = maxsize
+        self._name = name
+        self._drain_timeout = drain_timeout
+        self._loop = None
+        self._queue = None
+        self._workers = []
+        self._submitted = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+        self._run_max = 0.0
+        self._wait_seconds = WAIT_SECONDS.labels(name)
+        self._run_seconds = RUN_SECONDS.labels(name)
+        self._shutdown_hooked = False
+
+    def _ensure_started(self):
+        loop = asyncio.get_event_loop()
+
+        if self._queue is not None and self._loop is loop:
+            return
+
+        logger.debug("WorkQueue %s starting %s workers", self._name, self._concurrency)
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self._maxsize)
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self._concurrency)]
+
+        if not self._shutdown_hooked:
+            on_shutdown(self.drain)
+            self._shutdown_hooked = True
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue :code:`func(*args, **kwargs)`, a coroutine function, to be run by a worker.
+        """
+        self._ensure_started()
+
+        try:
+            self._queue.put_nowait((func, args, kwargs, time.monotonic()))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            logger.warning("WorkQueue %s full, rejected %s", self._name, func)
+            raise QueueFull(f'{self._name} queue is full')
+
+        self._submitted += 1
+
+    async def _worker(self):
+        while True:
+            func, args, kwargs, queued = await self._queue.get()
+            start = time.monotonic()
+            self._wait_total += start - queued
+            self._wait_seconds.observe(start - queued)
+
+            try:
+                await func(*args, **kwargs)
+                self._processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed += 1
+                logger.error("WorkQueue %s %s error: %s", self._name, func, e)
+            finally:
+                elapsed = time.monotonic() - start
+                self._run_total += elapsed
+                self._run_max = max(self._run_max, elapsed)
+                self._run_seconds.observe(elapsed)
+                self._queue.task_done()
+
+    async def drain(self, timeout=None):
+        """
+        Wait, up to :code:`timeout` seconds, for the queued work to finish and then
+        stop the workers.
+        """
+        if self._queue is None:
+            return
+
+        timeout = self._drain_timeout if timeout is None else timeout
+        logger.debug("WorkQueue %s draining %s", self._name, self._queue.qsize())
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                "WorkQueue %s drain timed out, %s left", self._name, self._queue.qsize())
+
+        for worker in self._workers:
+            worker.cancel()
+
+        self._workers = []
+        self._queue = None
+        self._loop = None
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        done = self._processed + self._failed
+
+        return {
+            'depth': self.depth,
+            'maxsize': self._maxsize,
+            'concurrency': self._concurrency,
+            'submitted': self._submitted,
+            'processed': self._processed,
+            'failed': self._failed,
+            'rejected': self._rejected,
+            'wait_avg': self._wait_total / done if done else 0.0,
+            'latency_avg': self._run_total / done if done else 0.0,
+            'latency_max': self._run_max,
+        }
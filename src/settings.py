@@ -30,6 +30,12 @@ class Env(environment.Environment):
         'SLACK_API_SCOPE': typesystem.string(default=''),
         'SLACK_BOT_NAME': typesystem.string(default=''),
         'SLACK_BOT_OAUTH_REDIR': typesystem.string(default=''),
+        'WORKER_CONCURRENCY': typesystem.integer(default=8),
+        'WORKER_QUEUE_SIZE': typesystem.integer(default=256),
+        'FIAT_CURRENCIES': typesystem.string(default='eur,gbp,jpy,cny,krw,cad,aud,inr'),
+        # Point these at the fakes, see src/fakes, to run without the real services.
+        'MARKET_API_URL': typesystem.string(default='https://api.coinmarketcap.com/v1/'),
+        'SLACK_API_URL': typesystem.string(default='https://slack.com/api/'),
     }
 
 
@@ -57,6 +63,40 @@ settings = {
         'API_SCOPE': env['SLACK_API_SCOPE'],
         'BOT_NAME': env['SLACK_BOT_NAME'],
         'BOT_OAUTH_REDIR': env['SLACK_BOT_OAUTH_REDIR'],
+        'API_URL': env['SLACK_API_URL'],
+    },
+    'WORKERS': {
+        'CONCURRENCY': env['WORKER_CONCURRENCY'],
+        'QUEUE_SIZE': env['WORKER_QUEUE_SIZE'],
+        'DRAIN_TIMEOUT': 10,
+    },
+    'MARKET': {
+        'API_URL': env['MARKET_API_URL'],
+        # Fiat currencies prices can be quoted in, their rates are fetched each refresh.
+        'FIAT': [c.strip() for c in env['FIAT_CURRENCIES'].split(',') if c.strip()],
+    },
+    # Slack allows about one message per second per channel.
+    'OUTBOUND': {
+        'CHANNEL_RATE': 1.0,
+        'TEAM_RATE': 5.0,
+        'TEAM_BURST': 10,
+        'COALESCE_WINDOW': 0.25,
+    },
+    # The shared aiohttp connector used for coinmarketcap and Slack.
+    'HTTP_CLIENT': {
+        'LIMIT': 100,
+        'LIMIT_PER_HOST': 20,
+        'DNS_CACHE_TTL': 300,
+        'KEEPALIVE_TIMEOUT': 30,
+        'TIMEOUT': 30,
+        # Seconds for a whole call, retries included.
+        'DEADLINE': 10,
+        'RETRIES': 2,
+        'BACKOFF_BASE': 0.1,
+        'BACKOFF_MAX': 2.0,
+        'HEDGE_PERCENTILE': 0.95,
+        'BREAKER_FAILURES': 5,
+        'BREAKER_RESET': 30,
     },
     'TEMPLATES': {
         'ROOT_DIR': ['index/templates', 'slackbot/templates'],
@@ -0,0 +1,338 @@
+import asyncio
+import bisect
+import logging
+from collections import defaultdict
+from local_utils.shutdown import on_shutdown
+
+"""
+Price Alerts
+************
+
+Price alert subscriptions, "tell me when ETH goes above $3000", stored per team and
+channel in the :code:`alert` table.
+
+Every process keeps an :code:`AlertBook` of the active alerts indexed by coin, with the
+thresholds of each direction kept sorted. When a new ticker snapshot arrives the alerts
+a coin crossed are found with two bisects, so the cost is O(log n + k) per coin that has
+alerts rather than a scan of every subscription.
+
+Alerts are one shot. The process that deletes a triggered alert from the database is the
+one that posts it, so with several workers each alert is still only posted once.
+
+Each process publishes the ids of the alerts it creates or deletes on a Redis channel
+once they're committed, the way :code:`TeamCache` invalidates teams, and every process
+applies them to its book before the next evaluation, reading only the new rows. The
+whole table is read just at startup and after the listener reconnects, when changes
+may have been missed. An alert's threshold must not already be crossed when it's set,
+it could never fire.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+ABOVE = 'above'
+BELOW = 'below'
+INF = float('inf')
+
+
+def already_crossed(direction, threshold, price):
+    """
+    True if :code:`price` is already past :code:`threshold`, an alert set there would
+    never fire.
+    """
+    if direction == ABOVE:
+        return price >= threshold
+
+    return price <= threshold
+
+
+class Alert(object):
+    __slots__ = ('id', 'team_id', 'channel_id', 'user_id', 'coin_id', 'direction', 'threshold')
+
+    def __init__(self, id, team_id, channel_id, user_id, coin_id, direction, threshold):
+        self.id = id
+        self.team_id = team_id
+        self.channel_id = channel_id
+        self.user_id = user_id
+        self.coin_id = coin_id
+        self.direction = direction
+        self.threshold = float(threshold)
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(*(record[k] for k in cls.__slots__))
+
+    def slack_str(self, symbol=None):
+        return f'*{symbol or self.coin_id}* {self.direction} *${self.threshold:2.2f}*'
+
+    def __repr__(self):
+        return f'<Alert {self.id} {self.coin_id} {self.direction} {self.threshold}>'
+
+
+class AlertBook(object):
+    def __init__(self):
+        # coin id -> sorted [(threshold, alert id)] for each direction
+        self._above = defaultdict(list)
+        self._below = defaultdict(list)
+        self._alerts = {}
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def __contains__(self, alert_id):
+        return alert_id in self._alerts
+
+    def add(self, alert):
+        if alert.id in self._alerts:
+            return
+
+        side = self._above if alert.direction == ABOVE else self._below
+        bisect.insort(side[alert.coin_id], (alert.threshold, alert.id))
+        self._alerts[alert.id] = alert
+
+    def remove(self, alert_id):
+        alert = self._alerts.pop(alert_id, None)
+
+        if alert is None:
+            return None
+
+        side = self._above if alert.direction == ABOVE else self._below
+        entries = side[alert.coin_id]
+        i = bisect.bisect_left(entries, (alert.threshold, alert.id))
+
+        if i < len(entries) and entries[i][1] == alert.id:
+            del entries[i]
+
+        if not entries:
+            del side[alert.coin_id]
+
+        return alert
+
+    def crossed(self, coin_id, old, new):
+        """
+        Remove and return the alerts for :code:`coin_id` whose threshold the price crossed
+        moving from :code:`old` to :code:`new`.
+        """
+        if new > old:
+            entries = self._above.get(coin_id, ())
+            # old < threshold <= new
+            lo = bisect.bisect_right(entries, (old, INF))
+            hi = bisect.bisect_right(entries, (new, INF))
+        elif new < old:
+            entries = self._below.get(coin_id, ())
+            # new <= threshold < old
+            lo = bisect.bisect_left(entries, (new, -INF))
+            hi = bisect.bisect_left(entries, (old, -INF))
+        else:
+            return []
+
+        return [self.remove(alert_id) for _, alert_id in entries[lo:hi]]
+
+    def ids(self):
+        return set(self._alerts)
+
+    def coins(self):
+        return set(self._above) | set(self._below)
+
+    def evaluate(self, old, new):
+        """
+        All alerts triggered going from ticker snapshot :code:`old` to :code:`new`.
+        Only coins with alerts and a price in both snapshots are looked at.
+        """
+        triggered = []
+
+        for coin_id in self.coins():
+            before = old.by_id.get(coin_id)
+            after = new.by_id.get(coin_id)
+
+            if before is None or after is None:
+                continue
+
+            triggered += self.crossed(coin_id, before.price, after.price)
+
+        return triggered
+
+
+class AlertStore(object):
+    """
+    Database access for alerts and the process local :code:`AlertBook` kept in sync with it.
+    """
+    COLUMNS = ', '.join(Alert.__slots__)
+    CHANNEL = 'alert_changes'
+
+    def __init__(self, asyncpg, redis, retry_interval=5):
+        self._asyncpg = asyncpg
+        self._redis = redis
+        self._book = AlertBook()
+        self._retry_interval = retry_interval
+        # Set until the book has been loaded from the whole table while listening.
+        self._reload = True
+        self._added = set()
+        self._removed = set()
+        self._loop = None
+        self._task = None
+        self._shutdown_hooked = False
+
+    @property
+    def book(self):
+        return self._book
+
+    async def sync(self):
+        """
+        Bring the book up to date: apply the alerts created and deleted, by this or any
+        other process, since the last sync. Runs once per ticker snapshot, not per event.
+        """
+        self._ensure_listening()
+
+        if self._reload:
+            self._reload = False
+            await self._load_all()
+
+        # Changes published while we were reading are applied too, a delete still
+        # wins over the row it deleted.
+        added, self._added = self._added, set()
+        removed, self._removed = self._removed, set()
+        added -= removed
+
+        for alert_id in removed:
+            self._book.remove(alert_id)
+
+        added = [alert_id for alert_id in added if alert_id not in self._book]
+        if added:
+            rows = await self._asyncpg.fetch(
+                f"SELECT {self.COLUMNS} FROM alert WHERE id = ANY($1::bigint[])", added)
+
+            for row in rows:
+                if row['id'] not in self._removed:
+                    self._book.add(Alert.from_record(row))
+
+        if added or removed:
+            logger.debug(
+                "AlertStore synced, %s added, %s removed, %s active",
+                len(added), len(removed), len(self._book))
+
+        return self._book
+
+    async def _load_all(self):
+        """
+        Reconcile the book with the whole table, for when changes may have been missed.
+        """
+        try:
+            rows = await self._asyncpg.fetch(f"SELECT {self.COLUMNS} FROM alert")
+        except Exception:
+            self._reload = True
+            raise
+
+        current = set()
+        for row in rows:
+            current.add(row['id'])
+            if row['id'] not in self._book:
+                self._book.add(Alert.from_record(row))
+
+        for alert_id in self._book.ids() - current:
+            self._book.remove(alert_id)
+
+        logger.debug("AlertStore loaded %s active", len(self._book))
+
+    async def _publish(self, sign, ids):
+        if not ids:
+            return
+
+        try:
+            await self._redis.publish(self.CHANNEL, sign + ','.join(str(i) for i in ids))
+        except Exception as e:
+            logger.error("AlertStore publish error: %s", e)
+
+    def _apply(self, message):
+        """
+        Note a published change, '+' or '-' and a comma separated list of alert ids.
+        """
+        ids = {int(i) for i in message[1:].split(',') if i}
+        (self._added if message[0] == '+' else self._removed).update(ids)
+
+    def _ensure_listening(self):
+        loop = asyncio.get_event_loop()
+
+        if self._task and not self._task.done() and self._loop is loop:
+            return
+
+        self._loop = loop
+        self._task = asyncio.ensure_future(self._listen())
+
+        if not self._shutdown_hooked:
+            on_shutdown(self.close)
+            self._shutdown_hooked = True
+
+    async def _listen(self):
+        while True:
+            conn = None
+
+            try:
+                conn, (channel,) = await self._redis.subscribe(self.CHANNEL)
+                logger.debug("AlertStore listening on %s", self.CHANNEL)
+                # Changes made before we were listening were missed, read everything.
+                self._reload = True
+
+                while await channel.wait_message():
+                    self._apply(await channel.get(encoding='utf-8'))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("AlertStore listener error: %s", e)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+            self._reload = True
+            await asyncio.sleep(self._retry_interval)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait([self._task])
+
+        self._task = None
+        self._loop = None
+
+    async def create(self, team_id, channel_id, user_id, coin_id, direction, threshold):
+        rows = await self._asyncpg.fetch(
+            """INSERT INTO alert
+                (team_id, channel_id, user_id, coin_id, direction, threshold)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                RETURNING id
+            """,
+            team_id, channel_id, user_id, coin_id, direction, threshold)
+
+        alert = Alert(rows[0]['id'], team_id, channel_id, user_id, coin_id, direction, threshold)
+        self._book.add(alert)
+        await self._publish('+', [alert.id])
+
+        return alert
+
+    async def claim(self, alert):
+        """
+        Delete a triggered alert, True only for the one process that actually deleted it.
+        """
+        rows = await self._asyncpg.fetch("DELETE FROM alert WHERE id = $1 RETURNING id", alert.id)
+        await self._publish('-', [row['id'] for row in rows])
+
+        return bool(rows)
+
+    async def for_channel(self, team_id, channel_id):
+        rows = await self._asyncpg.fetch(
+            f"SELECT {self.COLUMNS} FROM alert WHERE team_id = $1 AND channel_id = $2 ORDER BY id",
+            team_id, channel_id)
+
+        return [Alert.from_record(row) for row in rows]
+
+    async def clear_channel(self, team_id, channel_id):
+        rows = await self._asyncpg.fetch(
+            "DELETE FROM alert WHERE team_id = $1 AND channel_id = $2 RETURNING id",
+            team_id, channel_id)
+
+        for row in rows:
+            self._book.remove(row['id'])
+        await self._publish('-', [row['id'] for row in rows])
+
+        return len(rows)
@@ -4,11 +4,18 @@ from asyncpg import Connection
 from apistar import http, Route, Settings, Response, render_template, annotate
 from apistar.renderers import HTMLRenderer
 from settings import settings
+from local_utils.workqueue import QueueFull
+from local_utils.metrics import registry, CONTENT_TYPE
 from .component import CryptoBot
+from .metrics import STAGE_SECONDS
 
 
 logger = logging.getLogger(__name__)
 
+LISTENING_SECONDS = STAGE_SECONDS.labels('listening')
+EVENTS = registry.counter(
+    'slackbot_events_total', 'Requests to the Slack event endpoint by outcome.', ('result',))
+
 
 @annotate(renderers=[HTMLRenderer()])
 async def install(crypto_bot: CryptoBot, request: http.Request):
@@ -32,10 +39,14 @@ async def listening(slack_event: http.RequestData, crypto_bot: CryptoBot, settin
     The Slack API event handler.
     Also handles the Slack challenge request.
     """
-    print("SLACK EVENT listening: %s" % pformat(slack_event))
-    slack_event = slack_event or {}
-    logger.debug("SLACK EVENT listening: %s", pformat(slack_event))
-    logger.debug("SLACK EVENT api: %s", crypto_bot)
+    with LISTENING_SECONDS.time():
+        return await handle_event(slack_event or {}, crypto_bot, settings)
+
+
+async def handle_event(slack_event, crypto_bot, settings):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("SLACK EVENT listening: %s", pformat(slack_event))
+        logger.debug("SLACK EVENT api: %s", crypto_bot)
 
     # ============= Slack URL Verification ============ #
     # In order to verify the url of our endpoint, Slack will send a challenge
@@ -43,6 +54,7 @@ async def listening(slack_event: http.RequestData, crypto_bot: CryptoBot, settin
     # sends back.
     #       For more info: https://api.slack.com/events/url_verification
     if "challenge" in slack_event:
+        EVENTS.labels('challenge').inc()
         return {'challenge': slack_event['challenge']}
 
     # ============ Slack Token Verification =========== #
@@ -56,6 +68,7 @@ async def listening(slack_event: http.RequestData, crypto_bot: CryptoBot, settin
         if settings.get('DEBUG'):
             headers['X-Slack-No-Retry'] = '1'
 
+        EVENTS.labels('forbidden').inc()
         return Response(
             'Invalid Slack verification token',
             status=403,
@@ -63,10 +76,31 @@ async def listening(slack_event: http.RequestData, crypto_bot: CryptoBot, settin
         )
 
     # ====== Process Incoming Events from Slack ======= #
-    # If the incoming request is an Event we've subcribed to
+    # If the incoming request is an Event we've subcribed to, queue it and ack right
+    # away. Slack expects an answer within 3 seconds and retries when it doesn't get one.
     if "event" in slack_event:
-        return await crypto_bot.dispatch_event(slack_event)
-        #  event_type = slack_event["event"]["type"]
+        # Messages that aren't one of our commands are dropped before any I/O.
+        command = crypto_bot.route(slack_event)
+        if command is None:
+            EVENTS.labels('unmatched').inc()
+            return {'message': 'Ignored'}
+
+        # Slack retries events it thinks we missed, drop the ones already accepted.
+        if await crypto_bot.is_duplicate(slack_event):
+            logger.debug("SLACK EVENT duplicate: %s", slack_event.get('event_id'))
+            EVENTS.labels('duplicate').inc()
+            return {'message': 'Duplicate'}
+
+        try:
+            crypto_bot.enqueue_event(slack_event, command)
+        except QueueFull:
+            # Too busy, let Slack retry later, and don't take the retry for a duplicate.
+            await crypto_bot.forget_event(slack_event)
+            EVENTS.labels('busy').inc()
+            return Response('Busy, try again later', status=503)
+
+        EVENTS.labels('queued').inc()
+        return {'message': 'Queued'}
 
     # If our bot hears things that are not events we've subscribed to,
     # send a quirky but helpful error response
@@ -74,6 +108,7 @@ async def listening(slack_event: http.RequestData, crypto_bot: CryptoBot, settin
     if settings.get('DEBUG'):
         headers['X-Slack-No-Retry'] = '1'
 
+    EVENTS.labels('ignored').inc()
     return Response(
         "[NO EVENT IN SLACK REQUEST] These are not the droids you're looking for.",
         status=404,
@@ -103,6 +138,14 @@ async def thanks(code: str, state: str, crypto_bot: CryptoBot, request: http.Req
     return render_template("thanks.html", team_name=team_name)
 
 
+async def metrics(crypto_bot: CryptoBot):
+    """
+    Process metrics in the Prometheus text format. The bot is injected so its
+    collectors are registered even if no event has come in yet.
+    """
+    return Response(registry.render().encode('utf-8'), content_type=CONTENT_TYPE)
+
+
 async def dbtest(self, connection: Connection, crypto_bot: CryptoBot,):
     """
     Used only for a quick dbtest with the browser.
@@ -132,6 +175,7 @@ routes = [
     Route('/', 'GET', install),
     Route('/listening', 'POST', listening),
     Route('/thanks', 'GET', thanks),
+    Route('/metrics', 'GET', metrics),
 ]
 
 if settings.get('DEBUG'):
@@ -0,0 +1,180 @@
+import re
+import string
+import logging
+from .history import parse_window
+from .convert import TARGET_WORDS
+
+"""
+Bot Commands
+************
+
+Messages are tokenized once, when the event comes in, and routed on their command verb
+through a table built when the :code:`CryptoBot` is created. A message without a known
+verb is rejected right there, before the event is deduplicated or queued, so chatter in
+a channel never costs a Redis, Postgres or HTTP round trip.
+
+A routed message is handed to its handler as a :code:`Command` with the arguments
+already picked out: amounts like *$3,000.50*, a window like *6h*, fiat currencies and
+the remaining words, the candidates for coin names.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+# Fiat currencies coinmarketcap can convert prices to.
+CURRENCIES = frozenset((
+    'usd', 'aud', 'brl', 'cad', 'chf', 'clp', 'cny', 'czk', 'dkk', 'eur', 'gbp', 'hkd',
+    'huf', 'idr', 'ils', 'inr', 'jpy', 'krw', 'mxn', 'myr', 'nok', 'nzd', 'php', 'pkr',
+    'pln', 'rub', 'sek', 'sgd', 'thb', 'try', 'twd', 'zar',
+))
+# Currency codes that are also everyday words, "i try", they only count right after
+# a target word, "price btc in try".
+AMBIGUOUS_CURRENCIES = frozenset(('try', 'php'))
+
+AMOUNT_RE = re.compile(r'^\$?(\d[\d,]*(?:\.\d+)?|\.\d+)[.,!?]*$')
+STRIP_PUNCTUATION = str.maketrans('', '', string.punctuation)
+
+
+def is_currency(word, target=False):
+    """
+    True if :code:`word` names a fiat currency, :code:`target` if it follows "to" or "in".
+    """
+    return word in CURRENCIES and (target or word not in AMBIGUOUS_CURRENCIES)
+
+
+class Route(object):
+    __slots__ = ('name', 'verbs', 'handler', 'order', 'strict')
+
+    def __init__(self, name, verbs, handler, order, strict=frozenset()):
+        self.name = name
+        self.verbs = verbs
+        self.handler = handler
+        self.order = order
+        self.strict = strict
+
+    def __repr__(self):
+        return f'<Route {self.name} {self.verbs}>'
+
+
+class Command(object):
+    """
+    A tokenized message routed to a command.
+    """
+    __slots__ = ('route', 'verb', 'text', 'words', 'amounts', 'window', 'window_label',
+                 'currencies')
+
+    def __init__(self, route, verb, text, words, amounts, window=None, window_label=None,
+                 currencies=()):
+        self.route = route
+        self.verb = verb
+        self.text = text
+        self.words = words
+        self.amounts = amounts
+        self.window = window
+        self.window_label = window_label
+        self.currencies = currencies
+
+    @property
+    def symbols(self):
+        """
+        The words that could name a coin: everything but command verbs, the window and
+        currencies.
+        """
+        skip = self.route.verbs
+        return [
+            w for w in self.words
+            if w not in skip and w != self.window_label and w not in self.currencies
+        ]
+
+    def __contains__(self, word):
+        return word in self.words
+
+    def __repr__(self):
+        return f'<Command {self.verb} {self.words} {self.amounts}>'
+
+
+class CommandRouter(object):
+    def __init__(self):
+        self._table = {}
+        self._routes = []
+
+    def add(self, name, verbs, handler, strict=()):
+        """
+        Route messages containing any of :code:`verbs` to :code:`handler`. When a message
+        has the verbs of several routes the route added first wins.
+
+        :param strict: Verbs that are also everyday words, 'top', they only count as the
+            first word of a message or when followed by an amount or window, 'top 10'.
+        """
+        route = Route(name, frozenset(verbs), handler, len(self._routes), frozenset(strict))
+
+        for verb in route.verbs:
+            if verb in self._table:
+                raise ValueError(f'Verb {verb} already routed to {self._table[verb]}')
+
+            self._table[verb] = route
+
+        self._routes.append(route)
+        return route
+
+    @property
+    def routes(self):
+        return list(self._routes)
+
+    @staticmethod
+    def _qualified(parts, words, i):
+        """
+        True if the word at :code:`i` is an amount or a window.
+        """
+        return i < len(parts) and bool(AMOUNT_RE.match(parts[i]) or parse_window(words[i]))
+
+    def parse(self, text):
+        """
+        The :code:`Command` for :code:`text`, :code:`None` if it has no known verb.
+        """
+        parts = text.lower().split()
+        words = [p.translate(STRIP_PUNCTUATION) for p in parts]
+
+        route = verb = None
+        for i, word in enumerate(words):
+            found = self._table.get(word)
+            if found is None or (route is not None and found.order >= route.order):
+                continue
+
+            if i and word in found.strict and not self._qualified(parts, words, i + 1):
+                continue
+
+            route, verb = found, word
+
+        if route is None:
+            return None
+
+        kept = []
+        amounts = []
+        window = window_label = None
+        currencies = []
+        previous = None
+
+        for part, word in zip(parts, words):
+            m = AMOUNT_RE.match(part)
+            if m:
+                amounts.append(float(m.group(1).replace(',', '')))
+                continue
+
+            if not word:
+                continue
+
+            if window is None:
+                window = parse_window(word)
+                if window:
+                    window_label = word
+
+            if is_currency(word, previous in TARGET_WORDS):
+                currencies.append(word)
+
+            kept.append(word)
+            previous = word
+
+        return Command(
+            route, verb, text, kept, amounts, window, window_label, tuple(currencies))
@@ -1,11 +1,21 @@
-import string
+import asyncio
 from pprint import pformat
 import json
 from apistar import Component, Settings, Response, reverse_url
 from backends.redis import Redis
 from backends.asyncpg import AsyncPgBackend
 from aioclient.client import Client
+from local_utils.workqueue import WorkQueue
+from local_utils.metrics import registry
 from .crypto import CryptoWorld
+from .rankings import ranking_field, format_top, format_movers
+from .alerts import AlertStore, already_crossed, ABOVE, BELOW
+from .dedup import EventDeduper
+from .teams import TeamCache
+from .commands import CommandRouter, is_currency
+from .convert import UnknownRate, split_target, format_amount, format_quote
+from .outbound import SlackDispatcher
+from .metrics import STAGE_SECONDS, UPSTREAM_ERRORS, CACHE_HITS, CACHE_MISSES
 import logging
 
 """
@@ -16,6 +26,40 @@ Slackbot Component
 
 logger = logging.getLogger(__name__)
 
+CACHE_EVICTIONS = registry.counter('cache_evictions_total', 'Cache evictions.', ('cache',))
+CACHE_SIZE = registry.gauge('cache_size', 'Entries held in a cache.', ('cache',))
+FLIGHT_CALLS = registry.counter(
+    'singleflight_calls_total', 'Calls through a SingleFlight.', ('flight',))
+FLIGHT_COALESCED = registry.counter(
+    'singleflight_coalesced_total', 'Calls that shared another call in flight.', ('flight',))
+QUEUE_DEPTH = registry.gauge('workqueue_depth', 'Calls waiting in a work queue.', ('queue',))
+QUEUE_DONE = registry.counter(
+    'workqueue_calls_total', 'Work queue calls by outcome.', ('queue', 'result'))
+DEDUP_SUPPRESSED = registry.counter(
+    'slackbot_duplicate_events_total', 'Slack event retries dropped.', ('where',))
+OUTBOUND = registry.counter(
+    'slack_outbound_total', 'Outbound Slack messages and posts.', ('kind',))
+OUTBOUND_WAIT = registry.gauge(
+    'slack_outbound_wait_seconds', 'Seconds outbound messages waited to be posted.', ('stat',))
+REFRESHES = registry.counter(
+    'refresher_runs_total', 'Background market data refreshes.', ('result',))
+HTTP_CLIENT = registry.counter(
+    'http_client_total', 'Upstream call retries, hedges and circuit breaker events.', ('kind',))
+POOL_CONNECTIONS = registry.gauge(
+    'pool_connections', 'Connections in the Redis and Postgres pools.', ('pool', 'state'))
+
+DISPATCH_SECONDS = STAGE_SECONDS.labels('dispatch')
+GET_TEAM_SECONDS = STAGE_SECONDS.labels('get_team')
+POST_MESSAGE_SECONDS = STAGE_SECONDS.labels('post_message')
+CHAT_POST_SECONDS = STAGE_SECONDS.labels('chat_post')
+SLACK_ERRORS = UPSTREAM_ERRORS.labels('slack')
+
+SLACK_API_URL = 'https://slack.com/api/'
+
+
+def _stat(stats, key):
+    return lambda: stats()[key]
+
 
 # XXX(jeff) To remember which teams have authorized your app and what tokens are
 # associated with each team, we can store this information in memory on
@@ -33,30 +77,80 @@ class CryptoBot(object):
 
         self._config = settings.get('SLACK', {})
         self._asyncpg = asyncpg
+        self._redis = redis
         self._client = client
 
         self._name = self._config.get('BOT_NAME')
         self._emoji = ':robot_face:'
         self._verification = self._config.get('VERIFICATION_TOKEN')
+        self._api_url = self._config.get('API_URL') or SLACK_API_URL
         self._oauth = {
             'client_id': self._config.get('CLIENT_ID'),
             'client_secret': self._config.get('CLIENT_SECRET'),
             'scope': self._config.get('API_SCOPE'),
         }
 
-        self._cw = CryptoWorld(redis, client)
+        workers = settings.get('WORKERS', {})
+        self._queue = WorkQueue(
+            concurrency=workers.get('CONCURRENCY', 8),
+            maxsize=workers.get('QUEUE_SIZE', 256),
+            drain_timeout=workers.get('DRAIN_TIMEOUT', 10),
+            name='slack_events',
+        )
+
+        outbound = settings.get('OUTBOUND', {})
+        self._outbound = SlackDispatcher(
+            self._send_message,
+            channel_rate=outbound.get('CHANNEL_RATE', 1.0),
+            team_rate=outbound.get('TEAM_RATE', 5.0),
+            team_burst=outbound.get('TEAM_BURST', 10),
+            coalesce_window=outbound.get('COALESCE_WINDOW', 0.25),
+        )
 
-        # Get the global async loop and have it run update to pre-heat
-        # the cache of price data.
-        #  loop = asyncio.get_event_loop()
-        #  logger.debug("CryptoBot::__init__ loop: %s", loop)
-        #  loop.run_until_complete(self._cw.update())
-        #  logger.debug("CryptoBot::__init__ update done.")
+        self._dedup = EventDeduper(redis)
+        self._teams = TeamCache(asyncpg, redis)
+        market = settings.get('MARKET', {})
+        self._cw = CryptoWorld(
+            redis, client, fiat=market.get('FIAT', ()), base_url=market.get('API_URL'))
+        self._alerts = AlertStore(asyncpg, redis)
+        self._cw.add_listener(self._on_snapshot)
+        self.read_counters()
+        registry.collector(self.collect_metrics)
+
+        self._router = CommandRouter()
+        self._router.add('Alerts!', ('alert', 'alerts'), self.send_alert_message)
+        self._router.add('Pricing!', ('price', 'prices'), self.send_price_message)
+        self._router.add(
+            'Rankings!', ('top', 'movers'), self.send_rankings_message, strict=('top',))
+        self._router.add('Converted!', ('convert',), self.send_convert_message)
+
+        # The price data can't be pre-heated here, the App's IOLoop isn't running yet.
+        # CryptoWorld starts its background refresher on the first request instead.
 
     @property
     def api(self):
         return self._cw
 
+    @property
+    def router(self):
+        return self._router
+
+    @property
+    def queue(self):
+        return self._queue
+
+    @property
+    def outbound(self):
+        return self._outbound
+
+    @property
+    def dedup(self):
+        return self._dedup
+
+    @property
+    def alerts(self):
+        return self._alerts
+
     @property
     def name(self):
         return self._name
@@ -77,11 +171,23 @@ class CryptoBot(object):
     def config(self):
         return self._config.copy()
 
+    @property
+    def teams(self):
+        return self._teams
+
+    def is_bot_user(self, team_id, user_id):
+        """
+        True if :code:`user_id` is our bot in a team we have cached, never waits on I/O.
+        """
+        team = self._teams.peek(team_id)
+        return bool(user_id) and team is not None and user_id == TeamCache.bot_user_id(team)
+
     async def get_team(self, team_id):
-        data = await self._asyncpg.fetch("SELECT * FROM team WHERE slack_id = $1", team_id)
+        with GET_TEAM_SECONDS.time():
+            team = await self._teams.get(team_id)
 
-        logger.debug("GET TEAM %s : %s", team_id, data)
-        return dict(data[0])
+        logger.debug("GET TEAM %s : %s", team_id, team)
+        return team
 
     def redir_uri(self, request=None):
         redir_base = self._config.get('BOT_OAUTH_REDIR')
@@ -116,7 +222,7 @@ class CryptoBot(object):
             'redirect_uri': redirect_uri,
         }
 
-        resp = await self._client.post('https://slack.com/api/oauth.access', data=data)
+        resp = await self._client.post(f'{self._api_url}oauth.access', data=data)
         logger.debug("OAuth auth response %s", resp)
 
         if resp.status != 200:
@@ -147,10 +253,11 @@ class CryptoBot(object):
             team_id, token, bot_token, name, json.dumps(r_data))
 
         logger.debug("SlackBot oauth complete for team %s, %s", team_id, insert)
+        await self._teams.invalidate(team_id)
 
         return name
 
-    async def send_price_message(self, team_id, user_id, channel_id, message):
+    async def send_price_message(self, team_id, user_id, channel_id, command):
         """
         Create and send a price quote users. Save the
         time stamp of this message on the message object for updating in the
@@ -169,20 +276,128 @@ class CryptoBot(object):
             channel_id, self.name, self.emoji
         )
 
-        message = message.lower()
-        logger.debug('MESSAGE: %s', message)
-        parts = message.translate(str.maketrans('', '', string.punctuation)).split()
-        logger.debug('MESSAGE PARTS: %s', parts)
+        logger.debug('COMMAND: %s', command)
+
+        # An optional window, 'price btc 6h', adds the move over that window from
+        # the in memory price history.
+        window, label = command.window, command.window_label
+
+        # An optional target, 'price btc in eur' or 'price eth in btc', quotes in it.
+        words, target_words = split_target(command.symbols)
+        if not target_words and command.currencies:
+            target_words = command.currencies[-1:]
 
-        matched = await self._cw.fuzzy_match(parts)
+        matched = await self._cw.fuzzy_match(words)
         logger.debug('MATCHED: %s', matched)
-        resp_str = '\n'.join([m.slack_str for m in matched])
+        target = await self._resolve_unit(target_words, target=True) if target_words else None
+
+        if target:
+            unit, unit_name = target
+            rates = self._cw.rates
+            try:
+                resp_str = '\n'.join([
+                    format_quote(m, rates.price(m.index, unit), unit_name) for m in matched
+                ])
+            except UnknownRate:
+                resp_str = f'Sorry, I have no {unit_name.upper()} rate right now.'
+        elif window:
+            stats = self._cw.price_window(matched, window)
+            resp_str = '\n'.join([
+                m.slack_str + '\n' + (s.slack_str(label) if s else f'\t{label}: no history yet')
+                for m, s in zip(matched, stats)
+            ])
+        else:
+            resp_str = self._cw.quote(matched)
 
         if not resp_str:
-            logger.error("Empty price string generated!!! message: %s", message)
+            logger.error("Empty price string generated!!! message: %s", command.text)
+
+        return await self.post_message(team_id, channel_id, resp_str)
+
+    async def send_convert_message(self, team_id, user_id, channel_id, command):
+        """
+        Convert between coins and fiat currencies, 'convert 2.5 btc to eth'.
+        """
+        words, target_words = split_target(command.words[command.words.index(command.verb) + 1:])
+        src = await self._resolve_unit(words)
+        dst = await self._resolve_unit(target_words or ['usd'], target=True)
+
+        if src is None or dst is None:
+            return await self.post_message(
+                team_id, channel_id,
+                'What to what? Give an amount and two units, like 2.5 btc to eth.')
+
+        amount = command.amounts[0] if command.amounts else 1.0
+
+        try:
+            value = self._cw.rates.convert(amount, src[0], dst[0])
+        except UnknownRate:
+            return await self.post_message(
+                team_id, channel_id, 'Sorry, I have no rate for that right now.')
+
+        resp_str = f'{format_amount(amount, src[1])} = *{format_amount(value, dst[1])}*'
+        return await self.post_message(team_id, channel_id, resp_str)
+
+    async def _resolve_unit(self, words, target=False):
+        """
+        The unit, a fiat code or coin row index, and its display name, named by
+        :code:`words`, :code:`None` if they don't name one.
+
+        :param target: The words follow "to" or "in", "try" there is the lira.
+        """
+        for i, word in enumerate(words):
+            if is_currency(word, target and not i):
+                return word, word
+
+        matched = await self._cw.fuzzy_match(words)
+        if not matched:
+            return None
+
+        return matched[0].index, matched[0].symbol
+
+    async def send_rankings_message(self, team_id, user_id, channel_id, command):
+        """
+        Send the top coins, 'top 20 volume', or the biggest movers, 'movers 1h'.
+        """
+        movers = 'movers' in command
+        name = '24h' if movers else 'cap'
+        n = max(int(command.amounts[-1]), 1) if command.amounts else (5 if movers else 10)
+
+        for word in command.words:
+            if ranking_field(word):
+                name = ranking_field(word)
+
+        if movers:
+            if name not in ('1h', '24h', '7d'):
+                name = '24h'
+
+            gainers, losers = await self._cw.movers(name, n)
+            resp_str = format_movers(gainers, losers, name)
+        else:
+            resp_str = format_top(await self._cw.top(name, n), name)
+
+        return await self.post_message(team_id, channel_id, resp_str)
+
+    async def post_message(self, team_id, channel_id, text):
+        """
+        Post :code:`text` to a channel as the bot. The post goes through the outbound
+        dispatcher, so it's rate limited and may be merged with other replies to the channel.
+        """
+        with POST_MESSAGE_SECONDS.time():
+            ok = await self._outbound.post(team_id, channel_id, text)
 
+        if not ok:
+            return ''
+
+        return text
+
+    async def _send_message(self, team_id, channel_id, text):
+        """
+        Send :code:`text` to a channel with :code:`chat.postMessage`, returns the response.
+        """
         team = await self.get_team(team_id)
-        logger.debug("send_price team %s", pformat(team))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("post_message team %s", pformat(team))
 
         headers = {
             'Authorization': f'Bearer {team["bot_access_token"]}',
@@ -194,42 +409,219 @@ class CryptoBot(object):
             'channel': channel_id,
             'username': self.name,
             'icon_emoji': self.emoji,
-            'text': resp_str,
+            'text': text,
         }
 
-        logger.debug("send_price sending message %s", resp_str)
-        resp = await self._client.post(
-                'https://slack.com/api/chat.postMessage',
-                headers=headers,
-                json=data,
+        logger.debug("post_message sending message %s", text)
+        with CHAT_POST_SECONDS.time():
+            try:
+                resp = await self._client.post(
+                        f'{self._api_url}chat.postMessage',
+                        headers=headers,
+                        json=data,
+                )
+            except Exception:
+                SLACK_ERRORS.inc()
+                raise
+
+        if resp.status != 200:
+            SLACK_ERRORS.inc()
+
+        # Only the status and headers are used, hand the connection back for reuse.
+        await resp.release()
+
+        return resp
+
+    async def send_alert_message(self, team_id, user_id, channel_id, command):
+        """
+        Manage the price alerts of a channel:
+        'alert eth above 3000', 'alert btc 9000', 'alerts' and 'alert clear'.
+        """
+        if 'clear' in command:
+            count = await self._alerts.clear_channel(team_id, channel_id)
+            return await self.post_message(team_id, channel_id, f'Cleared, {count} removed.')
+
+        if not command.amounts:
+            alerts = await self._alerts.for_channel(team_id, channel_id)
+            lines = [a.slack_str(self._cw.symbol_of(a.coin_id)) for a in alerts]
+            resp_str = '\n'.join(['*Watching*'] + lines) if lines else 'Nothing watched here.'
+            return await self.post_message(team_id, channel_id, resp_str)
+
+        threshold = command.amounts[0]
+        words = [w for w in command.symbols if w not in (ABOVE, BELOW)]
+        matched = await self._cw.fuzzy_match(words)
+
+        if not matched:
+            return await self.post_message(
+                team_id, channel_id, 'Which coin? Name one and a threshold, like eth above 3000.')
+
+        coin = matched[0]
+        if ABOVE in command:
+            direction = ABOVE
+        elif BELOW in command:
+            direction = BELOW
+        else:
+            direction = ABOVE if threshold > coin.price else BELOW
+
+        if already_crossed(direction, threshold, coin.price):
+            return await self.post_message(
+                team_id, channel_id,
+                f'*{coin.symbol}* is already {direction} *${threshold:2.2f}* (now ${coin.usd}).')
+
+        alert = await self._alerts.create(
+            team_id, channel_id, user_id, coin['id'], direction, threshold)
+
+        return await self.post_message(
+            team_id, channel_id, f'Watching {alert.slack_str(coin.symbol)} (now ${coin.usd})')
+
+    def _on_snapshot(self, old, new):
+        if old.version is None:
+            # The first snapshot in this process, there's nothing to compare against.
+            return
+
+        asyncio.ensure_future(self.check_alerts(old, new))
+
+    async def check_alerts(self, old, new):
+        """
+        Post every alert triggered between two ticker snapshots.
+        """
+        try:
+            book = await self._alerts.sync()
+            triggered = book.evaluate(old, new)
+        except Exception as e:
+            logger.error("check_alerts error: %s", e)
+            return
+
+        logger.debug("check_alerts %s triggered of %s", len(triggered), len(book))
+
+        for alert in triggered:
+            try:
+                # Only the process that claims the alert posts it.
+                if not await self._alerts.claim(alert):
+                    continue
+
+                bc = new.by_id[alert.coin_id]
+                text = f':rotating_light: {alert.slack_str(bc.symbol)}\n{bc.slack_str}'
+                await self.post_message(alert.team_id, alert.channel_id, text)
+            except Exception as e:
+                logger.error("check_alerts post error for %s: %s", alert, e)
+
+    async def is_duplicate(self, event):
+        """
+        True for a Slack retry of an event that has already been accepted.
+        """
+        return await self._dedup.seen(event.get('event_id'))
+
+    async def forget_event(self, event):
+        """
+        Let Slack's retry of an event we turned away through the duplicate check.
+        """
+        await self._dedup.forget(event.get('event_id'))
+
+    def route(self, event):
+        """
+        The :code:`Command` for a Slack event, :code:`None` if it isn't a message for
+        one of our commands.
+        """
+        body = event.get('event') or {}
+
+        if body.get('type') != 'message':
+            return None
+
+        # Never answer a bot, least of all ourselves, or edits, joins and other subtypes.
+        # Our own replies quote commands and amounts and would answer themselves forever.
+        if body.get('bot_id') or body.get('subtype'):
+            return None
+
+        if self.is_bot_user(event.get('team_id'), body.get('user')):
+            return None
+
+        return self._router.parse(body.get('text') or '')
+
+    def enqueue_event(self, event, command=None):
+        """
+        Queue an event to be dispatched by a background worker, so Slack gets its ack
+        without waiting on the work. Raises :code:`QueueFull` when the queue is full.
+        """
+        self._queue.submit(self.dispatch_event, event, command)
+
+    async def dispatch_event(self, event={}, command=None):
+        with DISPATCH_SECONDS.time():
+            return await self._dispatch_event(event, command or self.route(event))
+
+    async def _dispatch_event(self, event, command):
+        if command is None:
+            message = "I do not have an event handler for the %s" % event['event']['type']
+            return Response(message, 200, headers={"X-Slack-No-Retry": '1'})
+
+        logger.debug('%s Message matched!', command.route.name)
+        body = event['event']
+
+        # Routing only knows the bot's user id once its team is cached, check it again.
+        team = await self.get_team(event['team_id'])
+        if body.get('user') and body.get('user') == TeamCache.bot_user_id(team):
+            return {'message': 'Ignored'}
+        await command.route.handler(event['team_id'], body['user'], body['channel'], command)
+
+        return {'message': command.route.name}
+
+    def read_counters(self):
+        """
+        Point the registry's counters at the counts our components already keep,
+        so they're read at scrape time and never touched per event.
+        """
+        caches = (
+            ('l1', self._cw.l1), ('replies', self._cw.replies),
+            ('teams', self._teams.cache), ('dedup', self._dedup.local),
         )
+        for name, cache in caches:
+            CACHE_HITS.read_from(_stat(cache.stats, 'hits'), name)
+            CACHE_MISSES.read_from(_stat(cache.stats, 'misses'), name)
+            CACHE_EVICTIONS.read_from(_stat(cache.stats, 'evictions'), name)
 
-        #  logger.debug('send_price_message resp: %s', resp)
+        for name, flight in (('market', self._cw.flight), ('teams', self._teams.flight)):
+            FLIGHT_CALLS.read_from(_stat(flight.stats, 'calls'), name)
+            FLIGHT_COALESCED.read_from(_stat(flight.stats, 'coalesced'), name)
 
-        if resp.status != 200:
-            logger.error('problem while posting slack message. %s', resp)
-            return ''
+        for result in ('processed', 'failed', 'rejected'):
+            QUEUE_DONE.read_from(_stat(self._queue.stats, result), 'slack_events', result)
 
-        return resp_str
+        DEDUP_SUPPRESSED.read_from(_stat(self._dedup.stats, 'suppressed_local'), 'local')
+        DEDUP_SUPPRESSED.read_from(_stat(self._dedup.stats, 'suppressed_redis'), 'redis')
 
-    async def dispatch_event(self, event={}):
-        event_type = event['event']['type']
-        team_id = event["team_id"]
+        for kind in ('messages', 'posts', 'coalesced', 'rate_limited', 'failed'):
+            OUTBOUND.read_from(_stat(self._outbound.stats, kind), kind)
 
-        if event_type == 'message':
-            logger.debug('Message!')
-            m_text = event['event'].get('text', '').lower()
+        REFRESHES.read_from(_stat(self._cw.refresher.stats, 'refreshes'), 'ok')
+        REFRESHES.read_from(_stat(self._cw.refresher.stats, 'failures'), 'failed')
+
+        resilience = self._client.resilience
+        for kind in ('calls', 'retries', 'hedges', 'hedges_won', 'breaker_trips',
+                     'breaker_rejected', 'deadlines'):
+            HTTP_CLIENT.read_from(_stat(resilience.stats, kind), kind)
+        HTTP_CLIENT.read_from(_stat(self._client.validators.stats, 'not_modified'), 'not_modified')
+
+    def collect_metrics(self):
+        """
+        Set the gauges from our components' current state, run before every scrape
+        so none of this is done per event.
+        """
+        caches = (
+            ('l1', self._cw.l1), ('replies', self._cw.replies),
+            ('teams', self._teams.cache), ('dedup', self._dedup.local),
+        )
+        for name, cache in caches:
+            CACHE_SIZE.labels(name).set(len(cache))
 
-            if 'price' in m_text:
-                logger.debug('Price Message matched!')
-                user_id = event["event"]["user"]
-                await self.send_price_message(team_id, user_id, event["event"]["channel"], m_text)
+        QUEUE_DEPTH.labels('slack_events').set(self._queue.stats()['depth'])
 
-                logger.debug('Pricing Message sent!')
-                return {'message': 'Pricing!'}
+        stats = self._outbound.stats()
+        OUTBOUND_WAIT.labels('avg').set(stats['wait_avg'])
+        OUTBOUND_WAIT.labels('max').set(stats['wait_max'])
 
-        message = "I do not have an event handler for the %s" % event_type
-        return Response(message, 200, headers={"X-Slack-No-Retry": '1'})
+        for name, backend in (('redis', self._redis), ('postgres', self._asyncpg)):
+            for state, value in backend.pool_stats().items():
+                POOL_CONNECTIONS.labels(name, state).set(value)
 
 
 components = [Component(CryptoBot, init=CryptoBot)]
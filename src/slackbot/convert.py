@@ -0,0 +1,132 @@
+from array import array
+import logging
+
+"""
+Currency Conversion
+*******************
+
+Conversions between coins and fiat currencies, "convert 2.5 btc to eth" or
+"price btc in eur", answered from the data we already hold.
+
+A :code:`CrossRates` is built once per ticker snapshot and fiat rate update. Every unit
+is valued in USD: coins by the snapshot's :code:`price_usd` column and fiat currencies
+by rates fetched with coinmarketcap's :code:`convert=` once per refresh. Converting
+between any two units is then two lookups and a multiply, and quoting every coin in a
+currency is a single pass over the price column, kept for the life of the snapshot.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+USD = 'usd'
+# Words separating what's converted from what it's converted to.
+TARGET_WORDS = frozenset(('to', 'in', 'into', 'as'))
+
+
+class UnknownRate(ValueError):
+    pass
+
+
+class CrossRates(object):
+    """
+    USD values for the coins of a :code:`TickerStore` and a set of fiat currencies.
+
+    Units are coin row indexes, as :code:`int`, or lowercase fiat currency codes.
+    """
+    def __init__(self, store, fiat=None, btc_index=None):
+        """
+        :param fiat: Currency code -> USD per unit of the currency.
+        :param btc_index: Row index of bitcoin, coin to BTC rates are then taken straight
+            from the ticker's :code:`price_btc` rather than crossed through USD.
+        """
+        self._usd = store.column('price_usd')
+        self._btc = store.column('price_btc')
+        self._fiat = dict(fiat or {})
+        self._fiat[USD] = 1.0
+        self._btc_index = btc_index
+        self._quotes = {}
+
+    @property
+    def currencies(self):
+        return frozenset(self._fiat)
+
+    def usd_value(self, unit):
+        """
+        USD value of one :code:`unit`, raises :code:`UnknownRate` if we have none.
+        """
+        if isinstance(unit, str):
+            value = self._fiat.get(unit)
+        else:
+            value = self._usd[unit] if 0 <= unit < len(self._usd) else None
+
+        if not value:
+            raise UnknownRate(f'No rate for {unit}')
+
+        return value
+
+    def rate(self, src, dst):
+        """
+        How many :code:`dst` one :code:`src` is worth.
+        """
+        if dst == self._btc_index and not isinstance(src, str) and self._btc[src]:
+            return self._btc[src]
+
+        return self.usd_value(src) / self.usd_value(dst)
+
+    def convert(self, amount, src, dst):
+        return amount * self.rate(src, dst)
+
+    def price(self, index, unit):
+        """
+        Price of the coin at row :code:`index` in :code:`unit`, read from the
+        currency's :code:`quotes` when it's a fiat currency.
+        """
+        if isinstance(unit, str):
+            price = self.quotes(unit)[index]
+            if not price:
+                raise UnknownRate(f'No rate for {index}')
+            return price
+
+        return self.rate(index, unit)
+
+    def quotes(self, currency):
+        """
+        Every coin's price in :code:`currency`, by row index, computed once per currency.
+        """
+        quotes = self._quotes.get(currency)
+
+        if quotes is None:
+            k = 1.0 / self.usd_value(currency)
+            quotes = self._quotes[currency] = array('d', (p * k for p in self._usd))
+
+        return quotes
+
+
+def format_amount(amount, unit):
+    """
+    :code:`amount` of :code:`unit`, a currency code or coin symbol, as Slack text.
+    """
+    if amount >= 1:
+        text = f'{amount:,.2f}'
+    else:
+        # Small coin values need more than cents to mean anything.
+        text = f'{amount:,.8f}'.rstrip('0').rstrip('.') or '0'
+
+    return f'{text} {unit.upper()}'
+
+
+def format_quote(bc, price, currency):
+    return f'*{bc.symbol}* \t*{format_amount(price, currency)}*\t(${bc.usd})'
+
+
+def split_target(words):
+    """
+    Split the words of a command at the last "to" or "in": "btc to eth" gives
+    :code:`(['btc'], ['eth'])`. The target is empty without one.
+    """
+    for i in range(len(words) - 1, -1, -1):
+        if words[i] in TARGET_WORDS:
+            return words[:i], words[i + 1:]
+
+    return words, []
@@ -2,20 +2,162 @@
 # encoding: utf-8
 
 #  from pprint import pformat
+import asyncio
+import codecs
 import datetime
+import hashlib
+import uuid
+from array import array
 import logging
 import json
+from types import MappingProxyType
+from local_utils.singleflight import SingleFlight
+from local_utils.metrics import registry
+from local_utils.jsonstream import JSONArrayDecoder
+from backends.memory import TTLCache
+from backends import codec as cache_codec
+from .refresher import Refresher
+from .matcher import CoinMatcher
+from .history import PriceHistory
+from .rankings import Rankings
+from .convert import CrossRates
+from .metrics import STAGE_SECONDS, UPSTREAM_ERRORS, CACHE_HITS, CACHE_MISSES
 
 
 logger = logging.getLogger(__name__)
 BASE_URL = 'https://api.coinmarketcap.com/v1/'
-GLOBAL_URL = f'{BASE_URL}global/'
-TICKER_URL = f'{BASE_URL}ticker/'
+
+FUZZY_MATCH_SECONDS = STAGE_SECONDS.labels('fuzzy_match')
+MARKET_ERRORS = UPSTREAM_ERRORS.labels('coinmarketcap')
+REDIS_HITS = CACHE_HITS.labels('redis')
+REDIS_MISSES = CACHE_MISSES.labels('redis')
+BYTES_SAVED = registry.counter(
+    'market_bytes_saved_total', 'Upstream payload bytes not downloaded thanks to a 304.')
+STALE_SERVED = registry.counter(
+    'market_stale_served_total', 'Upstream fetches answered with the last good data.')
+
+
+def payload_size(resp, body_size):
+    """
+    Bytes upstream sent for :code:`resp`: its Content-Length when it has one, that's
+    what's on the wire when the body came compressed, else the :code:`body_size` read.
+    """
+    length = resp.headers.get('Content-Length', '')
+    return int(length) if length.isdigit() else body_size
+
+
+class TickerStore(object):
+    """
+    A compact, column oriented store of ticker records parsed once from coinmarketcap.
+
+    Numeric fields are kept as typed :code:`array` columns and the string fields as plain
+    lists, one entry per coin, so a record is just its row index. Missing or null numeric
+    values are stored as :code:`0`, the same value the :code:`Blockchain` properties have
+    always reported for them, and remembered so :code:`raw` can still report them as null.
+    """
+    FLOAT_FIELDS = (
+        'price_usd', 'price_btc', '24h_volume_usd', 'market_cap_usd',
+        'available_supply', 'total_supply', 'max_supply',
+        'percent_change_1h', 'percent_change_24h', 'percent_change_7d',
+    )
+    INT_FIELDS = ('rank', 'last_updated')
+    STR_FIELDS = ('id', 'name', 'symbol')
+
+    __slots__ = ('_columns', '_size', '_missing')
+
+    def __init__(self, coins=()):
+        self._columns = {}
+        self._size = 0
+        # (field, row) of the numeric values that were null or missing, there are few.
+        self._missing = set()
+
+        for f in self.FLOAT_FIELDS:
+            self._columns[f] = array('d')
+
+        for f in self.INT_FIELDS:
+            self._columns[f] = array('q')
+
+        for f in self.STR_FIELDS:
+            self._columns[f] = []
+
+        for data in coins:
+            self.append(data)
+
+    def append(self, data):
+        """
+        Parse one raw coinmarketcap record into the store and return its row index.
+        """
+        cols = self._columns
+        idx = self._size
+
+        for f in self.FLOAT_FIELDS:
+            value = data.get(f)
+            if value is None:
+                self._missing.add((f, idx))
+            cols[f].append(float(value or 0))
+
+        for f in self.INT_FIELDS:
+            value = data.get(f)
+            if value is None:
+                self._missing.add((f, idx))
+            cols[f].append(int(float(value or 0)))
+
+        for f in self.STR_FIELDS:
+            cols[f].append(data.get(f) or '')
+
+        self._size += 1
+        return idx
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def column(self, field):
+        return self._columns[field]
+
+    def get(self, idx, field, default=None):
+        """
+        The parsed value of a field, a number for the numeric fields.
+        """
+        col = self._columns.get(field)
+        return default if col is None else col[idx]
+
+    def raw(self, idx, field, default=None):
+        """
+        A field as coinmarketcap sends it, numbers as strings and null as :code:`None`.
+        Numbers are rebuilt from the parsed value, so :code:`"100"` in a float field comes
+        back as :code:`"100.0"`.
+        """
+        col = self._columns.get(field)
+
+        if col is None:
+            return default
+
+        if field in self.STR_FIELDS:
+            return col[idx]
+
+        if (field, idx) in self._missing:
+            return None
+
+        return str(col[idx])
+
+    def view(self, idx):
+        return Blockchain(self, idx)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return (Blockchain(self, idx) for idx in range(self._size))
 
 
 class Blockchain(object):
     """Info for a :code:`Blockchain` instance for a particular blockchain from coinmarketcap
 
+    A :code:`Blockchain` is a thin view over one row of a :code:`TickerStore`, the numbers
+    were parsed when the store was built. Raw record keys are available as items or
+    attributes, with upstream's string values, and parsed with :code:`value`.
+
     Example::
 
         {
@@ -36,48 +178,75 @@ class Blockchain(object):
         }
 
     """
+    __slots__ = ('_store', '_cols', '_idx')
+
+    def __init__(self, store, idx):
+        self._store = store
+        self._cols = store.columns
+        self._idx = idx
 
-    def __init__(self, data={}):
-        self._ts = datetime.datetime.utcnow()
-        self._data = data
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a standalone :code:`Blockchain` from one raw coinmarketcap record.
+        """
+        store = TickerStore()
+        return cls(store, store.append(data))
 
     def __getitem__(self, key):
-        return self._data.get(key)
+        return self._store.raw(self._idx, key)
 
     def __getattr__(self, key):
-        return self._data.get(key)
+        if key.startswith('_'):
+            raise AttributeError(key)
+
+        return self._store.raw(self._idx, key)
+
+    def value(self, key, default=None):
+        """
+        The parsed value of a record key, numbers as :code:`float` or :code:`int`.
+        """
+        return self._store.get(self._idx, key, default)
+
+    @property
+    def index(self):
+        return self._idx
 
     @property
     def market_cap(self):
-        return float(self._data.get('market_cap_usd') or 0)
+        return self._cols['market_cap_usd'][self._idx]
 
     @property
     def last_updated(self):
-        return datetime.utcfromtimestamp(int(self._data.get('last_updated', 0)))
+        return datetime.datetime.utcfromtimestamp(self._cols['last_updated'][self._idx])
+
+    @property
+    def price(self):
+        return self._cols['price_usd'][self._idx]
 
     @property
     def usd(self):
-        return '%2.2f' % float(self._data.get('price_usd', 0))
+        return '%2.2f' % self._cols['price_usd'][self._idx]
 
     @property
     def symbol(self):
-        return self._data.get('symbol', '').upper()
+        return self._cols['symbol'][self._idx].upper()
 
     @property
     def id(self):
-        return self._data.get('id', '').lower()
+        return self._cols['id'][self._idx].lower()
 
     @property
     def one_hour(self):
-        return float(self._data.get('percent_change_1h') or 0)
+        return self._cols['percent_change_1h'][self._idx]
 
     @property
     def one_day(self):
-        return float(self._data.get('percent_change_24h') or 0)
+        return self._cols['percent_change_24h'][self._idx]
 
     @property
     def one_week(self):
-        return float(self._data.get('percent_change_7d') or 0)
+        return self._cols['percent_change_7d'][self._idx]
 
     @property
     def slack_str(self):
@@ -95,18 +264,243 @@ class Blockchain(object):
         return f'<BlockChain {self.symbol} : ${self.usd}>'
 
 
+class TickerSnapshot(object):
+    """
+    An immutable, indexed view of one version of the ticker data.
+
+    The :code:`version` is a content hash of the raw ticker payload, so an unchanged payload
+    can be recognized without decoding it. A :code:`CryptoWorld` swaps in a whole new
+    snapshot when the version changes and never modifies the current one in place.
+    """
+    __slots__ = (
+        '_version', '_store', '_coins', '_by_id', '_by_symbol', '_matcher', '_rankings',
+        '_fragments',
+    )
+
+    def __init__(self, version=None, coins=(), store=None):
+        """
+        :param store: A :code:`TickerStore` already holding the coins.
+        """
+        store = store if store is not None else TickerStore(coins)
+        coins = tuple(store)
+        by_id = {}
+        by_symbol = {}
+
+        for bc in coins:
+            by_id[bc['id']] = bc
+
+            # Symbols aren't unique, keep the coin with the largest market cap.
+            symbol = bc['symbol'].lower()
+            if symbol not in by_symbol or by_symbol[symbol].market_cap < bc.market_cap:
+                by_symbol[symbol] = bc
+
+        self._version = version
+        self._store = store
+        self._coins = coins
+        self._by_id = MappingProxyType(by_id)
+        self._by_symbol = MappingProxyType(by_symbol)
+        self._matcher = CoinMatcher(store)
+        self._rankings = Rankings(store)
+        # Rendered slack_str per row, filled in as coins are quoted.
+        self._fragments = [None] * len(coins)
+
+    @staticmethod
+    def version_of(raw):
+        """
+        The version of a raw ticker payload, as :code:`str` or :code:`bytes`.
+        """
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+
+        return hashlib.sha1(raw).hexdigest()
+
+    @classmethod
+    def from_raw(cls, raw, version=None):
+        """
+        Build a snapshot from a cached ticker value, in any cache codec format.
+        """
+        return cls(version or cls.version_of(raw), cache_codec.decode(raw))
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def coins(self):
+        """
+        Every coin's :code:`Blockchain`, by row index in the store.
+        """
+        return self._coins
+
+    @property
+    def by_id(self):
+        return self._by_id
+
+    @property
+    def by_symbol(self):
+        return self._by_symbol
+
+    @property
+    def matcher(self):
+        return self._matcher
+
+    def match(self, tokens):
+        return [self._coins[idx] for idx in self._matcher.match(tokens)]
+
+    def fragment(self, idx):
+        """
+        The :code:`slack_str` of the coin at row :code:`idx`, rendered once per snapshot.
+        """
+        text = self._fragments[idx]
+
+        if text is None:
+            text = self._fragments[idx] = self._coins[idx].slack_str
+
+        return text
+
+    def owns(self, bc):
+        return 0 <= bc.index < len(self._coins) and self._coins[bc.index] is bc
+
+    def top(self, name='cap', n=10):
+        return [self._coins[idx] for idx in self._rankings.top(name, n)]
+
+    def movers(self, name='24h', n=5):
+        gainers, losers = self._rankings.movers(name, n)
+        return [self._coins[idx] for idx in gainers], [self._coins[idx] for idx in losers]
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __repr__(self):
+        return f'<TickerSnapshot {self._version} : {len(self)} coins>'
+
+
 class CryptoWorld(object):
-    REDIS_KEY_GLOBAL = 'coin_global'
-    REDIS_KEY_TICKER = 'coin_ticker'
+    # Encoded with a cache codec. Workers from before the codecs read plain JSON from
+    # coin_global and coin_ticker, so these must never be written there.
+    REDIS_KEY_GLOBAL = 'coin_global:v2'
+    REDIS_KEY_TICKER = 'coin_ticker:v2'
+    # Per coin copies of the ticker, coin id -> record JSON and symbol -> coin id.
+    REDIS_KEY_TICKER_IDS = 'coin_ticker:id'
+    REDIS_KEY_TICKER_SYMBOLS = 'coin_ticker:symbol'
+    # Fiat currency -> USD per unit, fetched with the ticker's convert= option.
+    REDIS_KEY_FIAT = 'coin_fiat'
+    # Held by the one process fetching from upstream in a refresh round.
+    REDIS_KEY_REFRESH_LOCK = 'coin_refresh:lock'
 
-    def __init__(self, redis_db, client, data_expire=600):
+    def __init__(self, redis_db, client, data_expire=600, refresh_ratio=0.8,
+                 l1_ttl=None, l1_size=16, codec=None, history_size=288, fiat=(),
+                 reply_cache_size=256, stream_chunk_size=65536, base_url=None):
         logger.debug("CryptoWorld __init__ redis: %s, client: %s", redis_db, client)
         self._redis_db = redis_db
         self._client = client
         self._data_expire = data_expire
+        base_url = base_url or BASE_URL
+        self._global_url = f'{base_url}global/'
+        self._ticker_url = f'{base_url}ticker/'
+        self._codec = codec or cache_codec.default_codec()
+        # In process first tier in front of Redis, it must expire before Redis does.
+        self._l1 = TTLCache(
+            maxsize=l1_size,
+            ttl=min(l1_ttl or data_expire // 4, data_expire // 2) or 1,
+        )
         self._global = {}
-        self._by_symbol = {}
-        self._by_id = {}
+        # The last data fetched for each key, served when upstream is failing.
+        self._last_good = {}
+        # Upstream payload size for each key, to count what a 304 saved us.
+        self._last_size = {}
+        # The ticker is streamed from upstream into a TickerStore and to Redis, the store
+        # is kept here, with the value it came with, for update_ticker to pick up.
+        self._stream_codec = cache_codec.ZlibJSONCodec()
+        self._stream_chunk_size = stream_chunk_size
+        self._streamed = None
+        self._ticker = TickerSnapshot()
+        # Rendered price replies by (snapshot version, coin rows), cleared on a new snapshot.
+        self._replies = TTLCache(maxsize=reply_cache_size, ttl=None)
+        self._history = PriceHistory(history_size)
+        self._listeners = []
+        self._fiat_currencies = tuple(c.lower() for c in fiat if c.lower() != 'usd')
+        self._fiat = {}
+        self._rates = None
+        self._flight = SingleFlight()
+        # Refresh ahead of the cache expiry so requests never find it empty.
+        self._refresher = Refresher(self, max(int(data_expire * refresh_ratio), 1))
+        self._lock_token = uuid.uuid4().hex
+
+    @property
+    def flight(self):
+        """
+        The :code:`SingleFlight` used to coalesce concurrent cache misses.
+        """
+        return self._flight
+
+    @property
+    def refresher(self):
+        return self._refresher
+
+    @property
+    def l1(self):
+        """
+        The in process :code:`TTLCache` in front of Redis.
+        """
+        return self._l1
+
+    @property
+    def ticker(self):
+        """
+        The current :code:`TickerSnapshot`.
+        """
+        return self._ticker
+
+    @property
+    def replies(self):
+        return self._replies
+
+    @property
+    def rates(self):
+        """
+        The :code:`CrossRates` for the current snapshot and fiat rates, built on first use.
+        """
+        if self._rates is None:
+            btc = self._ticker.by_id.get('bitcoin')
+            self._rates = CrossRates(
+                self._ticker.store, self._fiat, btc.index if btc is not None else None)
+
+        return self._rates
+
+    @property
+    def history(self):
+        """
+        The :code:`PriceHistory` of every ticker snapshot this process has loaded.
+        """
+        return self._history
+
+    def add_listener(self, listener):
+        """
+        Call :code:`listener(old, new)` with the old and new :code:`TickerSnapshot` every
+        time a changed snapshot is swapped in. Listeners run on the refresh path, so
+        anything slow should be scheduled rather than done inline.
+        """
+        self._listeners.append(listener)
+
+    @property
+    def _by_id(self):
+        return self._ticker.by_id
+
+    @property
+    def _by_symbol(self):
+        return self._ticker.by_symbol
+
+    @property
+    def has_data(self):
+        """
+        True once both the global and ticker data have been loaded into this process.
+        """
+        return bool(self._global and self._by_id)
 
     @property
     def total_cap(self):
@@ -132,86 +526,509 @@ class CryptoWorld(object):
     def last_updated(self):
         return datetime.utcfromtimestamp(int(self._global.get('last_updated', 0)))
 
-    async def _get_cached(self, key, url, params={}):
+    async def _get_cached_raw(self, key, url, params={}, force=False):
         logger.debug("_get_cached %s, %s, %s", key, url, params)
-        data = await self._redis_db.exec('get', key)
 
-        if data:
-            logger.debug("_get_cached HIT")
-            return json.loads(data)
+        if not force:
+            data = self._l1.get(key)
+            if data:
+                logger.debug("_get_cached L1 HIT")
+                return data
+
+            data = await self._redis_db.exec('get', key)
+            if data and cache_codec.readable(data):
+                logger.debug("_get_cached HIT")
+                REDIS_HITS.inc()
+                self._l1.set(key, data)
+                return data
+
+            REDIS_MISSES.inc()
 
         logger.debug("_get_cached MISS")
-        resp = await self._client.get(url, params=params)
+        # Only one upstream fetch per key is allowed in flight, everyone else missing
+        # on the same key waits for and shares its result.
+        try:
+            return await self._flight.do(key, self._fetch, key, url, params)
+        except Exception as e:
+            data = self._last_good.get(key)
+            if data is None:
+                raise
+
+            # Upstream is down or its circuit is open, keep going on what we had.
+            STALE_SERVED.inc()
+            logger.warning("_get_cached serving last good %s: %s", key, e)
+            return data
+
+    async def _get_cached(self, key, url, params={}, force=False):
+        raw = await self._get_cached_raw(key, url, params=params, force=force)
+        return cache_codec.decode(raw)
+
+    async def _fetch(self, key, url, params={}):
+        last = self._last_good.get(key)
+        if last is None:
+            # Nothing to fall back on if told it's not modified, fetch it in full.
+            validators = self._client.validators
+            validators.forget(validators.key(url, params))
+
+        try:
+            # The ticker is big and slow, worth a hedged second request. Conditional, so
+            # once we have it an unchanged payload is revalidated rather than downloaded.
+            # Its latencies are kept apart from the small limit=1 fiat lookups on the
+            # same URL, or they would make it look slow.
+            resp = await self._client.get(
+                url, params=params, hedge=key == self.REDIS_KEY_TICKER, conditional=True,
+                endpoint=key)
+
+            if resp.status != 200 and not (resp.status == 304 and last is not None):
+                resp.raise_for_status()
+        except Exception:
+            MARKET_ERRORS.inc()
+            raise
 
-        if resp.status != 200:
-            resp.raise_for_status()
+        if resp.status == 304:
+            await resp.release()
+            return await self._not_modified(key, last)
 
-        data = await resp.text()
+        if key == self.REDIS_KEY_TICKER:
+            return await self._stream_ticker(resp)
+
+        body = await resp.read()
+        obj = json.loads(body)
+        data = self._codec.encode(obj)
 
         await self._redis_db.exec('setex', key, self._data_expire, data)
 
-        logger.debug("_get_cached UPDATED")
-        data = json.loads(data)
+        self._l1.set(key, data)
+        self._last_good[key] = data
+        self._last_size[key] = payload_size(resp, len(body))
+
+        logger.debug(
+            "_get_cached UPDATED %s, %s bytes as %s from %s bytes",
+            key, len(data), self._codec.name, len(body)
+        )
+
+        return data
+
+    async def _stream_ticker(self, resp):
+        """
+        Read the ticker response a chunk at a time. Each chunk is compressed and appended
+        to a temporary Redis key, and the coins completed by it are parsed straight into
+        a :code:`TickerStore` and written to a temporary per coin hash. Once the whole
+        response is in, the temporary keys are renamed over the live ones in one
+        transaction.
+
+        Only the compressed value, the store and one chunk are held in memory, never the
+        full response body, its text or its parsed list of records.
+        """
+        token = uuid.uuid4().hex
+        tmp_blob = f'{self.REDIS_KEY_TICKER}:tmp:{token}'
+        tmp_ids = f'{self.REDIS_KEY_TICKER_IDS}:tmp:{token}'
+
+        text = codecs.getincrementaldecoder('utf-8')()
+        decoder = JSONArrayDecoder()
+        compressor = self._stream_codec.compressor()
+        header = bytes((self._stream_codec.version,))
+        blob = [header]
+        unwritten = [header]
+        store = TickerStore()
+        by_symbol = {}
+        size = 0
+
+        async def write(out, coins, final=False):
+            if out:
+                blob.append(out)
+                unwritten.append(out)
+
+            commands = []
+            if coins:
+                args = []
+                for bcd in coins:
+                    store.append(bcd)
+                    args += [bcd['id'], json.dumps(bcd, separators=(',', ':'))]
+                    # Coins arrive in rank order, the first coin with a symbol keeps it.
+                    by_symbol.setdefault(bcd['symbol'].lower(), bcd['id'])
+
+                commands += [
+                    ('hmset', tmp_ids, *args),
+                    ('expire', tmp_ids, self._data_expire),
+                ]
 
-        from pprint import pformat
-        logger.debug("_get_cached NEW DATA\n%s : %s", key, pformat(data))
+            if final or sum(len(b) for b in unwritten) >= self._stream_chunk_size:
+                # Compressed output comes in small pieces, append it in bigger ones.
+                commands += [
+                    ('append', tmp_blob, b''.join(unwritten)),
+                    # Don't leave temporary keys behind if this process dies mid stream.
+                    ('expire', tmp_blob, self._data_expire),
+                ]
+                del unwritten[:]
+
+            if commands:
+                await self._redis_db.transaction(*commands)
+
+        try:
+            async for chunk in resp.content.iter_chunked(self._stream_chunk_size):
+                size += len(chunk)
+                await write(compressor.compress(chunk), decoder.feed(text.decode(chunk)))
+
+            await write(
+                compressor.flush(), decoder.close(text.decode(b'', final=True)), final=True)
+
+            commands = [
+                ('rename', tmp_blob, self.REDIS_KEY_TICKER),
+                ('expire', self.REDIS_KEY_TICKER, self._data_expire),
+            ]
+
+            if len(store):
+                commands += [
+                    ('rename', tmp_ids, self.REDIS_KEY_TICKER_IDS),
+                    ('expire', self.REDIS_KEY_TICKER_IDS, self._data_expire),
+                ]
+            else:
+                commands.append(('del', self.REDIS_KEY_TICKER_IDS))
+
+            commands.append(('del', self.REDIS_KEY_TICKER_SYMBOLS))
+            if by_symbol:
+                commands += [
+                    ('hmset', self.REDIS_KEY_TICKER_SYMBOLS,
+                     *[v for item in by_symbol.items() for v in item]),
+                    ('expire', self.REDIS_KEY_TICKER_SYMBOLS, self._data_expire),
+                ]
+
+            await self._redis_db.transaction(*commands)
+        except BaseException:
+            try:
+                await self._redis_db.exec('del', tmp_blob, tmp_ids)
+            except Exception as e:
+                logger.error("_stream_ticker cleanup error: %s", e)
+            raise
+
+        data = b''.join(blob)
+        self._streamed = (data, store)
+        self._l1.set(self.REDIS_KEY_TICKER, data)
+        self._last_good[self.REDIS_KEY_TICKER] = data
+        self._last_size[self.REDIS_KEY_TICKER] = payload_size(resp, size)
+
+        logger.debug(
+            "_get_cached STREAMED %s, %s coins, %s bytes as %s from %s bytes",
+            self.REDIS_KEY_TICKER, len(store), len(data), self._stream_codec.name, size
+        )
 
         return data
 
-    async def update_global(self):
+    async def _not_modified(self, key, data):
+        """
+        Upstream says :code:`data` is still current, extend its life in the caches.
+        """
+        BYTES_SAVED.inc(self._last_size.get(key, 0))
+        logger.debug("_get_cached NOT MODIFIED %s", key)
+
+        keys = [key]
+        if key == self.REDIS_KEY_TICKER:
+            keys += [self.REDIS_KEY_TICKER_IDS, self.REDIS_KEY_TICKER_SYMBOLS]
+
+        extended = await self._redis_db.transaction(
+            *[('expire', k, self._data_expire) for k in keys])
+
+        if not all(extended):
+            # Expired from Redis in the meantime, write it back in full.
+            if key == self.REDIS_KEY_TICKER:
+                await self._store_ticker(data, cache_codec.decode(data))
+            else:
+                await self._redis_db.exec('setex', key, self._data_expire, data)
+
+        self._l1.set(key, data)
+        return data
+
+    async def _store_ticker(self, data, coins):
+        """
+        Write the full, encoded, ticker blob along with the per coin hashes, all in one
+        transaction so readers never see them out of sync.
+        """
+        by_id = {}
+        by_symbol = {}
+
+        for bcd in coins:
+            bc_id = bcd['id']
+            by_id[bc_id] = json.dumps(bcd, separators=(',', ':'))
+
+            # Coins arrive in rank order, the first coin with a symbol keeps it.
+            by_symbol.setdefault(bcd['symbol'].lower(), bc_id)
+
+        commands = [('setex', self.REDIS_KEY_TICKER, self._data_expire, data)]
+
+        for key, mapping in ((self.REDIS_KEY_TICKER_IDS, by_id),
+                             (self.REDIS_KEY_TICKER_SYMBOLS, by_symbol)):
+            args = [v for item in mapping.items() for v in item]
+            commands.append(('del', key))
+
+            if args:
+                commands.append(('hmset', key, *args))
+                commands.append(('expire', key, self._data_expire))
+
+        await self._redis_db.transaction(*commands)
+
+    async def update_global(self, force=False):
         # Get the global market data
         logger.debug("Fetching global info...")
 
-        g_data = await self._get_cached(self.REDIS_KEY_GLOBAL, GLOBAL_URL)
+        g_data = await self._get_cached(self.REDIS_KEY_GLOBAL, self._global_url, force=force)
         self._global = g_data
 
         return self
 
-    async def update_ticker(self):
+    async def update_ticker(self, force=False):
         # Get all price data for all currencies
         logger.debug("Fetching ticker info...")
 
-        t_data = await self._get_cached(
-            self.REDIS_KEY_TICKER, f'{TICKER_URL}', params={'limit': 0})
+        raw = await self._get_cached_raw(
+            self.REDIS_KEY_TICKER, self._ticker_url, params={'limit': 0}, force=force)
 
-        for bcd in t_data:
-            bc = Blockchain(bcd)
-            self._by_id[bcd['id']] = bc
-            self._by_symbol[bcd['symbol'].lower()] = bc
+        version = TickerSnapshot.version_of(raw)
+        if version == self._ticker.version:
+            logger.debug("update_ticker unchanged, version: %s", version)
+            return self
+
+        # Build the new index off to the side and swap it in whole. A ticker we just
+        # streamed in is already parsed.
+        streamed, self._streamed = self._streamed, None
+        if streamed is not None and streamed[0] is raw:
+            snapshot = TickerSnapshot(version, store=streamed[1])
+        else:
+            snapshot = TickerSnapshot.from_raw(raw, version)
+
+        old, self._ticker = self._ticker, snapshot
+        self._rates = None
+        self._replies.clear()
+        self._history.append(self._ticker.store)
+        logger.debug("update_ticker new snapshot: %s", self._ticker)
+
+        for listener in self._listeners:
+            try:
+                listener(old, self._ticker)
+            except Exception as e:
+                logger.error("update_ticker listener %s error: %s", listener, e)
 
         return self
 
+    async def update_fiat(self, force=False):
+        """
+        Load the USD rate of each configured fiat currency, from the shared cache or
+        from coinmarketcap. A currency that fails keeps its last rate.
+        """
+        if not self._fiat_currencies:
+            return self
+
+        rates = {}
+
+        if not force:
+            cached = await self._redis_db.exec('hgetall', self.REDIS_KEY_FIAT) or []
+            rates = {
+                k.decode('utf-8'): float(v)
+                for k, v in zip(cached[::2], cached[1::2])
+            }
+
+        missing = [c for c in self._fiat_currencies if c not in rates]
+        if missing:
+            results = await asyncio.gather(
+                *[self._flight.do(f'{self.REDIS_KEY_FIAT}:{c}', self._fetch_fiat, c)
+                  for c in missing],
+                return_exceptions=True,
+            )
+
+            fetched = {}
+            for currency, rate in zip(missing, results):
+                if isinstance(rate, Exception):
+                    logger.error("update_fiat %s error: %s", currency, rate)
+                else:
+                    fetched[currency] = rate
+
+            if fetched:
+                await self._redis_db.transaction(
+                    ('hmset', self.REDIS_KEY_FIAT, *[v for i in fetched.items() for v in i]),
+                    ('expire', self.REDIS_KEY_FIAT, self._data_expire),
+                )
+
+            rates.update(fetched)
+
+        fiat = dict(self._fiat)
+        fiat.update((c, r) for c, r in rates.items() if c in self._fiat_currencies)
+        self._fiat = fiat
+        self._rates = None
+        logger.debug("update_fiat rates: %s", self._fiat)
+
+        return self
+
+    async def _fetch_fiat(self, currency):
+        """
+        USD per unit of :code:`currency`, from the top coin's price in both.
+        """
+        try:
+            resp = await self._client.get(
+                self._ticker_url, params={'limit': 1, 'convert': currency.upper()})
+
+            if resp.status != 200:
+                resp.raise_for_status()
+        except Exception:
+            MARKET_ERRORS.inc()
+            raise
+
+        coin = json.loads(await resp.text())[0]
+        return float(coin['price_usd']) / float(coin[f'price_{currency}'])
+
     async def ticker_get(self, bc_id):
         if not bc_id:
             raise ValueError('Invalid block chain id argument')
 
-        await self.update_ticker()
-        return self._by_id.get(bc_id.lower())
+        res = await self.ticker_get_many([bc_id])
+        return res[0] if res else None
+
+    async def ticker_get_many(self, keys):
+        """
+        Look up coins by id or symbol. Served from the in process snapshot when there
+        is one, otherwise only the requested coins are read from Redis and the whole
+        ticker is loaded only if Redis doesn't have them.
+        """
+        keys = [k.lower() for k in keys if k]
+
+        if not self.has_data:
+            res = await self._redis_get_many(keys)
+            if res is not None:
+                return res
+
+            await self.update()
+
+        res = []
+        for k in keys:
+            bc = self._by_id.get(k) or self._by_symbol.get(k)
+            if bc is not None and bc not in res:
+                res.append(bc)
+
+        return res
+
+    async def _redis_get_many(self, keys):
+        """
+        Read just the requested coins from the per coin hashes, :code:`None` when they
+        aren't all available there.
+        """
+        if not keys:
+            return []
+
+        ids = await self._redis_db.exec('hmget', self.REDIS_KEY_TICKER_SYMBOLS, *keys)
+        # Anything that isn't a known symbol is looked up as an id.
+        ids = [(i.decode() if isinstance(i, bytes) else i) or k for i, k in zip(ids, keys)]
+        ids = list(dict.fromkeys(ids))
+
+        records = await self._redis_db.exec('hmget', self.REDIS_KEY_TICKER_IDS, *ids)
+        if not all(records):
+            logger.debug("_redis_get_many MISS %s", keys)
+            return None
+
+        logger.debug("_redis_get_many HIT %s", keys)
+        return [Blockchain.from_dict(json.loads(r)) for r in records]
+
+    async def refresh(self, force=False):
+        """
+        Reload the global and ticker data, with :code:`force` the shared cache is
+        skipped and the data is fetched from upstream.
+        """
+        logger.debug("CryptoWorld refresh, force: %s", force)
+        await self.update_global(force=force)
+        await self.update_ticker(force=force)
+        await self.update_fiat(force=force)
+
+    async def claim_refresh(self, seconds):
+        """
+        Take the shared refresh lock for :code:`seconds`, True if we got it. The process
+        holding it fetches from upstream, the others pick its data up from Redis.
+        """
+        try:
+            res = await self._redis_db.exec(
+                'set', self.REDIS_KEY_REFRESH_LOCK, self._lock_token, 'EX', seconds, 'NX')
+        except Exception as e:
+            logger.error("claim_refresh error: %s", e)
+            return False
+
+        return res is not None
+
+    async def release_refresh(self):
+        """
+        Give the refresh lock up, if we hold it, so another process can try.
+        """
+        try:
+            holder = await self._redis_db.exec('get', self.REDIS_KEY_REFRESH_LOCK)
+            if holder and holder.decode('utf-8') == self._lock_token:
+                await self._redis_db.exec('del', self.REDIS_KEY_REFRESH_LOCK)
+        except Exception as e:
+            logger.error("release_refresh error: %s", e)
 
     async def update(self):
+        """
+        Make sure market data is available. The background refresher keeps it current,
+        so this only waits on a load when the process has no data at all.
+        """
         logger.debug("CryptoWorld update...")
-        await self.update_global()
-        await self.update_ticker()
+        self._refresher.ensure_running()
+
+        if self.has_data:
+            return
+
+        await self._flight.do('update', self.refresh)
 
     async def fuzzy_match(self, tokens):
         logger.debug("fuzzy_match %s", tokens)
+
+        with FUZZY_MATCH_SECONDS.time():
+            await self.update()
+            res = self._ticker.match(tokens)
+
+        logger.debug("fuzzy_matched %s", res)
+        return res
+
+    async def top(self, name='cap', n=10):
+        """
+        The top :code:`n` coins by a ranking from :code:`slackbot.rankings.FIELDS`.
+        """
         await self.update()
+        return self._ticker.top(name, n)
 
-        symbols = set(tokens) & set(self._by_symbol.keys())
-        ids = (set(tokens) & set(self._by_id.keys())) - symbols
-        logger.debug("fuzzy_matched symbols/ids %s %s", symbols, ids)
+    async def movers(self, name='24h', n=5):
+        """
+        The biggest gainers and losers over 1h, 24h or 7d.
+        """
+        await self.update()
+        return self._ticker.movers(name, n)
 
-        res = []
-        if symbols:
-            for s in symbols:
-                res.append(self._by_symbol[s])
+    def quote(self, coins):
+        """
+        The price reply for :code:`coins`, as matched from the current snapshot. Replies
+        are rendered once per snapshot and set of coins, repeats are a dict lookup.
+        """
+        snapshot = self._ticker
 
-        if ids:
-            for id in ids:
-                res.append(self._by_id[id])
+        if not all(snapshot.owns(bc) for bc in coins):
+            # Matched against a snapshot that has since been replaced, render as is.
+            return '\n'.join(bc.slack_str for bc in coins)
 
-        logger.debug("fuzzy_matched %s", res)
-        return res
+        key = (snapshot.version, tuple(bc.index for bc in coins))
+        reply = self._replies.get(key)
+
+        if reply is None:
+            reply = '\n'.join(snapshot.fragment(bc.index) for bc in coins)
+            self._replies.set(key, reply)
+
+        return reply
+
+    def symbol_of(self, bc_id):
+        bc = self._by_id.get(bc_id)
+        return bc.symbol if bc is not None else None
+
+    def price_window(self, coins, window):
+        """
+        :code:`WindowStats` over the last :code:`window` seconds for each coin in
+        :code:`coins`, or :code:`None` for coins without history.
+        """
+        stats = self._history.window(window, [bc['id'] for bc in coins])
+        return [stats.get(bc['id']) for bc in coins]
 
     def __str__(self):
         return (
@@ -0,0 +1,94 @@
+import logging
+from backends.memory import TTLCache
+
+"""
+Event Deduplication
+*******************
+
+Slack resends an event, with the same :code:`event_id`, when it doesn't get an ack in
+time. :code:`EventDeduper` remembers the event ids it has seen, first in a bounded in
+process cache and then with a Redis :code:`SET NX EX` so a retry landing on another
+worker is caught too. Duplicates are dropped before any ticker, database or HTTP work.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventDeduper(object):
+    REDIS_PREFIX = 'slack_event:'
+
+    def __init__(self, redis, ttl=3600, maxsize=10000):
+        """
+        :param ttl: Seconds an event id is remembered for, Slack retries within minutes.
+        :param maxsize: The number of event ids remembered in process.
+        """
+        self._redis = redis
+        self._ttl = ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._local_dupes = 0
+        self._redis_dupes = 0
+        self._errors = 0
+
+    async def seen(self, event_id):
+        """
+        True if :code:`event_id` was already seen, by this or any other process.
+        Marks it as seen otherwise.
+        """
+        if not event_id:
+            return False
+
+        if self._local.get(event_id):
+            self._local_dupes += 1
+            logger.debug("EventDeduper local duplicate %s", event_id)
+            return True
+
+        self._local.set(event_id, True)
+
+        try:
+            res = await self._redis.exec(
+                'set', f'{self.REDIS_PREFIX}{event_id}', 1, 'EX', self._ttl, 'NX')
+        except Exception as e:
+            # Fail open, a rare duplicate reply beats dropping events while Redis is down.
+            self._errors += 1
+            logger.error("EventDeduper Redis error: %s", e)
+            return False
+
+        if res is None:
+            self._redis_dupes += 1
+            logger.debug("EventDeduper Redis duplicate %s", event_id)
+            return True
+
+        return False
+
+    async def forget(self, event_id):
+        """
+        Unmark :code:`event_id`, for an event we saw but couldn't accept, so Slack's
+        retry of it isn't taken for a duplicate.
+        """
+        if not event_id:
+            return
+
+        self._local.delete(event_id)
+
+        try:
+            await self._redis.exec('del', f'{self.REDIS_PREFIX}{event_id}')
+        except Exception as e:
+            self._errors += 1
+            logger.error("EventDeduper Redis error: %s", e)
+
+    @property
+    def local(self):
+        return self._local
+
+    @property
+    def suppressed(self):
+        return self._local_dupes + self._redis_dupes
+
+    def stats(self):
+        return {
+            'suppressed': self.suppressed,
+            'suppressed_local': self._local_dupes,
+            'suppressed_redis': self._redis_dupes,
+            'errors': self._errors,
+        }
@@ -0,0 +1,182 @@
+import re
+import time
+import bisect
+import logging
+from array import array
+
+"""
+Price History
+*************
+
+A fixed size, in memory history of coin prices, one row per ticker snapshot.
+
+Every coin's prices live in their own :code:`array` column sharing one ring of slots and
+timestamps, so a time window is always one or two contiguous slices of every column and
+the window statistics for all coins are computed with C level slicing, :code:`min`,
+:code:`max` and :code:`sum` rather than Python loops over the samples.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+WINDOW_RE = re.compile(r'^(\d+)([mhdw])$')
+WINDOW_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_window(token):
+    """
+    Parse a window like :code:`30m`, :code:`6h`, :code:`2d` or :code:`1w` into seconds,
+    :code:`None` if :code:`token` isn't a window.
+    """
+    m = WINDOW_RE.match(token)
+
+    if not m or not int(m.group(1)):
+        return None
+
+    return int(m.group(1)) * WINDOW_UNITS[m.group(2)]
+
+
+class WindowStats(object):
+    __slots__ = ('first', 'last', 'low', 'high', 'mean', 'samples', 'span')
+
+    def __init__(self, values, span):
+        self.first = values[0]
+        self.last = values[-1]
+        self.low = min(values)
+        self.high = max(values)
+        self.mean = sum(values) / len(values)
+        self.samples = len(values)
+        self.span = span
+
+    @property
+    def change(self):
+        """
+        Percent change from the first to the last price in the window.
+        """
+        if not self.first:
+            return 0.0
+
+        return (self.last - self.first) / self.first * 100
+
+    def slack_str(self, label):
+        res = (
+            f'\t{label}: {self.change:+.2f}%,\t'
+            f'low: ${self.low:2.2f},\thigh: ${self.high:2.2f},\tavg: ${self.mean:2.2f}'
+        )
+
+        if self.samples < 2:
+            res += ' (no history yet)'
+
+        return res
+
+    def __repr__(self):
+        return f'<WindowStats {self.change:+.2f}% over {self.samples} samples>'
+
+
+class PriceHistory(object):
+    def __init__(self, capacity=288):
+        """
+        :param capacity: The number of snapshots kept, the default is a day of
+            coinmarketcap's five minute updates.
+        """
+        self._capacity = capacity
+        self._ts = array('d', [0.0] * capacity)
+        self._prices = {}
+        self._first_seen = {}
+        self._head = 0
+        self._seq = 0
+
+    def __len__(self):
+        return min(self._seq, self._capacity)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def newest(self):
+        return self._ts[self._head - 1] if self._seq else None
+
+    @property
+    def oldest(self):
+        if not self._seq:
+            return None
+
+        return self._ts[(self._head - len(self)) % self._capacity]
+
+    def append(self, store, ts=None):
+        """
+        Record the prices of every coin in a :code:`TickerStore`.
+        Coins missing from the store carry their last known price forward.
+        """
+        ts = time.time() if ts is None else ts
+        slot = self._head
+        prev = (slot - 1) % self._capacity
+        seen = set()
+
+        for coin_id, price in zip(store.column('id'), store.column('price_usd')):
+            col = self._prices.get(coin_id)
+
+            if col is None:
+                col = self._prices[coin_id] = array('d', [0.0] * self._capacity)
+                self._first_seen[coin_id] = self._seq
+
+            col[slot] = price
+            seen.add(coin_id)
+
+        for coin_id, col in self._prices.items():
+            if coin_id not in seen:
+                col[slot] = col[prev]
+
+        self._ts[slot] = ts
+        self._head = (slot + 1) % self._capacity
+        self._seq += 1
+
+    def _tail(self, col, n):
+        """
+        The last :code:`n` samples of :code:`col`, oldest first.
+        """
+        head = self._head
+
+        if n <= head:
+            return col[head - n:head]
+
+        return col[self._capacity - (n - head):] + col[:head]
+
+    def _window_size(self, window, now):
+        """
+        The number of newest samples that fall within :code:`window` seconds of :code:`now`,
+        along with all of the sample timestamps.
+        """
+        ts = self._tail(self._ts, len(self))
+
+        # The timestamps are ascending, bisect for the first sample inside the window.
+        return len(ts) - bisect.bisect_left(ts, now - window), ts
+
+    def window(self, window, coin_ids=None, now=None):
+        """
+        :code:`WindowStats` over the last :code:`window` seconds for :code:`coin_ids`,
+        or for every coin, as a dict keyed by coin id. Coins without samples in the
+        window are left out.
+        """
+        now = time.time() if now is None else now
+        size, ts = self._window_size(window, now)
+
+        if not size:
+            return {}
+
+        if coin_ids is None:
+            coin_ids = self._prices.keys()
+
+        res = {}
+        for coin_id in coin_ids:
+            col = self._prices.get(coin_id)
+            if col is None:
+                continue
+
+            n = min(size, self._seq - self._first_seen[coin_id])
+            if n > 0:
+                res[coin_id] = WindowStats(self._tail(col, n), ts[-1] - ts[-n])
+
+        return res
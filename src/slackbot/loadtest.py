@@ -0,0 +1,490 @@
+import asyncio
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import random
+import time
+from collections import Counter, deque
+import aiohttp
+from apistar import Command
+from yarl import URL
+from settings import settings
+
+"""
+Load Test
+*********
+
+Replays Slack Events API traffic against the :code:`/listening` endpoint to find how
+many events a second one worker takes before it misses Slack's 3 second ack deadline.
+
+The traffic is a mix of the messages a busy workspace sends: price, conversion and
+ranking commands, chatter that's none of ours, Slack's retries of events it already
+sent and the odd URL verification. Events carry the verification token, and are also
+signed when a signing secret is given.
+
+Commands only get past the team lookup for installed teams, so before the run the
+:code:`--teams` teams are installed through the bot's :code:`/thanks` OAuth redirect,
+which needs the bot's :code:`SLACK_API_URL` pointed at the fake Slack, see
+:code:`src/fakes`. Teams already installed can be given with :code:`--team` instead.
+
+It runs open loop at a fixed :code:`--rate`, latency then counts from when each request
+was due so a slow server can't hide its queueing, or closed loop with
+:code:`--concurrency` senders each waiting on its last answer. Throughput, latency
+percentiles and outcomes are printed and saved to a JSON file to compare runs by.
+
+::
+
+    $ apistar loadtest --rate 200 --duration 60
+    $ apistar loadtest --concurrency 50 --requests 10000 --output before.json
+    $ apistar loadtest --rate 50 --team T0AB12CD3,T0EF45GH6
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+SYMBOLS = ('btc', 'eth', 'xrp', 'bch', 'ltc', 'ada', 'xlm', 'neo', 'eos', 'doge', 'iota')
+CURRENCIES = ('eur', 'gbp', 'jpy', 'btc')
+CHATTER = (
+    'anyone up for lunch?',
+    'deploy is done',
+    'lol',
+    'can someone review my PR',
+    'brb',
+    'the standup moved to 10:30',
+)
+
+
+def command_text(rnd):
+    """
+    The text of a random bot command, weighted roughly as they're used.
+    """
+    roll = rnd.random()
+    coins = ' '.join(rnd.sample(SYMBOLS, rnd.randint(1, 3)))
+
+    if roll < 0.6:
+        return f'price {coins}'
+
+    if roll < 0.7:
+        return f'price {coins} in {rnd.choice(CURRENCIES)}'
+
+    if roll < 0.8:
+        return f'convert {rnd.randint(1, 500) / 10} {rnd.choice(SYMBOLS)} to {rnd.choice(SYMBOLS)}'
+
+    if roll < 0.9:
+        return f'top {rnd.choice((5, 10, 20))}'
+
+    return f'movers {rnd.choice(("1h", "24h", "7d"))}'
+
+
+def sign(secret, timestamp, body):
+    """
+    Slack's :code:`X-Slack-Signature` for :code:`body`.
+    """
+    base = b'v0:' + str(timestamp).encode('utf-8') + b':' + body
+    return 'v0=' + hmac.new(secret.encode('utf-8'), base, hashlib.sha256).hexdigest()
+
+
+class EventFactory(object):
+    """
+    Builds Events API requests, as :code:`(kind, body, headers)`.
+    """
+    MESSAGE = 'message'
+    CHATTER = 'chatter'
+    RETRY = 'retry'
+    CHALLENGE = 'challenge'
+
+    def __init__(self, token, teams, signing_secret='', channels=20, users=50,
+                 retry_ratio=0.05, challenge_ratio=0.01, chatter_ratio=0.2, seed=0):
+        """
+        :param teams: Ids of the installed teams events are sent from.
+        :param retry_ratio: The share of requests that are retries of an earlier event.
+        :param challenge_ratio: The share of requests that are URL verifications.
+        :param chatter_ratio: The share of messages that aren't bot commands.
+        """
+        self._token = token
+        self._signing_secret = signing_secret
+        self._random = random.Random(seed)
+        self._teams = list(teams)
+        self._channels = [f'CLOAD{i:04d}' for i in range(channels)]
+        self._users = [f'ULOAD{i:04d}' for i in range(users)]
+        self._retry_ratio = retry_ratio
+        self._challenge_ratio = challenge_ratio
+        self._chatter_ratio = chatter_ratio
+        self._sent = deque(maxlen=1000)
+        self._count = 0
+        self._prefix = f'{seed:x}{int(time.time()):x}'
+
+    def _headers(self, body, extra=None):
+        headers = {'Content-Type': 'application/json'}
+
+        if self._signing_secret:
+            timestamp = int(time.time())
+            headers['X-Slack-Request-Timestamp'] = str(timestamp)
+            headers['X-Slack-Signature'] = sign(self._signing_secret, timestamp, body)
+
+        headers.update(extra or {})
+        return headers
+
+    def _message(self, text):
+        rnd = self._random
+        self._count += 1
+        now = time.time()
+
+        return {
+            'token': self._token,
+            'team_id': rnd.choice(self._teams),
+            'api_app_id': 'ALOADTEST',
+            'event': {
+                'type': 'message',
+                'user': rnd.choice(self._users),
+                'text': text,
+                'ts': '%.6f' % now,
+                'channel': rnd.choice(self._channels),
+                'event_ts': '%.6f' % now,
+                'channel_type': 'channel',
+            },
+            'type': 'event_callback',
+            'event_id': f'Ev{self._prefix}{self._count:08d}',
+            'event_time': int(now),
+            'authed_users': [],
+        }
+
+    def next(self):
+        rnd = self._random
+        roll = rnd.random()
+
+        if roll < self._challenge_ratio:
+            body = json.dumps({
+                'token': self._token,
+                'challenge': '%032x' % rnd.getrandbits(128),
+                'type': 'url_verification',
+            }).encode('utf-8')
+            return self.CHALLENGE, body, self._headers(body)
+
+        if roll < self._challenge_ratio + self._retry_ratio and self._sent:
+            # Slack resends an event it thinks we missed, same event_id and all.
+            body, tries = rnd.choice(self._sent)
+            tries[0] += 1
+            return self.RETRY, body, self._headers(body, {
+                'X-Slack-Retry-Num': str(tries[0]),
+                'X-Slack-Retry-Reason': 'http_timeout',
+            })
+
+        if rnd.random() < self._chatter_ratio:
+            kind, text = self.CHATTER, rnd.choice(CHATTER)
+        else:
+            kind, text = self.MESSAGE, command_text(rnd)
+
+        body = json.dumps(self._message(text)).encode('utf-8')
+        self._sent.append((body, [0]))
+        return kind, body, self._headers(body)
+
+
+async def install_teams(thanks_url, api_url, count, client_id, seed=0):
+    """
+    Install :code:`count` teams through the bot's OAuth redirect and return their ids.
+
+    Each OAuth code is first exchanged at :code:`api_url` for the team id it gives, the
+    fake Slack derives the same team from a code every time, then sent to the bot's
+    :code:`thanks_url` so the bot exchanges it again and saves the team.
+    """
+    teams = []
+
+    async with aiohttp.ClientSession() as session:
+        for i in range(count):
+            code = f'loadtest-{seed}-{i}'
+
+            async with session.post(f'{api_url}oauth.access',
+                                    data={'client_id': client_id, 'code': code}) as resp:
+                data = await resp.json()
+
+            if not data.get('ok'):
+                raise RuntimeError(f"oauth.access failed: {data.get('error')}")
+
+            async with session.get(thanks_url, params={'code': code, 'state': ''}) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f'{thanks_url} answered {resp.status}: {await resp.text()}')
+
+            teams.append(data['team_id'])
+
+    return teams
+
+
+def percentile(ordered, p):
+    """
+    The :code:`p` percentile, nearest rank, of an already sorted list.
+    """
+    if not ordered:
+        return None
+
+    return ordered[min(int(p * len(ordered)), len(ordered) - 1)]
+
+
+def latency_summary(latencies):
+    ordered = sorted(latencies)
+
+    if not ordered:
+        return {'count': 0}
+
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'p50': percentile(ordered, 0.50),
+        'p95': percentile(ordered, 0.95),
+        'p99': percentile(ordered, 0.99),
+        'max': ordered[-1],
+    }
+
+
+class LoadResult(object):
+    """
+    Latencies and outcomes of the requests of a run.
+    """
+    def __init__(self, deadline=3.0):
+        self._deadline = deadline
+        self._latencies = {}
+        self._outcomes = Counter()
+        self._errors = 0
+        self._late = 0
+
+    def add(self, kind, seconds, outcome, error=False):
+        self._latencies.setdefault(kind, []).append(seconds)
+        self._outcomes[outcome] += 1
+
+        if error:
+            self._errors += 1
+
+        if seconds > self._deadline:
+            self._late += 1
+
+    def summary(self, elapsed):
+        latencies = [s for values in self._latencies.values() for s in values]
+        count = len(latencies)
+
+        return {
+            'requests': count,
+            'elapsed': elapsed,
+            'throughput': count / elapsed if elapsed else 0.0,
+            'errors': self._errors,
+            'error_rate': self._errors / count if count else 0.0,
+            'missed_deadline': self._late,
+            'missed_deadline_rate': self._late / count if count else 0.0,
+            'latency': latency_summary(latencies),
+            'kinds': {k: latency_summary(v) for k, v in sorted(self._latencies.items())},
+            'outcomes': dict(self._outcomes.most_common()),
+        }
+
+
+class LoadTest(object):
+    def __init__(self, url, factory, rate=0.0, concurrency=10, duration=30.0, requests=0,
+                 deadline=3.0, timeout=10.0):
+        """
+        :param rate: Requests per second, open loop. :code:`0` runs closed loop.
+        :param concurrency: Senders in closed loop, the most connections in open loop.
+        :param duration: Seconds to run for, unless :code:`requests` is given.
+        :param requests: Requests to send in total.
+        :param deadline: Slack's ack deadline, slower answers are counted as missed.
+        :param timeout: Seconds before a request is given up on.
+        """
+        self._url = url
+        self._factory = factory
+        self._rate = rate
+        self._concurrency = concurrency
+        self._duration = duration
+        self._requests = requests
+        self._timeout = timeout
+        self._result = LoadResult(deadline)
+        self._sent = 0
+        self._stop_at = 0.0
+
+    def _more(self):
+        if self._requests:
+            return self._sent < self._requests
+
+        return time.monotonic() < self._stop_at
+
+    async def run(self):
+        connector = aiohttp.TCPConnector(limit=self._concurrency)
+        timeout = aiohttp.ClientTimeout(total=self._timeout)
+        start = time.monotonic()
+        self._stop_at = start + self._duration
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            if self._rate > 0:
+                await self._open_loop(session, start)
+            else:
+                await asyncio.gather(*[self._closed_loop(session)
+                                       for _ in range(self._concurrency)])
+
+        return self._result.summary(time.monotonic() - start)
+
+    async def _open_loop(self, session, start):
+        interval = 1.0 / self._rate
+        pending = set()
+
+        while self._more():
+            due = start + self._sent * interval
+            wait = due - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            self._sent += 1
+            pending.add(asyncio.ensure_future(self._send(session, due)))
+
+            if len(pending) >= 1000:
+                _, pending = await asyncio.wait(pending, timeout=0)
+
+        if pending:
+            await asyncio.wait(pending)
+
+    async def _closed_loop(self, session):
+        while self._more():
+            self._sent += 1
+            await self._send(session, time.monotonic())
+
+    async def _send(self, session, due):
+        """
+        Send one request, its latency counts from :code:`due`.
+        """
+        kind, body, headers = self._factory.next()
+        error = False
+
+        try:
+            async with session.post(self._url, data=body, headers=headers) as resp:
+                text = await resp.text()
+
+            if resp.status == 200:
+                try:
+                    data = json.loads(text)
+                except ValueError:
+                    data = {}
+
+                message = data.get('message') if isinstance(data, dict) else None
+                outcome = 'challenge' if 'challenge' in data else (message or 'ok').lower()
+            else:
+                error = resp.status >= 500
+                outcome = f'status_{resp.status}'
+        except asyncio.TimeoutError:
+            error, outcome = True, 'timeout'
+        except aiohttp.ClientError as e:
+            error, outcome = True, type(e).__name__
+
+        self._result.add(kind, time.monotonic() - due, outcome, error)
+
+
+def print_summary(summary):
+    latency = summary['latency']
+    print(f"requests: {summary['requests']}  elapsed: {summary['elapsed']:.1f}s  "
+          f"throughput: {summary['throughput']:.1f}/s")
+    print(f"errors: {summary['errors']} ({summary['error_rate']:.2%})  "
+          f"missed deadline: {summary['missed_deadline']} "
+          f"({summary['missed_deadline_rate']:.2%})")
+
+    print(f"{'kind':>12} {'count':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind, stats in [('all', latency)] + list(summary['kinds'].items()):
+        if not stats['count']:
+            continue
+
+        print(f"{kind:>12} {stats['count']:>8} " + ' '.join(
+            f"{stats[p] * 1000:>9.1f}" for p in ('p50', 'p95', 'p99', 'max')))
+
+    print('outcomes: ' + ', '.join(f'{k}={v}' for k, v in summary['outcomes'].items()))
+
+
+def loadtest(url: str = 'http://127.0.0.1:8080/listening', rate: float = 0.0,
+             concurrency: int = 10, duration: float = 30.0, requests: int = 0,
+             deadline: float = 3.0, retry_ratio: float = 0.05, challenge_ratio: float = 0.01,
+             chatter_ratio: float = 0.2, token: str = '', signing_secret: str = '',
+             team: str = '', teams: int = 5, slack_api_url: str = '',
+             seed: int = 0, output: str = ''):
+    """
+    Load test the Slack event endpoint and report throughput and latency
+
+    url: The bot's Slack event URL.
+    rate: Requests per second to send at, 0 sends as fast as the concurrency allows.
+    concurrency: Senders at 0 rate, otherwise the most connections open at once.
+    duration: Seconds to run for.
+    requests: Requests to send, overrides the duration.
+    deadline: Seconds to ack in, Slack's is 3.
+    retry_ratio: Share of requests that are Slack retries of an earlier event.
+    challenge_ratio: Share of requests that are URL verifications.
+    chatter_ratio: Share of messages that aren't bot commands.
+    token: Verification token, defaults to the one in the settings.
+    signing_secret: Sign requests with this Slack signing secret.
+    team: Comma separated ids of installed teams to send as, skips installing teams.
+    teams: Teams to install through the bot's /thanks page before the run.
+    slack_api_url: The fake Slack the bot talks to, defaults to the one in the settings.
+    seed: Random seed for the generated traffic.
+    output: JSON file for the results, defaults to a timestamped name.
+    """
+    slack = settings.get('SLACK', {})
+    token = token or slack.get('VERIFICATION_TOKEN', '')
+    loop = asyncio.get_event_loop()
+
+    team_ids = [t.strip() for t in team.split(',') if t.strip()]
+    if not team_ids:
+        thanks_url = str(URL(url).with_path('/thanks'))
+        api_url = slack_api_url or slack.get('API_URL', '')
+        print(f'Installing {teams} teams through {thanks_url}...')
+        team_ids = loop.run_until_complete(install_teams(
+            thanks_url, api_url, teams, slack.get('CLIENT_ID', ''), seed=seed))
+
+    factory = EventFactory(
+        token,
+        team_ids,
+        signing_secret=signing_secret,
+        retry_ratio=retry_ratio,
+        challenge_ratio=challenge_ratio,
+        chatter_ratio=chatter_ratio,
+        seed=seed,
+    )
+    test = LoadTest(
+        url,
+        factory,
+        rate=rate,
+        concurrency=concurrency,
+        duration=duration,
+        requests=requests,
+        deadline=deadline,
+        timeout=max(deadline * 3, 10.0),
+    )
+
+    started = datetime.datetime.utcnow()
+    mode = f'rate {rate}/s' if rate > 0 else f'concurrency {concurrency}'
+    print(f'Load testing {url} at {mode}...')
+
+    summary = loop.run_until_complete(test.run())
+    print_summary(summary)
+
+    output = output or started.strftime('loadtest-%Y%m%d-%H%M%S.json')
+    result = {
+        'started': started.isoformat() + 'Z',
+        'config': {
+            'url': url,
+            'rate': rate,
+            'concurrency': concurrency,
+            'duration': duration,
+            'requests': requests,
+            'deadline': deadline,
+            'retry_ratio': retry_ratio,
+            'challenge_ratio': challenge_ratio,
+            'chatter_ratio': chatter_ratio,
+            'signed': bool(signing_secret),
+            'teams': team_ids,
+            'seed': seed,
+        },
+        'summary': summary,
+    }
+
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    print(f'Results saved to {output}')
+
+
+commands = [
+    Command('loadtest', loadtest)
+]
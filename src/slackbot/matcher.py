@@ -0,0 +1,200 @@
+import logging
+from collections import defaultdict
+
+"""
+Coin Matcher
+************
+
+A prebuilt index for finding the coins mentioned in a message. Coins can be named by
+symbol, id or name, multi word names like *bitcoin cash* are matched as a phrase and
+longer words are matched with a typo, *bitcon*, or two in long ones, *etherium*.
+
+With thousands of coin names about, fuzzy matching is kept on a short leash so the
+ordinary words of a message don't turn into coins: it needs 6 letters or more and the
+first letter right, allows one edit below 8 letters, and never applies to common
+English words.
+
+Ambiguous symbols and names resolve to the coin with the largest market cap.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+# Words that show up in requests and should never be taken for a coin.
+STOPWORDS = frozenset((
+    'a', 'an', 'and', 'the', 'of', 'in', 'to', 'for', 'is', 'me', 'what', 'whats', 'how',
+    'please', 'price', 'prices', 'quote', 'value', 'worth', 'now', 'today', 'current',
+))
+
+# Common words of 6 letters or more, too close to too many coin names to fuzzy match.
+# An exact symbol, id or name still matches them.
+COMMON_WORDS = frozenset((
+    'against', 'alerts', 'almost', 'already', 'always', 'another', 'anyone', 'anything',
+    'around', 'because', 'before', 'better', 'between', 'bought', 'buying', 'change',
+    'crypto', 'currency', 'doesnt', 'dollar', 'dollars', 'dropped', 'during', 'either',
+    'enough', 'everyone', 'exchange', 'happened', 'higher', 'holding', 'however', 'invest',
+    'latest', 'little', 'market', 'markets', 'minute', 'minutes', 'morning', 'movers',
+    'nothing', 'people', 'prices', 'pretty', 'probably', 'pumping', 'really', 'selling',
+    'should', 'something', 'stocks', 'thanks', 'things', 'through', 'tomorrow', 'trading',
+    'update', 'volume', 'wallet', 'weekly', 'yesterday',
+))
+
+
+def trigrams(term):
+    padded = f'  {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """
+    Levenshtein distance between :code:`a` and :code:`b`, or :code:`limit + 1` as soon as
+    it's known to be larger than :code:`limit`.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    prev = list(range(len(b) + 1))
+
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        best = i
+
+        for j, cb in enumerate(b, 1):
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            cur.append(d)
+            best = min(best, d)
+
+        if best > limit:
+            return limit + 1
+
+        prev = cur
+
+    return prev[-1]
+
+
+class CoinMatcher(object):
+    """
+    Built once per ticker snapshot from its :code:`TickerStore`, :code:`match` returns
+    row indexes into that store.
+    """
+    # Shorter words are a letter away from too many names, steam/steem or crowd/crown.
+    MIN_FUZZY_LEN = 6
+
+    def __init__(self, store):
+        ids = store.column('id')
+        names = store.column('name')
+        symbols = store.column('symbol')
+        caps = store.column('market_cap_usd')
+
+        self._caps = caps
+        self._exact = {}
+        self._phrases = {}
+        self._max_words = 1
+        self._terms = {}
+        self._grams = defaultdict(list)
+
+        # Index the largest coins first so they win every collision.
+        for idx in sorted(range(len(store)), key=lambda i: caps[i], reverse=True):
+            for key in (symbols[idx].lower(), ids[idx].lower(), names[idx].lower()):
+                if not key:
+                    continue
+
+                words = key.split()
+                if len(words) > 1:
+                    self._phrases.setdefault(' '.join(words), idx)
+                    self._max_words = max(self._max_words, len(words))
+                    self._exact.setdefault(key.replace(' ', '-'), idx)
+                else:
+                    self._exact.setdefault(key, idx)
+
+            for term in (ids[idx].lower(), ' '.join(names[idx].lower().split())):
+                if len(term) >= self.MIN_FUZZY_LEN and term not in self._terms:
+                    self._terms[term] = idx
+
+        for term in self._terms:
+            for gram in trigrams(term):
+                self._grams[gram].append(term)
+
+        logger.debug(
+            "CoinMatcher built, %s exact keys, %s phrases, %s fuzzy terms",
+            len(self._exact), len(self._phrases), len(self._terms)
+        )
+
+    @staticmethod
+    def max_distance(token):
+        return 2 if len(token) >= 8 else 1
+
+    def fuzzy(self, token):
+        """
+        The row index of the closest id or name to :code:`token` within a small edit
+        distance, or :code:`None`.
+        """
+        if len(token) < self.MIN_FUZZY_LEN or token in COMMON_WORDS or not token[0].isalpha():
+            return None
+
+        limit = self.max_distance(token)
+        grams = trigrams(token)
+        # A term within `limit` edits still shares most of its trigrams with the token.
+        needed = max(len(grams) - 3 * limit, 1)
+
+        counts = defaultdict(int)
+        for gram in grams:
+            for term in self._grams.get(gram, ()):
+                counts[term] += 1
+
+        best = None
+        for term, count in counts.items():
+            # Typos almost never hit the first letter, near misses on it are other words.
+            if count < needed or term[0] != token[0]:
+                continue
+
+            d = edit_distance(token, term, limit)
+            if d > limit:
+                continue
+
+            # Closest first, then the largest coin.
+            idx = self._terms[term]
+            rank = (d, -self._caps[idx], idx)
+            if best is None or rank < best:
+                best = rank
+
+        return best and best[2]
+
+    def match_token(self, token):
+        if token in STOPWORDS:
+            return None
+
+        idx = self._exact.get(token)
+        if idx is None:
+            idx = self.fuzzy(token)
+
+        return idx
+
+    def match(self, tokens):
+        """
+        Return the row indexes of the coins named in :code:`tokens`, in the order they
+        were mentioned and without duplicates.
+        """
+        found = []
+        i = 0
+
+        while i < len(tokens):
+            idx = None
+            width = 1
+
+            for n in range(min(self._max_words, len(tokens) - i), 1, -1):
+                idx = self._phrases.get(' '.join(tokens[i:i + n]))
+                if idx is not None:
+                    width = n
+                    break
+
+            if idx is None:
+                idx = self.match_token(tokens[i])
+
+            if idx is not None and idx not in found:
+                found.append(idx)
+
+            i += width
+
+        return found
@@ -0,0 +1,16 @@
+from local_utils.metrics import registry
+
+"""
+Slackbot Metrics
+****************
+
+The metrics more than one module of the bot reports to, defined once here.
+"""
+
+
+STAGE_SECONDS = registry.histogram(
+    'slackbot_stage_seconds', 'Seconds spent in each stage of handling Slack events.', ('stage',))
+UPSTREAM_ERRORS = registry.counter(
+    'upstream_errors_total', 'Failed requests to upstream services.', ('upstream',))
+CACHE_HITS = registry.counter('cache_hits_total', 'Cache hits.', ('cache',))
+CACHE_MISSES = registry.counter('cache_misses_total', 'Cache misses.', ('cache',))
@@ -0,0 +1,300 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from email.utils import parsedate_to_datetime
+from backends.memory import TTLCache
+
+"""
+Outbound Slack Dispatcher
+*************************
+
+Every message the bot posts goes through :code:`SlackDispatcher`, which keeps us inside
+Slack's rate limits instead of finding out from a 429 and losing the reply.
+
+* Each workspace and each channel has a token bucket, a post waits for a token from both.
+* A 429's :code:`Retry-After` pauses the bucket it applies to and the post is retried.
+* Replies that pile up for a busy channel within a short window are merged into one
+  message, so a burst of "price btc" in one channel costs one post rather than many. A
+  lone reply to a quiet channel is posted straight away.
+* Buckets of channels and workspaces that have gone quiet are dropped, a bucket left
+  idle that long has refilled and is no different from a new one.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_retry_after(value, default=1.0, now=None):
+    """
+    Seconds to wait from a :code:`Retry-After` header, either a number of seconds or an
+    HTTP date, :code:`default` if it's missing or neither.
+    """
+    if value is None:
+        return default
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        when = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        logger.warning("SlackDispatcher bad Retry-After: %r", value)
+        return default
+
+    return max(when - (time.time() if now is None else now), 0.0)
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=1, timer=time.monotonic):
+        """
+        :param rate: Tokens added per second.
+        :param burst: The most tokens the bucket holds.
+        """
+        self._rate = rate
+        self._burst = burst
+        self._timer = timer
+        self._tokens = float(burst)
+        self._updated = timer()
+        self._paused_until = 0.0
+
+    def _fill(self):
+        now = self._timer()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        return now
+
+    def delay(self):
+        """
+        Seconds until a token is available, :code:`0` if one is available now.
+        """
+        now = self._fill()
+        wait = max(self._paused_until - now, 0.0)
+
+        if self._tokens < 1:
+            wait = max(wait, (1 - self._tokens) / self._rate)
+
+        return wait
+
+    def take(self):
+        self._fill()
+        self._tokens -= 1
+
+    def pause(self, seconds):
+        """
+        Hand out no tokens for :code:`seconds`, as asked by a :code:`Retry-After`.
+        """
+        self._paused_until = max(self._paused_until, self._timer() + seconds)
+        self._tokens = 0.0
+
+
+class _Pending(object):
+    __slots__ = ('text', 'future', 'queued')
+
+    def __init__(self, text, future, queued):
+        self.text = text
+        self.future = future
+        self.queued = queued
+
+
+class SlackDispatcher(object):
+    def __init__(self, send, channel_rate=1.0, channel_burst=1, team_rate=5.0, team_burst=10,
+                 coalesce_window=0.25, max_length=3500, max_retries=3, idle_ttl=300,
+                 max_buckets=10000, timer=time.monotonic):
+        """
+        :param send: Coroutine function :code:`send(team_id, channel_id, text)` that posts
+            the message and returns the HTTP response.
+        :param coalesce_window: Seconds to wait for more replies to a channel that
+            already has several waiting, before posting.
+        :param max_length: Replies are only merged up to this many characters.
+        :param idle_ttl: Seconds an unused bucket is kept, it must outlast any
+            :code:`Retry-After` pause.
+        :param max_buckets: The most channel, and workspace, buckets kept.
+        """
+        self._send = send
+        self._channel_rate = channel_rate
+        self._channel_burst = channel_burst
+        self._team_rate = team_rate
+        self._team_burst = team_burst
+        self._coalesce_window = coalesce_window
+        self._max_length = max_length
+        self._max_retries = max_retries
+        self._timer = timer
+        self._channel_buckets = TTLCache(maxsize=max_buckets, ttl=idle_ttl, timer=timer)
+        self._team_buckets = TTLCache(maxsize=max_buckets, ttl=idle_ttl, timer=timer)
+        self._pending = {}
+        self._workers = {}
+        self._posts = 0
+        self._messages = 0
+        self._coalesced = 0
+        self._rate_limited = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _bucket(self, buckets, key, rate, burst):
+        bucket = buckets.get(key)
+
+        if bucket is None:
+            bucket = TokenBucket(rate, burst, self._timer)
+
+        # Set on every use so only idle buckets expire.
+        buckets.set(key, bucket)
+        return bucket
+
+    async def post(self, team_id, channel_id, text):
+        """
+        Queue :code:`text` for a channel and wait for it to be posted.
+        Returns True once Slack accepted the message, possibly merged with others.
+        """
+        key = (team_id, channel_id)
+        future = asyncio.get_event_loop().create_future()
+        self._pending.setdefault(key, deque()).append(_Pending(text, future, self._timer()))
+        self._messages += 1
+
+        worker = self._workers.get(key)
+        if worker is None or worker.done():
+            self._workers[key] = asyncio.ensure_future(self._channel_worker(key))
+
+        return await future
+
+    def _take_batch(self, pending):
+        batch = [pending.popleft()]
+        length = len(batch[0].text)
+
+        while pending and length + len(pending[0].text) + 1 <= self._max_length:
+            item = pending.popleft()
+            length += len(item.text) + 1
+            batch.append(item)
+
+        return batch
+
+    async def _wait_for_tokens(self, channel, team):
+        while True:
+            delay = max(channel.delay(), team.delay())
+            if not delay:
+                break
+
+            await asyncio.sleep(delay)
+
+        channel.take()
+        team.take()
+
+    @staticmethod
+    def _settle(batch, result):
+        """
+        Resolve the futures of :code:`batch` still waiting, with :code:`result` or, for an
+        exception, by raising it in their :code:`post` calls.
+        """
+        for item in batch:
+            if item.future.done():
+                continue
+
+            if isinstance(result, BaseException):
+                item.future.set_exception(result)
+            else:
+                item.future.set_result(result)
+
+    async def _channel_worker(self, key):
+        team_id, channel_id = key
+        pending = self._pending[key]
+        batch = []
+        cancelled = False
+
+        try:
+            channel = self._bucket(
+                self._channel_buckets, key, self._channel_rate, self._channel_burst)
+            team = self._bucket(self._team_buckets, team_id, self._team_rate, self._team_burst)
+
+            while pending:
+                if len(pending) > 1:
+                    # A busy channel, give its replies a moment to pile up and merge.
+                    await asyncio.sleep(self._coalesce_window)
+
+                await self._wait_for_tokens(channel, team)
+
+                batch = self._take_batch(pending)
+                await self._post_batch(key, batch, channel, team)
+        except asyncio.CancelledError:
+            # Shutting down, nobody is left to post what's queued.
+            cancelled = True
+            self._settle(batch, False)
+            self._settle(pending, False)
+            pending.clear()
+            raise
+        except Exception as e:
+            logger.error("SlackDispatcher worker for %s error: %s", key, e)
+            self._failed += 1
+            failed = [item for item in batch if not item.future.done()]
+            if not failed and pending:
+                # Fail at least one message, so a worker that keeps failing still works
+                # through the queue rather than being replaced forever.
+                failed = self._take_batch(pending)
+            self._settle(failed, e)
+        finally:
+            # Nothing awaits between the loop check and here, so no post can slip in.
+            self._workers.pop(key, None)
+
+            if not pending:
+                self._pending.pop(key, None)
+            elif not cancelled:
+                self._workers[key] = asyncio.ensure_future(self._channel_worker(key))
+
+    async def _post_batch(self, key, batch, channel, team):
+        team_id, channel_id = key
+        now = self._timer()
+
+        for item in batch:
+            wait = now - item.queued
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+
+        text = '\n'.join(item.text for item in batch)
+        ok = False
+
+        for attempt in range(self._max_retries + 1):
+            try:
+                resp = await self._send(team_id, channel_id, text)
+            except Exception as e:
+                logger.error("SlackDispatcher send error: %s", e)
+                break
+
+            if resp.status != 429:
+                ok = resp.status == 200
+                if not ok:
+                    logger.error('problem while posting slack message. %s', resp)
+                break
+
+            self._rate_limited += 1
+            retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+            logger.warning(
+                "SlackDispatcher rate limited on %s, retry after %ss", key, retry_after)
+
+            # Slack doesn't say which limit we hit, hold back the whole workspace.
+            channel.pause(retry_after)
+            team.pause(retry_after)
+            await self._wait_for_tokens(channel, team)
+
+        self._posts += 1
+        self._coalesced += len(batch) - 1
+        if not ok:
+            self._failed += 1
+
+        for item in batch:
+            if not item.future.done():
+                item.future.set_result(ok)
+
+    def stats(self):
+        return {
+            'messages': self._messages,
+            'posts': self._posts,
+            'coalesced': self._coalesced,
+            'rate_limited': self._rate_limited,
+            'failed': self._failed,
+            'pending': sum(len(p) for p in self._pending.values()),
+            'channels': len(self._channel_buckets),
+            'wait_avg': self._wait_total / self._messages if self._messages else 0.0,
+            'wait_max': self._wait_max,
+        }
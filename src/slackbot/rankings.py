@@ -0,0 +1,110 @@
+import heapq
+import logging
+
+"""
+Rankings
+********
+
+Market wide rankings over a ticker snapshot: the top coins by market cap or volume and
+the biggest movers over 1h, 24h or 7d.
+
+Rankings use a partial selection, :code:`heapq`, over the snapshot's columns instead of
+sorting every coin, and each result is cached on the snapshot so repeated requests are a
+dict lookup until the next snapshot replaces it.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+# Ranking names used in bot commands mapped to the TickerStore column they rank by.
+FIELDS = {
+    'cap': 'market_cap_usd',
+    'volume': '24h_volume_usd',
+    '1h': 'percent_change_1h',
+    '24h': 'percent_change_24h',
+    '7d': 'percent_change_7d',
+}
+
+FIELD_ALIASES = {
+    'marketcap': 'cap', 'mcap': 'cap', 'vol': 'volume',
+    'hour': '1h', 'day': '24h', '1d': '24h', 'week': '7d', '1w': '7d',
+}
+
+MAX_N = 50
+
+
+def ranking_field(token):
+    """
+    The ranking name for a command token, :code:`None` if it doesn't name one.
+    """
+    token = FIELD_ALIASES.get(token, token)
+    return token if token in FIELDS else None
+
+
+class Rankings(object):
+    """
+    Rankings for one :code:`TickerSnapshot`, results are row indexes into its store.
+    """
+    def __init__(self, store, movers_universe=200):
+        """
+        :param movers_universe: Only this many of the largest coins by market cap are
+            considered for movers, so illiquid micro caps don't crowd out the list.
+        """
+        self._store = store
+        self._movers_universe = movers_universe
+        self._cache = {}
+
+    def _select(self, field, n, largest=True, among=None):
+        key = (field, n, largest, among is not None)
+        res = self._cache.get(key)
+
+        if res is None:
+            col = self._store.column(field)
+            candidates = range(len(col)) if among is None else among
+            select = heapq.nlargest if largest else heapq.nsmallest
+            res = self._cache[key] = tuple(select(n, candidates, key=col.__getitem__))
+            logger.debug("Rankings computed %s", key)
+
+        return res
+
+    def top(self, name='cap', n=10):
+        """
+        The :code:`n` coins with the largest value for ranking :code:`name`.
+        """
+        return self._select(FIELDS[name], min(n, MAX_N))
+
+    def movers(self, name='24h', n=5):
+        """
+        The :code:`n` biggest gainers and losers over :code:`name`, one of 1h, 24h or 7d.
+        """
+        n = min(n, MAX_N)
+        field = FIELDS[name]
+        among = self._select(FIELDS['cap'], self._movers_universe)
+
+        return (
+            self._select(field, n, largest=True, among=among),
+            self._select(field, n, largest=False, among=among),
+        )
+
+
+def format_top(coins, name):
+    field = FIELDS[name]
+    lines = [f'*Largest {len(coins)} by {name}*']
+
+    for i, bc in enumerate(coins, 1):
+        value = bc.value(field)
+        value = f'{value:+.2f}%' if name in ('1h', '24h', '7d') else f'${value:,.0f}'
+        lines.append(f'{i}. *{bc.symbol}* \t*${bc.usd}*\t{name}: {value}')
+
+    return '\n'.join(lines)
+
+
+def format_movers(gainers, losers, name):
+    field = FIELDS[name]
+    lines = [f'*Biggest moves, {name}*', ':chart_with_upwards_trend: gainers']
+    lines += [f'\t*{bc.symbol}* \t*${bc.usd}*\t{bc.value(field):+.2f}%' for bc in gainers]
+    lines.append(':chart_with_downwards_trend: losers')
+    lines += [f'\t*{bc.symbol}* \t*${bc.usd}*\t{bc.value(field):+.2f}%' for bc in losers]
+
+    return '\n'.join(lines)
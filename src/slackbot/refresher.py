@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from local_utils.shutdown import on_shutdown
+
+"""
+Background Refresher
+********************
+
+Keeps the :code:`CryptoWorld` market data warm so price requests are answered from the
+last good snapshot instead of waiting on coinmarketcap.
+
+With several workers and dynos sharing one Redis, each round one process takes a short
+Redis lock and fetches from upstream, the others read the shared copy it writes.
+
+Components are built before the App's IOLoop is running (see the README), so the
+refresher can't be started from :code:`CryptoBot.__init__`. Instead it is started lazily
+from inside a request, on whatever loop is serving it, and restarted if it finds itself
+bound to a different loop.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+class Refresher(object):
+    def __init__(self, world, interval, retry_interval=30):
+        """
+        :param world: The :code:`CryptoWorld` to keep warm.
+        :param interval: Seconds between refreshes, should be shorter than the cache expiry.
+        :param retry_interval: Seconds to wait before trying again after a failed refresh.
+        """
+        self._world = world
+        self._interval = interval
+        self._retry_interval = min(retry_interval, interval)
+        self._loop = None
+        self._task = None
+        self._refreshes = 0
+        self._failures = 0
+        self._shutdown_hooked = False
+
+    @property
+    def running(self):
+        return bool(self._task and not self._task.done())
+
+    @property
+    def interval(self):
+        return self._interval
+
+    def ensure_running(self):
+        """
+        Start the refresh loop on the current event loop if it isn't already running there.
+        Must be called from within a coroutine on the serving loop.
+        """
+        loop = asyncio.get_event_loop()
+
+        if self.running and self._loop is loop:
+            return self._task
+
+        if self.running:
+            logger.debug("Refresher bound to another loop, restarting")
+            self._task.cancel()
+
+        logger.debug("Refresher starting, interval: %s", self._interval)
+        self._loop = loop
+        self._task = asyncio.ensure_future(self._run())
+
+        if not self._shutdown_hooked:
+            on_shutdown(self.close)
+            self._shutdown_hooked = True
+
+        return self._task
+
+    def stop(self):
+        if self.running:
+            self._task.cancel()
+
+        self._task = None
+        self._loop = None
+
+    async def close(self):
+        task = self._task
+        self.stop()
+
+        if task is not None:
+            await asyncio.wait([task])
+
+    async def _run(self):
+        # Warm from the shared cache first, another worker may have fresh data already.
+        first = True
+
+        while True:
+            force = False
+
+            try:
+                # After that only one process a round fetches from upstream, the others
+                # read what it wrote to Redis.
+                if not first:
+                    force = await self._world.claim_refresh(self._interval)
+
+                await self._world.refresh(force=force)
+                self._refreshes += 1
+                first = False
+                delay = self._interval
+                logger.debug("Refresher refreshed, upstream: %s, next in %ss", force, delay)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep serving the last good snapshot and try again soon.
+                self._failures += 1
+                delay = self._retry_interval
+                logger.error("Refresher refresh failed, retry in %ss: %s", delay, e)
+
+                if force:
+                    # Let whichever process comes next have a go at upstream.
+                    await self._world.release_refresh()
+
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'refreshes': self._refreshes,
+            'failures': self._failures,
+        }
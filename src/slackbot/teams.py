@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+from backends.memory import TTLCache
+from local_utils.singleflight import SingleFlight
+from local_utils.shutdown import on_shutdown
+
+"""
+Team Cache
+**********
+
+Team records, mostly wanted for their :code:`bot_access_token`, change only when a team
+(re)installs the app, yet they're needed for every message we post. :code:`TeamCache`
+keeps them in a bounded LRU/TTL cache in front of Postgres.
+
+When a team is upserted the entry is dropped locally and the team id is published on a
+Redis channel, every process listens on that channel and drops its own copy. The TTL
+bounds how stale a copy can get if an invalidation is ever missed.
+
+Each invalidation also bumps the team's generation. A fetch started before it neither
+caches the row it read nor is joined by callers arriving after it.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+
+class TeamCache(object):
+    CHANNEL = 'team_invalidate'
+
+    def __init__(self, asyncpg, redis, ttl=3600, maxsize=1024, retry_interval=5):
+        self._asyncpg = asyncpg
+        self._redis = redis
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._flight = SingleFlight()
+        self._retry_interval = retry_interval
+        self._loop = None
+        self._task = None
+        self._invalidations = 0
+        # Bumped for a team when it's invalidated, and for all of them when the cache is
+        # cleared, so a fetch can tell whether its row is still current.
+        self._generations = {}
+        self._epoch = 0
+        self._shutdown_hooked = False
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def flight(self):
+        return self._flight
+
+    def peek(self, team_id):
+        """
+        The cached record of :code:`team_id`, :code:`None` if it isn't cached.
+        """
+        return self._cache.get(team_id)
+
+    @staticmethod
+    def bot_user_id(team):
+        """
+        The user id of our bot in :code:`team`, from the OAuth response saved with it.
+        """
+        auth = team.get('auth') or {}
+        if isinstance(auth, str):
+            auth = json.loads(auth)
+
+        return (auth.get('bot') or {}).get('bot_user_id')
+
+    async def get(self, team_id):
+        self._ensure_listening()
+
+        team = self._cache.get(team_id)
+        if team is None:
+            generation = self._generation(team_id)
+            team = await self._flight.do(
+                (team_id, generation), self._fetch, team_id, generation)
+
+        return team
+
+    def _generation(self, team_id):
+        return self._epoch, self._generations.get(team_id, 0)
+
+    def _drop(self, team_id):
+        self._cache.delete(team_id)
+        self._generations[team_id] = self._generations.get(team_id, 0) + 1
+
+    async def _fetch(self, team_id, generation):
+        data = await self._asyncpg.fetch("SELECT * FROM team WHERE slack_id = $1", team_id)
+        logger.debug("TeamCache fetched %s : %s", team_id, data)
+
+        team = dict(data[0])
+        if self._generation(team_id) == generation:
+            self._cache.set(team_id, team)
+        else:
+            # Invalidated while we were reading, the row may be from before the upsert.
+            logger.debug("TeamCache %s invalidated during fetch, not cached", team_id)
+
+        return team
+
+    async def invalidate(self, team_id):
+        """
+        Drop :code:`team_id` here and in every other process.
+        """
+        self._drop(team_id)
+
+        try:
+            await self._redis.publish(self.CHANNEL, team_id)
+        except Exception as e:
+            logger.error("TeamCache invalidate publish error: %s", e)
+
+    def _ensure_listening(self):
+        loop = asyncio.get_event_loop()
+
+        if self._task and not self._task.done() and self._loop is loop:
+            return
+
+        self._loop = loop
+        self._task = asyncio.ensure_future(self._listen())
+
+        if not self._shutdown_hooked:
+            on_shutdown(self.close)
+            self._shutdown_hooked = True
+
+    async def _listen(self):
+        while True:
+            conn = None
+
+            try:
+                conn, (channel,) = await self._redis.subscribe(self.CHANNEL)
+                logger.debug("TeamCache listening on %s", self.CHANNEL)
+
+                while await channel.wait_message():
+                    team_id = await channel.get(encoding='utf-8')
+                    self._drop(team_id)
+                    self._invalidations += 1
+                    logger.debug("TeamCache invalidated %s", team_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("TeamCache listener error: %s", e)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+            # Anything cached may have missed an invalidation while we weren't listening.
+            self._cache.clear()
+            self._epoch += 1
+            await asyncio.sleep(self._retry_interval)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait([self._task])
+
+        self._task = None
+        self._loop = None
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats['invalidations'] = self._invalidations
+        return stats
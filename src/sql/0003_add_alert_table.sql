@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS alert (
+    id bigserial,
+    PRIMARY KEY (id)
+);
+
+ALTER TABLE IF EXISTS alert
+ADD COLUMN IF NOT EXISTS team_id varchar(32) NOT NULL,
+ADD COLUMN IF NOT EXISTS channel_id varchar(32) NOT NULL,
+ADD COLUMN IF NOT EXISTS user_id varchar(32),
+ADD COLUMN IF NOT EXISTS coin_id varchar(64) NOT NULL,
+ADD COLUMN IF NOT EXISTS direction varchar(8) NOT NULL,
+ADD COLUMN IF NOT EXISTS threshold double precision NOT NULL,
+ADD COLUMN IF NOT EXISTS created timestamp with time zone DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS alert_channel_index ON alert (team_id, channel_id);
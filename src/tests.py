@@ -1,20 +1,1579 @@
+import asyncio
+import pytest
+import json
+import codecs
+import random
+import time
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
 from apistar.test import TestClient
-from app import app, welcome
+from app import app
+from fakes import FakeMarket, FakeSlack, make_app
+from settings import settings
+from backends.redis import Redis
+from backends.asyncpg import AsyncPgBackend
+from aioclient.client import Client
+from slackbot.component import CryptoBot
+from aioclient.resilience import Resilience, CircuitBreaker, CircuitOpen, backoff
+from slackbot.commands import CommandRouter
+from slackbot.convert import CrossRates, UnknownRate, split_target
+from slackbot.metrics import CACHE_HITS
+from local_utils.metrics import registry
+from local_utils.jsonstream import JSONArrayDecoder
+from local_utils.singleflight import SingleFlight
+from backends.memory import TTLCache
+from aioredis import ReplyError
+from slackbot.alerts import AlertStore, ABOVE, BELOW
+from slackbot.app import handle_event
+from slackbot.dedup import EventDeduper
+from slackbot.teams import TeamCache
+from local_utils.workqueue import WorkQueue, QueueFull
+from slackbot.outbound import SlackDispatcher, TokenBucket, parse_retry_after
+from slackbot.crypto import CryptoWorld, Blockchain, BYTES_SAVED, payload_size
+from slackbot.refresher import Refresher
+from slackbot.history import PriceHistory
+from slackbot.crypto import TickerStore, TickerSnapshot
+from backends import codec as cache_codec
+from slackbot.matcher import CoinMatcher
+from benchmarks.market import synthetic_ticker
+from slackbot.loadtest import install_teams
 
 
-def test_welcome():
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def make_bot():
     """
-    Testing a view directly.
+    A :code:`CryptoBot` as the app builds it, nothing connects until it's used.
     """
-    data = welcome()
-    assert data == {'message': 'Welcome to API Star!'}
+    return CryptoBot(Redis(settings), settings, AsyncPgBackend(settings), Client(settings))
+
+
+class FakeRedis(object):
+    """
+    The few Redis commands we use, on a dict, expiry isn't modelled.
+    """
+    def __init__(self):
+        self.data = {}
+
+    async def exec(self, cmd, *args):
+        data = self.data
+
+        if cmd == 'get':
+            return data.get(args[0])
+
+        if cmd in ('set', 'setex'):
+            key, value = args[0], args[2] if cmd == 'setex' else args[1]
+            if 'NX' in args[2:] and key in data:
+                return None
+
+            data[key] = value if isinstance(value, bytes) else str(value).encode('utf-8')
+            return b'OK'
+
+        if cmd == 'del':
+            return sum(data.pop(k, None) is not None for k in args)
+
+        if cmd == 'expire':
+            return int(args[0] in data)
+
+        if cmd == 'append':
+            data[args[0]] = data.get(args[0], b'') + args[1]
+            return len(data[args[0]])
+
+        if cmd == 'rename':
+            if args[0] not in data:
+                return ReplyError('ERR no such key')
+            data[args[1]] = data.pop(args[0])
+            return b'OK'
 
+        if cmd == 'hmset':
+            data.setdefault(args[0], {}).update(
+                (k, v if isinstance(v, bytes) else str(v).encode('utf-8'))
+                for k, v in zip(args[1::2], args[2::2]))
+            return b'OK'
 
-def test_http_request():
+        if cmd == 'hmget':
+            fields = data.get(args[0], {})
+            return [fields.get(k) for k in args[1:]]
+
+        raise NotImplementedError(cmd)
+
+    async def transaction(self, *commands):
+        # Like MULTI/EXEC a failed command doesn't stop the others, and like
+        # Redis.transaction its error is then raised.
+        results = [await self.exec(*c) for c in commands]
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+        return results
+
+
+def test_url_verification():
     """
-    Testing a view, using the test client.
+    Slack's challenge is answered without touching any backend.
     """
     client = TestClient(app)
-    response = client.get('http://localhost/')
+    response = client.post('http://localhost/listening', json={'challenge': 'abc'})
+    assert response.status_code == 200
+    assert response.json() == {'challenge': 'abc'}
+
+
+def test_bad_verification_token():
+    client = TestClient(app)
+    response = client.post('http://localhost/listening', json={'token': 'nope'})
+    assert response.status_code == 403
+
+
+def test_metrics():
+    client = TestClient(app)
+    response = client.get('http://localhost/metrics')
     assert response.status_code == 200
-    assert response.json() == {'message': 'Welcome to API Star!'}
+    assert 'slackbot_events_total' in response.text
+
+
+def test_counters_read_from_component_stats():
+    bot = make_bot()
+    bot.api.l1.get('nothing-here')
+    text = registry.render()
+
+    assert text.count('# TYPE slackbot_stage_seconds histogram') == 1
+    assert 'cache_misses_total{cache="l1"} 1' in text
+    assert '# TYPE cache_size gauge' in text
+    assert not hasattr(CACHE_HITS.labels('l1'), 'set')
+
+    with pytest.raises(ValueError):
+        CACHE_HITS.read_from(lambda: 0)
+
+
+async def _fake_market():
+    market = FakeMarket(count=50, update_interval=0)
+
+    async with TestServer(make_app(market=market)) as server, ClientSession() as session:
+        url = str(server.make_url('/v1/ticker/'))
+
+        async with session.get(url, params={'limit': 0}) as resp:
+            assert resp.status == 200
+            coins = await resp.json()
+            etag = resp.headers['ETag']
+
+        assert len(coins) == 50
+        assert [c['rank'] for c in coins[:3]] == ['1', '2', '3']
+
+        async with session.get(url, params={'limit': 0}, headers={'If-None-Match': etag}) as resp:
+            assert resp.status == 304
+
+        async with session.get(url, params={'limit': 1, 'convert': 'EUR'}) as resp:
+            coin = (await resp.json())[0]
+            assert float(coin['price_eur']) > 0
+
+        async with session.get(str(server.make_url('/v1/global/'))) as resp:
+            assert (await resp.json())['active_currencies'] == 50
+
+    assert market.stats()['not_modified'] == 1
+
+
+def test_fake_market():
+    run(_fake_market())
+
+
+async def _fake_slack():
+    slack = FakeSlack(channel_rate=1.0, channel_burst=1)
+
+    async with TestServer(make_app(slack=slack)) as server, ClientSession() as session:
+        async with session.post(str(server.make_url('/api/oauth.access')),
+                                data={'client_id': 'id', 'code': 'abc'}) as resp:
+            team = await resp.json()
+
+        assert team['ok'] and team['team_id'].startswith('T')
+
+        url = str(server.make_url('/api/chat.postMessage'))
+        headers = {'Authorization': f'Bearer {team["bot"]["bot_access_token"]}'}
+        message = {'channel': 'C1', 'text': 'hi'}
+
+        async with session.post(url, headers=headers, json=message) as resp:
+            assert (await resp.json())['ok']
+
+        async with session.post(url, headers=headers, json=message) as resp:
+            assert resp.status == 429
+            assert int(resp.headers['Retry-After']) >= 1
+
+    assert slack.stats()['posts'] == 1
+    assert slack.stats()['rate_limited'] == 1
+
+
+def test_fake_slack():
+    run(_fake_slack())
+
+
+async def _install_load_teams():
+    slack = FakeSlack()
+    installed = []
+    app = make_app(slack=slack)
+
+    async def thanks(request):
+        # Stands in for the bot, which exchanges the code and saves the team.
+        data = {'client_id': 'id', 'code': request.query['code']}
+
+        async with ClientSession() as session:
+            async with session.post(str(request.url.with_path('/api/oauth.access')),
+                                    data=data) as resp:
+                installed.append((await resp.json())['team_id'])
+
+        return web.Response(text='thanks')
+
+    app.router.add_get('/thanks', thanks)
+
+    async with TestServer(app) as server:
+        teams = await install_teams(
+            str(server.make_url('/thanks')), str(server.make_url('/api/')), 3, 'id')
+
+    assert teams == installed
+    assert len(set(teams)) == 3
+    assert slack.stats()['auths'] == 6
+
+
+def test_install_load_teams():
+    run(_install_load_teams())
+
+
+def test_refresh_lock():
+    """
+    One process a round gets to fetch from upstream, and can hand the round back.
+    """
+    redis = FakeRedis()
+    first, second = CryptoWorld(redis, None), CryptoWorld(redis, None)
+
+    assert run(first.claim_refresh(60))
+    assert not run(second.claim_refresh(60))
+
+    # Only the holder can release it.
+    run(second.release_refresh())
+    assert not run(second.claim_refresh(60))
+
+    run(first.release_refresh())
+    assert run(second.claim_refresh(60))
+
+
+def test_refresher_rounds():
+    """
+    The first refresh reads the shared copy, later ones fetch upstream only with the lock.
+    """
+    class World(object):
+        claims = [True, False]
+        forced = []
+
+        async def claim_refresh(self, seconds):
+            return self.claims.pop(0) if self.claims else False
+
+        async def refresh(self, force=False):
+            self.forced.append(force)
+
+        async def release_refresh(self):
+            pass
+
+    async def rounds():
+        refresher = Refresher(World(), 0.01)
+        refresher.ensure_running()
+        await asyncio.sleep(0.035)
+        await refresher.close()
+
+    run(rounds())
+    assert World.forced[:3] == [False, True, False]
+
+
+def test_blockchain_raw_and_typed():
+    """
+    Items and attributes keep upstream's strings, value() gives the parsed numbers.
+    """
+    bc = Blockchain.from_dict({
+        'id': 'bitcoin', 'symbol': 'btc', 'rank': '1', 'price_usd': '573.137',
+        'percent_change_24h': '-0.3', 'max_supply': None,
+    })
+
+    assert bc['rank'] == '1' and bc.rank == '1'
+    assert bc['price_usd'] == '573.137'
+    assert bc['max_supply'] is None
+    assert bc['id'] == 'bitcoin'
+    assert bc.value('rank') == 1
+    assert bc.value('price_usd') == 573.137
+    assert bc.value('max_supply') == 0
+    assert bc.symbol == 'BTC' and bc.one_day == -0.3
+
+
+REAL_COINS = (
+    ('bitcoin', 'Bitcoin', 'BTC'), ('ethereum', 'Ethereum', 'ETH'), ('ripple', 'Ripple', 'XRP'),
+    ('bitcoin-cash', 'Bitcoin Cash', 'BCH'), ('litecoin', 'Litecoin', 'LTC'),
+    ('cardano', 'Cardano', 'ADA'), ('stellar', 'Stellar', 'XLM'), ('monero', 'Monero', 'XMR'),
+    ('status', 'Status', 'SNT'), ('power-ledger', 'Power Ledger', 'POWR'),
+    ('storm', 'Storm', 'STORM'), ('maker', 'Maker', 'MKR'), ('verge', 'Verge', 'XVG'),
+    ('steem', 'Steem', 'STEEM'), ('crown', 'Crown', 'CRW'), ('quant', 'Quant', 'QNT'),
+    ('decent', 'Decent', 'DCT'), ('golem-network-tokens', 'Golem', 'GNT'),
+)
+
+
+def market_matcher(count=3000):
+    coins = synthetic_ticker(count)
+    for (coin_id, name, symbol), coin in zip(REAL_COINS, coins):
+        coin.update(id=coin_id, name=name, symbol=symbol)
+
+    return CoinMatcher(TickerStore(coins))
+
+
+def test_matcher_typos():
+    matcher = market_matcher()
+
+    def name(token):
+        idx = matcher.match_token(token)
+        return None if idx is None else REAL_COINS[idx][0]
+
+    assert name('bitcoin') == 'bitcoin'
+    assert name('bitcon') == 'bitcoin'
+    assert name('etherium') == 'ethereum'
+    assert name('litecion') == 'litecoin'
+    assert name('cardnao') is None
+    assert [REAL_COINS[i][0] for i in matcher.match(['bitcoin', 'cash', 'eth'])] == [
+        'bitcoin-cash', 'ethereum']
+
+
+def test_matcher_ignores_common_words():
+    """
+    Ordinary words in price and alert messages don't fuzzy match any of 3000 coins.
+    """
+    matcher = market_matcher()
+    words = (
+        'about above alert below could there where which would hello thanks lunch market '
+        'money people right think today price check watch while other great never still '
+        'think going happened really should dollar early later maybe quick every store makes '
+        'verse steam crowd quart golden recent'
+    ).split()
+
+    assert {w: matcher.match_token(w) for w in words if matcher.match_token(w) is not None} == {}
+
+
+def test_codec_keys_kept_from_old_workers():
+    """
+    Workers from before the cache codecs json.loads coin_ticker and coin_global, encoded
+    values must go elsewhere.
+    """
+    assert CryptoWorld.REDIS_KEY_TICKER not in ('coin_ticker', 'coin_global')
+    assert CryptoWorld.REDIS_KEY_GLOBAL not in ('coin_ticker', 'coin_global')
+
+
+def make_router():
+    router = CommandRouter()
+    router.add('Alerts!', ('alert', 'alerts'), 'alerts')
+    router.add('Pricing!', ('price', 'prices'), 'price')
+    router.add('Rankings!', ('top', 'movers'), 'rankings', strict=('top',))
+    return router
+
+
+def test_router_table():
+    router = make_router()
+
+    assert router.parse('good morning all') is None
+    assert router.parse('') is None
+    assert router.parse('Price, BTC?').route.handler == 'price'
+    assert router.parse('prices eth').verb == 'prices'
+    # A message with the verbs of two routes goes to the one added first.
+    assert router.parse('price alert btc above 3000').route.name == 'Alerts!'
+    assert router.parse('movers price').route.name == 'Pricing!'
+    assert [r.name for r in router.routes] == ['Alerts!', 'Pricing!', 'Rankings!']
+
+    with pytest.raises(ValueError):
+        router.add('Again!', ('price',), 'again')
+
+
+def test_router_arguments():
+    router = make_router()
+
+    command = router.parse('alert ETH above $3,000.50!')
+    assert command.amounts == [3000.5]
+    assert command.words == ['alert', 'eth', 'above']
+    assert command.symbols == ['eth', 'above']
+    assert 'above' in command
+
+    command = router.parse('price btc 6h in eur')
+    assert command.window == 6 * 3600
+    assert command.window_label == '6h'
+    assert command.currencies == ('eur',)
+    assert command.symbols == ['btc', 'in']
+
+    assert router.parse('movers 1w').window == 7 * 24 * 3600
+
+    assert router.parse('price .5 btc').amounts == [0.5]
+    assert router.parse('price 0h').window is None
+
+
+def make_rates():
+    coins = synthetic_ticker(3)
+    for coin, usd, btc in zip(coins, ('8000', '400', '0'), ('1.0', '0.05', '0')):
+        coin['price_usd'], coin['price_btc'] = usd, btc
+
+    return CrossRates(TickerStore(coins), fiat={'eur': 1.25}, btc_index=0)
+
+
+def test_cross_rates():
+    rates = make_rates()
+
+    assert rates.currencies == {'usd', 'eur'}
+    assert rates.rate(0, 1) == 20.0
+    assert rates.convert(2.5, 0, 'usd') == 20000.0
+    assert rates.convert(100, 'eur', 'usd') == 125.0
+    # Coin to BTC comes straight from the ticker's price_btc.
+    assert rates.rate(1, 0) == 0.05
+    assert rates.price(0, 'eur') == 6400.0
+    assert rates.price(1, 0) == 0.05
+    assert rates.quotes('eur') is rates.quotes('eur')
+    assert list(rates.quotes('usd')) == [8000.0, 400.0, 0.0]
+
+    for unit in ('gbp', 2):
+        with pytest.raises(UnknownRate):
+            rates.rate(0, unit)
+
+    with pytest.raises(UnknownRate):
+        rates.price(2, 'eur')
+
+
+def test_split_target():
+    assert split_target(['btc', 'to', 'eth']) == (['btc'], ['eth'])
+    assert split_target(['money', 'in', 'btc', 'in', 'eur']) == (['money', 'in', 'btc'], ['eur'])
+    assert split_target(['btc']) == (['btc'], [])
+
+
+def test_chat_words_are_not_currencies():
+    router = make_router()
+
+    assert router.parse('price btc, i try').currencies == ()
+    assert 'try' in router.parse('price btc, i try').symbols
+    assert router.parse('price btc in try').currencies == ('try',)
+    assert router.parse('price btc to php eur').currencies == ('php', 'eur')
+    assert router.parse('prices php coin').currencies == ()
+
+    bot = make_bot()
+
+    async def fuzzy_match(words):
+        return []
+
+    bot._cw.fuzzy_match = fuzzy_match
+    assert run(bot._resolve_unit(['try'])) is None
+    assert run(bot._resolve_unit(['try'], target=True)) == ('try', 'try')
+    assert run(bot._resolve_unit(['eur'])) == ('eur', 'eur')
+
+
+def test_top_needs_to_lead_or_count():
+    """
+    'top' is an everyday word, it only routes first in a message or before a count.
+    """
+    router = make_bot().router
+
+    assert router.parse('lunch at the top of the hour') is None
+    assert router.parse('on top of that') is None
+    assert router.parse('top 20 volume').route.name == 'Rankings!'
+    assert router.parse('show me the top 10').amounts == [10.0]
+    assert router.parse('whats on top 24h').route.name == 'Rankings!'
+    assert router.parse('top').route.name == 'Rankings!'
+
+
+def test_bot_ignores_bots_and_itself():
+    bot = make_bot()
+    bot.teams.cache.set('T1', {'auth': '{"bot": {"bot_user_id": "UBOT"}}'})
+
+    def event(**body):
+        return {'team_id': 'T1', 'event': dict({'type': 'message', 'text': 'price btc'}, **body)}
+
+    assert bot.route(event(user='U1')).route.name == 'Pricing!'
+    assert bot.route(event(user='UBOT')) is None
+    assert bot.route(event(bot_id='B1')) is None
+    assert bot.route(event(user='U1', subtype='message_changed')) is None
+
+
+def test_replies_are_not_commands():
+    """
+    Help and status replies must never route back to the bot as commands.
+    """
+    bot = make_bot()
+    posted = []
+
+    class Alerts(object):
+        async def clear_channel(self, team_id, channel_id):
+            return 3
+
+        async def for_channel(self, team_id, channel_id):
+            return []
+
+    async def post_message(team_id, channel_id, text):
+        posted.append(text)
+
+    async def fuzzy_match(words):
+        return []
+
+    bot._alerts = Alerts()
+    bot._cw.fuzzy_match = fuzzy_match
+    bot.post_message = post_message
+
+    async def replies():
+        for text in ('alert clear', 'alerts', 'alert foo above 3000', 'convert 2 foo to bar'):
+            command = bot.router.parse(text)
+            await command.route.handler('T1', 'U1', 'C1', command)
+
+    run(replies())
+
+    assert len(posted) == 4
+    assert [t for t in posted if bot.router.parse(t)] == []
+
+
+class FakePubSub(object):
+    """
+    Redis publish and subscribe, delivered to every subscriber in this process.
+    """
+    class Channel(object):
+        def __init__(self):
+            self.queue = asyncio.Queue()
+
+        async def wait_message(self):
+            self.message = await self.queue.get()
+            return True
+
+        async def get(self, encoding=None):
+            return self.message
+
+    class Connection(object):
+        def close(self):
+            pass
+
+    def __init__(self):
+        self.channels = []
+        self.published = []
+
+    async def subscribe(self, name):
+        channel = self.Channel()
+        self.channels.append(channel)
+        return self.Connection(), [channel]
+
+    async def publish(self, name, message):
+        self.published.append(message)
+        for channel in self.channels:
+            channel.queue.put_nowait(message)
+
+
+class FakeAlertTable(object):
+    """
+    The alert table, answering the queries :code:`AlertStore` makes.
+    """
+    def __init__(self):
+        self.rows = {}
+        self.queries = []
+
+    def add(self, id, coin_id='ethereum', direction=ABOVE, threshold=3000.0):
+        self.rows[id] = {
+            'id': id, 'team_id': 'T1', 'channel_id': 'C1', 'user_id': 'U1',
+            'coin_id': coin_id, 'direction': direction, 'threshold': threshold,
+        }
+
+    async def fetch(self, query, *args):
+        self.queries.append(query.split()[0] + (' ANY' if 'ANY' in query else ''))
+
+        if query.startswith('INSERT'):
+            id = max(self.rows, default=0) + 1
+            self.add(id, *args[3:])
+            return [{'id': id}]
+
+        if query.startswith('DELETE'):
+            ids = [i for i, row in self.rows.items()
+                   if (row['id'],) == args or (row['team_id'], row['channel_id']) == args]
+            for i in ids:
+                del self.rows[i]
+            return [{'id': i} for i in ids]
+
+        assert query.startswith('SELECT')
+        if 'ANY' in query:
+            return [self.rows[i] for i in args[0] if i in self.rows]
+
+        return list(self.rows.values())
+
+
+def test_alert_sync_is_incremental():
+    """
+    The table is read in full once, after that only the rows other processes say
+    they've created are read, and their deletes are applied.
+    """
+    async def scenario():
+        table, pubsub = FakeAlertTable(), FakePubSub()
+        store, other = AlertStore(table, pubsub), AlertStore(table, pubsub)
+        table.add(1)
+        table.add(3)
+
+        # Once listening, the table is read again for what was missed before that.
+        for _ in range(2):
+            await store.sync()
+            await other.sync()
+            await asyncio.sleep(0)
+        assert store.book.ids() == {1, 3}
+
+        table.queries.clear()
+        created = await other.create('T1', 'C1', 'U1', 'bitcoin', BELOW, 100.0)
+        await other.claim(other.book.crossed('ethereum', 2900.0, 3100.0)[0])
+        await asyncio.sleep(0)
+        await store.sync()
+        assert store.book.ids() == {created.id, 3}
+        assert 'bitcoin' in store.book.coins()
+        assert table.queries == ['INSERT', 'DELETE', 'SELECT ANY']
+
+        await other.clear_channel('T1', 'C1')
+        await asyncio.sleep(0)
+        await store.sync()
+        assert len(store.book) == 0
+        # Our own create comes back to us and costs nothing.
+        assert table.queries == ['INSERT', 'DELETE', 'SELECT ANY', 'DELETE']
+        assert pubsub.published == ['+4', '-1', '-3,4']
+
+        await store.close()
+        await other.close()
+
+    run(scenario())
+
+
+def test_alert_sync_reloads_after_reconnect():
+    async def scenario():
+        table, pubsub = FakeAlertTable(), FakePubSub()
+        store = AlertStore(table, pubsub, retry_interval=0)
+        table.add(1)
+        await store.sync()
+        await asyncio.sleep(0)
+
+        # Changes made while the listener was down are only found by a full read.
+        await store.close()
+        table.add(2, direction=BELOW, threshold=100.0)
+        del table.rows[1]
+        await store.sync()
+        await asyncio.sleep(0)
+        await store.sync()
+        assert store.book.ids() == {2}
+        await store.close()
+
+    run(scenario())
+
+
+def test_alert_book_crossing():
+    table = FakeAlertTable()
+    store = AlertStore(table, FakePubSub())
+    table.add(1, threshold=3000.0)
+    table.add(2, direction=BELOW, threshold=2000.0)
+    book = run(store.sync())
+
+    assert book.crossed('ethereum', 2500.0, 2900.0) == []
+    assert [a.id for a in book.crossed('ethereum', 2900.0, 3000.0)] == [1]
+    assert [a.id for a in book.crossed('ethereum', 3000.0, 1500.0)] == [2]
+    assert len(book) == 0
+
+
+def test_alert_already_crossed_is_refused():
+    bot = make_bot()
+    posted = []
+    coin = Blockchain.from_dict({'id': 'ethereum', 'symbol': 'ETH', 'price_usd': '3200'})
+
+    class Alerts(object):
+        async def create(self, *args):
+            raise AssertionError('an alert that can never fire was stored')
+
+    async def post_message(team_id, channel_id, text):
+        posted.append(text)
+
+    async def fuzzy_match(words):
+        return [coin]
+
+    bot._alerts = Alerts()
+    bot._cw.fuzzy_match = fuzzy_match
+    bot.post_message = post_message
+
+    command = bot.router.parse('alert eth above 3000')
+    run(command.route.handler('T1', 'U1', 'C1', command))
+
+    assert 'already above' in posted[0]
+
+
+def test_deduper():
+    redis = FakeRedis()
+    first, second = EventDeduper(redis), EventDeduper(redis)
+
+    assert not run(first.seen('Ev1'))
+    assert run(first.seen('Ev1'))
+    # Another process catches it through Redis.
+    assert run(second.seen('Ev1'))
+    assert not run(first.seen(None))
+    assert first.stats()['suppressed_local'] == 1
+    assert second.stats()['suppressed_redis'] == 1
+
+
+def test_busy_event_is_retried_not_dropped():
+    """
+    An event turned away with a 503 while the queue is full is accepted on Slack's retry.
+    """
+    bot = make_bot()
+    bot._dedup = EventDeduper(FakeRedis())
+    queued = []
+
+    def enqueue_event(event, command=None):
+        if not queued:
+            queued.append(None)
+            raise QueueFull()
+
+        queued.append(event['event_id'])
+
+    bot.enqueue_event = enqueue_event
+    event = {
+        'token': bot.verification,
+        'event_id': 'Ev42',
+        'team_id': 'T1',
+        'event': {'type': 'message', 'user': 'U1', 'channel': 'C1', 'text': 'price btc'},
+    }
+
+    busy = run(handle_event(event, bot, settings))
+    assert busy.status == 503
+
+    assert run(handle_event(event, bot, settings)) == {'message': 'Queued'}
+    assert run(handle_event(event, bot, settings)) == {'message': 'Duplicate'}
+    assert queued == [None, 'Ev42']
+
+
+def test_full_queue_pushes_back():
+    """
+    With every worker busy and the queue full, events get a 503 and are forgotten
+    by the deduper, and the queue's wait and run times are exported.
+    """
+    bot = make_bot()
+    bot._dedup = EventDeduper(FakeRedis())
+    bot._queue = WorkQueue(concurrency=1, maxsize=1, name='test_events')
+    release = asyncio.Event()
+    dispatched = []
+
+    async def dispatch_event(event, command=None):
+        await release.wait()
+        dispatched.append(event['event_id'])
+
+    bot.dispatch_event = dispatch_event
+
+    def event(event_id):
+        return {
+            'token': bot.verification, 'event_id': event_id, 'team_id': 'T1',
+            'event': {'type': 'message', 'user': 'U1', 'channel': 'C1', 'text': 'price btc'},
+        }
+
+    async def scenario():
+        assert await handle_event(event('Ev1'), bot, settings) == {'message': 'Queued'}
+        await asyncio.sleep(0)
+        assert await handle_event(event('Ev2'), bot, settings) == {'message': 'Queued'}
+
+        busy = await handle_event(event('Ev3'), bot, settings)
+        assert busy.status == 503
+        assert not await bot.dedup.seen('Ev3')
+        assert bot.queue.stats()['rejected'] == 1
+
+        release.set()
+        await bot.queue.drain()
+
+    run(scenario())
+    assert dispatched == ['Ev1', 'Ev2']
+
+    text = registry.render()
+    assert 'workqueue_wait_seconds_count{queue="test_events"} 2' in text
+    assert 'workqueue_run_seconds_count{queue="test_events"} 2' in text
+
+
+def test_work_queue_drains_on_shutdown():
+    queue = WorkQueue(concurrency=2, maxsize=10, name='drain')
+    done = []
+
+    async def job(i, delay):
+        await asyncio.sleep(delay)
+        done.append(i)
+
+    async def scenario(delay, timeout):
+        for i in range(5):
+            queue.submit(job, i, delay)
+
+        await queue.drain(timeout)
+
+    # Everything queued is finished before the workers stop.
+    run(scenario(0.001, 5))
+    assert sorted(done) == [0, 1, 2, 3, 4]
+    assert queue.stats()['processed'] == 5 and queue.depth == 0
+
+    # Past the timeout the workers are stopped anyway.
+    del done[:]
+    run(scenario(10, 0.01))
+    assert done == []
+    assert queue.stats()['processed'] == 5
+
+
+class FakeResponse(object):
+    def __init__(self, status=200, headers=None):
+        self.status = status
+        self.headers = headers or {}
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(2.0, burst=2, timer=lambda: now[0])
+
+    bucket.take()
+    bucket.take()
+    assert bucket.delay() == 0.5
+
+    now[0] += 0.5
+    assert bucket.delay() == 0
+
+    bucket.pause(3)
+    assert bucket.delay() == 3
+
+
+def test_dispatcher_posts_lone_reply_at_once():
+    sent = []
+
+    async def send(team_id, channel_id, text):
+        sent.append(text)
+        return FakeResponse()
+
+    async def post():
+        dispatcher = SlackDispatcher(send, coalesce_window=5)
+        return await asyncio.wait_for(dispatcher.post('T1', 'C1', 'hi'), 1)
+
+    assert run(post()) is True
+    assert sent == ['hi']
+
+
+def test_dispatcher_coalesces_a_burst():
+    sent = []
+
+    async def send(team_id, channel_id, text):
+        sent.append(text)
+        return FakeResponse()
+
+    async def burst():
+        dispatcher = SlackDispatcher(send, channel_rate=100, coalesce_window=0.01)
+        results = await asyncio.gather(*[dispatcher.post('T1', 'C1', f'm{i}') for i in range(5)])
+        return results, dispatcher.stats()
+
+    results, stats = run(burst())
+    assert all(results)
+    assert '\n'.join(sent).split('\n') == [f'm{i}' for i in range(5)]
+    assert len(sent) < 5
+    assert stats['coalesced'] == 5 - len(sent)
+
+
+def test_dispatcher_retries_after_429():
+    statuses = [429, 200]
+
+    async def send(team_id, channel_id, text):
+        return FakeResponse(statuses.pop(0), {'Retry-After': '0.01'})
+
+    async def post():
+        dispatcher = SlackDispatcher(send)
+        return await dispatcher.post('T1', 'C1', 'hi'), dispatcher.stats()
+
+    ok, stats = run(post())
+    assert ok and stats['rate_limited'] == 1 and stats['failed'] == 0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('2') == 2.0
+    assert parse_retry_after('-1') == 0.0
+    assert parse_retry_after(None) == 1.0
+    assert parse_retry_after('soon', default=3) == 3
+    # An HTTP date, 30 seconds from now.
+    now = 1_500_000_000
+    assert parse_retry_after('Fri, 14 Jul 2017 02:40:30 GMT', now=now) == 30.0
+    assert parse_retry_after('Fri, 14 Jul 2017 02:40:00 GMT', now=now + 60) == 0.0
+
+
+def test_dispatcher_retry_after_date():
+    statuses = [429, 200]
+
+    async def send(team_id, channel_id, text):
+        return FakeResponse(statuses.pop(0), {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+
+    async def post():
+        dispatcher = SlackDispatcher(send, channel_rate=100, team_rate=100)
+        return await asyncio.wait_for(dispatcher.post('T1', 'C1', 'hi'), 1)
+
+    assert run(post()) is True
+
+
+def test_dispatcher_worker_failure_settles_every_post():
+    sent = []
+
+    async def send(team_id, channel_id, text):
+        sent.append(text)
+        return FakeResponse()
+
+    async def posts():
+        dispatcher = SlackDispatcher(send, channel_rate=100, coalesce_window=0, max_length=2)
+        post_batch = dispatcher._post_batch
+
+        async def broken_once(*args):
+            dispatcher._post_batch = post_batch
+            raise RuntimeError('boom')
+
+        dispatcher._post_batch = broken_once
+        results = await asyncio.wait_for(asyncio.gather(
+            *[dispatcher.post('T1', 'C1', f'm{i}') for i in range(3)],
+            return_exceptions=True), 1)
+        return results, dispatcher.stats()
+
+    # The batch being posted fails, a new worker posts the rest.
+    results, stats = run(posts())
+    assert isinstance(results[0], RuntimeError)
+    assert results[1:] == [True, True]
+    assert sent == ['m1', 'm2']
+    assert stats['failed'] == 1 and stats['pending'] == 0
+
+    async def cancelled():
+        dispatcher = SlackDispatcher(
+            send, channel_rate=0.001, channel_burst=1, coalesce_window=0, max_length=2)
+        posts = [asyncio.ensure_future(dispatcher.post('T1', 'C2', f'm{i}')) for i in range(3)]
+        await asyncio.sleep(0.01)
+        dispatcher._workers[('T1', 'C2')].cancel()
+        return await asyncio.wait_for(asyncio.gather(*posts), 1)
+
+    # Stopped for shutdown, what was still waiting is reported as not posted.
+    assert run(cancelled()) == [True, False, False]
+
+
+def test_dispatcher_drops_idle_buckets():
+    async def send(team_id, channel_id, text):
+        return FakeResponse()
+
+    async def posts():
+        dispatcher = SlackDispatcher(send, max_buckets=2)
+        for channel in ('C1', 'C2', 'C3', 'C4'):
+            await dispatcher.post('T1', channel, 'hi')
+
+        return dispatcher.stats()
+
+    assert run(posts())['channels'] == 2
+
+
+def test_circuit_breaker():
+    now = [100.0]
+    breaker = CircuitBreaker(failures=2, reset_timeout=10, timer=lambda: now[0])
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN and breaker.trips == 1
+    assert not breaker.allow()
+
+    now[0] += 10
+    assert breaker.allow() and breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN and breaker.trips == 2
+
+    # A trial that never reports back is replaced after another reset timeout.
+    now[0] += 10
+    assert breaker.allow()
+    now[0] += 5
+    assert not breaker.allow()
+    now[0] += 5
+    assert breaker.allow()
+
+    # So is one that was cancelled, right away.
+    breaker.record_abandoned()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+
+
+class FakeHttpResponse(FakeResponse):
+    released = False
+
+    async def release(self):
+        self.released = True
+
+
+def make_resilience(now, **kwargs):
+    resilience = Resilience(backoff_base=0, breaker_failures=1, breaker_reset=10, **kwargs)
+    resilience._breakers['host'] = CircuitBreaker(1, 10, timer=lambda: now[0])
+    return resilience
+
+
+def test_half_open_trial_always_settles():
+    now = [100.0]
+    resilience = make_resilience(now, retries=0)
+    breaker = resilience.breaker('host')
+    breaker.record_failure()
+
+    async def broken():
+        raise KeyError('not a network error')
+
+    now[0] += 10
+    with pytest.raises(KeyError):
+        run(resilience.call('host', broken))
+    assert breaker.state == breaker.OPEN
+    with pytest.raises(CircuitOpen):
+        run(resilience.call('host', broken))
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def cancelled_trial():
+        task = asyncio.ensure_future(resilience.call('host', slow))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    async def ok():
+        return FakeHttpResponse(200)
+
+    now[0] += 10
+    run(cancelled_trial())
+    assert run(resilience.call('host', ok)).status == 200
+    assert breaker.state == breaker.CLOSED
+
+
+def test_backoff_full_jitter():
+    random.seed(7)
+    for attempt in range(8):
+        delays = [backoff(attempt, base=0.1, cap=2.0) for _ in range(50)]
+        assert all(0 <= d <= min(2.0, 0.1 * 2 ** attempt) for d in delays)
+
+    assert max(backoff(10, base=0.1, cap=2.0) for _ in range(50)) <= 2.0
+
+
+def test_retries_idempotent_calls_on_5xx():
+    resilience = make_resilience([100.0], retries=2)
+    resilience._breakers['host'] = CircuitBreaker(5, 10)
+    responses = [FakeHttpResponse(503), FakeHttpResponse(200)]
+    sent = list(responses)
+
+    async def request():
+        return sent.pop(0)
+
+    assert run(resilience.call('host', request, idempotent=True)) is responses[1]
+    assert responses[0].released
+    assert resilience.stats()['retries'] == 1
+
+    sent[:] = [FakeHttpResponse(503), FakeHttpResponse(200)]
+    assert run(resilience.call('host', request)).status == 503
+
+
+def test_hedged_call_takes_the_faster_answer():
+    resilience = Resilience(hedge_min_samples=3)
+    for _ in range(3):
+        resilience.latency('host').add(0.01)
+
+    slow_response, fast_response = FakeHttpResponse(200), FakeHttpResponse(200)
+    delays = [(1.0, slow_response), (0, fast_response)]
+    cancelled = []
+
+    async def request():
+        delay, resp = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(resp)
+            raise
+        return resp
+
+    assert run(resilience.call('host', request, idempotent=True, hedge=True)) is fast_response
+    assert cancelled == [slow_response]
+    stats = resilience.stats()
+    assert (stats['hedges'], stats['hedges_won']) == (1, 1)
+
+
+class FakeMarketClient(object):
+    """
+    Answers every get with the next of :code:`responses`.
+    """
+    class validators(object):
+        @staticmethod
+        def key(url, params):
+            return url
+
+        @staticmethod
+        def forget(key):
+            pass
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    async def get(self, url, **kwargs):
+        return self.responses.pop(0)
+
+
+class FakeBodyResponse(FakeHttpResponse):
+    def __init__(self, body, status=200, headers=None):
+        super().__init__(status, headers)
+        self.body = body
+
+    async def read(self):
+        return self.body
+
+
+def test_not_modified_counts_bytes_on_the_wire():
+    body = '{"name": "bitcoin ₿"}'.encode('utf-8')
+    saved = BYTES_SAVED.labels()
+
+    for headers, size in (({'Content-Length': '12'}, 12), ({}, len(body))):
+        cw = CryptoWorld(FakeRedis(), FakeMarketClient(
+            FakeBodyResponse(body, headers=headers), FakeHttpResponse(304)))
+        run(cw._fetch(cw.REDIS_KEY_GLOBAL, 'global/'))
+
+        before = saved.value
+        run(cw._fetch(cw.REDIS_KEY_GLOBAL, 'global/'))
+        assert saved.value - before == size
+
+    assert payload_size(FakeResponse(headers={'Content-Length': 'x'}), 5) == 5
+
+
+def decode_chunks(data, size, **kwargs):
+    """
+    Decode :code:`data`, bytes, fed :code:`size` bytes at a time the way the ticker is.
+    """
+    text = codecs.getincrementaldecoder('utf-8')()
+    decoder = JSONArrayDecoder(**kwargs)
+    items = []
+
+    for i in range(0, len(data), size):
+        items += decoder.feed(text.decode(data[i:i + size]))
+
+    return items + decoder.close(text.decode(b'', final=True))
+
+
+def test_json_array_decoder_chunk_boundaries():
+    coins = [{'name': 'Bitcoin ₿ “cash”', 'price': 8123.456789}, 1234567, 'x' * 40, None, []]
+    data = json.dumps(coins, ensure_ascii=False, indent=2).encode('utf-8')
+
+    # Every chunk size from 1 byte up cuts inside strings, numbers and the
+    # multi-byte characters somewhere.
+    for size in range(1, 40):
+        assert decode_chunks(data, size) == coins
+
+    assert decode_chunks(b'[12, 345]', 5) == [12, 345]
+    assert decode_chunks(b' \n[ \t]\r\n ', 2) == []
+    assert decode_chunks(b'[]', 1) == []
+
+
+def test_json_array_decoder_bad_input():
+    for data in (b'[1, 2', b'[{"a": 1}', b'', b'[1,'):
+        with pytest.raises(ValueError):
+            decode_chunks(data, 2)
+
+    for data in (b'{"a": 1}', b'[1] 2', b'[1 2]'):
+        with pytest.raises(ValueError):
+            decode_chunks(data, 2)
+
+    # Malformed input fails once it's more than an element could be, not at close().
+    decoder = JSONArrayDecoder(max_element=64)
+    assert decoder.feed('[{"a": 1}, {"b": nope') == [{'a': 1}]
+    with pytest.raises(ValueError):
+        for _ in range(10):
+            decoder.feed(', "padding": 1')
+    assert decoder.count == 1
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        if isinstance(value, Exception):
+            raise value
+        return [value]
+
+    async def callers(value, n):
+        return await asyncio.gather(
+            *[flight.do('ticker', fetch, value) for _ in range(n)], return_exceptions=True)
+
+    results = run(callers('first', 5))
+    assert calls == ['first']
+    assert all(r is results[0] for r in results)
+    assert not flight.inflight('ticker')
+
+    error = KeyError('down')
+    results = run(callers(error, 3))
+    assert calls == ['first', error]
+    assert all(r is error for r in results)
+
+    # Once a call is done the next one starts afresh.
+    assert run(flight.do('ticker', fetch, 'second')) == ['second']
+    assert flight.stats() == {'calls': 9, 'coalesced': 6, 'inflight': 0}
+
+
+def test_ttl_cache_expiry():
+    now = [0.0]
+    cache = TTLCache(maxsize=4, ttl=10, timer=lambda: now[0])
+    forever = TTLCache(ttl=None, timer=lambda: now[0])
+
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=30)
+    forever.set('c', 3)
+    now[0] = 9.9
+    assert cache.get('a') == 1
+
+    now[0] = 10
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+
+    now[0] = 1000
+    assert cache.get('b', 'gone') == 'gone'
+    assert forever.get('c') == 3
+    assert len(cache) == 0
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expirations']) == (2, 2, 2)
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=3, ttl=None)
+
+    for key in 'abc':
+        cache.set(key, key)
+
+    # Reading a and rewriting b leaves c the least recently used.
+    cache.get('a')
+    cache.set('b', 'B')
+    cache.set('d', 'd')
+    assert cache.get('c') is None
+    assert [cache.get(k) for k in 'abd'] == ['a', 'B', 'd']
+
+    cache.set('e', 'e')
+    assert cache.get('a') is None
+    assert cache.stats()['evictions'] == 2
+    assert (cache.hits, cache.misses) == (4, 2)
+
+    assert cache.delete('e') and not cache.delete('e')
+    cache.clear()
+    assert len(cache) == 0
+
+    with pytest.raises(ValueError):
+        TTLCache(maxsize=0)
+
+
+def ticker_coins():
+    coins = synthetic_ticker(3)
+    for coin, (coin_id, name, symbol) in zip(coins, (
+            ('bitcoin', 'Bitcoin', 'BTC'), ('ethereum', 'Ethereum', 'ETH'),
+            ('bitcoin-gold', 'Bitcoin Gold', 'BTC'))):
+        coin.update(id=coin_id, name=name, symbol=symbol)
+
+    return coins
+
+
+def test_per_coin_hashes():
+    redis = FakeRedis()
+    cw = CryptoWorld(redis, None)
+    coins = ticker_coins()
+    run(cw._store_ticker(b'blob', coins))
+
+    assert redis.data[cw.REDIS_KEY_TICKER] == b'blob'
+    assert set(redis.data[cw.REDIS_KEY_TICKER_IDS]) == {'bitcoin', 'ethereum', 'bitcoin-gold'}
+    # The first coin, by rank, keeps a shared symbol.
+    assert redis.data[cw.REDIS_KEY_TICKER_SYMBOLS]['btc'] == b'bitcoin'
+
+    found = run(cw._redis_get_many(['btc', 'ethereum', 'bitcoin-gold']))
+    assert [bc['id'] for bc in found] == ['bitcoin', 'ethereum', 'bitcoin-gold']
+    assert found[1]['price_usd'] == coins[1]['price_usd']
+    assert [bc['id'] for bc in run(cw._redis_get_many(['btc', 'bitcoin']))] == ['bitcoin']
+    assert run(cw._redis_get_many([])) == []
+
+    # One coin missing means the caller has to load the whole ticker.
+    assert run(cw._redis_get_many(['btc', 'dogecoin'])) is None
+
+    # Without a snapshot in process, lookups are answered from the hashes.
+    assert not cw.has_data
+    assert [bc['id'] for bc in run(cw.ticker_get_many(['ETH', '', 'bitcoin']))] == [
+        'ethereum', 'bitcoin']
+    assert run(cw.ticker_get('btc'))['name'] == 'Bitcoin'
+
+
+def price_store(**prices):
+    return TickerStore([
+        {'id': coin_id, 'name': coin_id, 'symbol': coin_id[:3].upper(), 'price_usd': str(price)}
+        for coin_id, price in prices.items()
+    ])
+
+
+def test_price_history_wraps_around():
+    history = PriceHistory(capacity=4)
+    assert history.window(3600, now=0) == {}
+
+    for i in range(6):
+        history.append(price_store(bitcoin=100 + i), ts=i * 100)
+
+    # Only the last four snapshots are kept, split across the end of the ring.
+    assert len(history) == 4
+    assert (history.oldest, history.newest) == (200, 500)
+
+    stats = history.window(1000, now=500)['bitcoin']
+    assert (stats.first, stats.last, stats.low, stats.high) == (102, 105, 102, 105)
+    assert (stats.samples, stats.span, stats.mean) == (4, 300, 103.5)
+
+    stats = history.window(150, now=500)['bitcoin']
+    assert (stats.first, stats.last, stats.samples) == (104, 105, 2)
+
+    # A sample right at the start of the window is in it.
+    stats = history.window(300, now=500)['bitcoin']
+    assert (stats.first, stats.samples) == (102, 4)
+    assert history.window(299, now=500)['bitcoin'].samples == 3
+    assert history.window(50, now=1000) == {}
+
+
+def test_price_history_partial_coins():
+    history = PriceHistory(capacity=4)
+
+    for i in range(5):
+        prices = {'bitcoin': 100 + i}
+        if i >= 3:
+            prices['newcoin'] = 10 * i
+        if i == 4:
+            del prices['bitcoin']
+        history.append(price_store(**prices), ts=i * 100)
+
+    stats = history.window(3600, now=400)
+    # Listed two snapshots ago, its window only covers those two.
+    assert (stats['newcoin'].first, stats['newcoin'].last, stats['newcoin'].samples) == (30, 40, 2)
+    assert stats['newcoin'].span == 100
+    # Missing from the last snapshot, its last price is carried forward.
+    assert (stats['bitcoin'].first, stats['bitcoin'].last) == (101, 103)
+    assert history.window(3600, ['newcoin', 'nope'], now=400).keys() == {'newcoin'}
+
+
+def test_price_window_command():
+    bot = make_bot()
+    posted = []
+    now = time.time()
+
+    for i, price in enumerate((100, 110, 120)):
+        bot.api.history.append(price_store(bitcoin=price), ts=now - (2 - i) * 3600)
+
+    coins = [Blockchain.from_dict({'id': 'bitcoin', 'symbol': 'BTC', 'name': 'Bitcoin',
+                                   'price_usd': '120'}),
+             Blockchain.from_dict({'id': 'ethereum', 'symbol': 'ETH', 'name': 'Ethereum',
+                                   'price_usd': '3000'})]
+
+    async def fuzzy_match(words):
+        assert words == ['btc', 'eth']
+        return coins
+
+    async def post_message(team_id, channel_id, text):
+        posted.append(text)
+
+    bot._cw.fuzzy_match = fuzzy_match
+    bot.post_message = post_message
+
+    command = bot.router.parse('price btc eth 90m')
+    run(command.route.handler('T1', 'U1', 'C1', command))
+
+    # The samples an hour and two hours old, the older one is outside the window.
+    lines = posted[0].split('\n')
+    assert lines[2] == '\t90m: +9.09%,\tlow: $110.00,\thigh: $120.00,\tavg: $115.00'
+    assert lines[5] == '\t90m: no history yet'
+
+
+class FakeTeamTable(object):
+    """
+    The team table, each read blocks until :code:`release` is set.
+    """
+    def __init__(self):
+        self.token = 'xoxb-old'
+        self.reads = 0
+        self.release = asyncio.Event()
+
+    async def fetch(self, query, team_id):
+        token = self.token
+        self.reads += 1
+        await self.release.wait()
+        return [{'slack_id': team_id, 'bot_access_token': token}]
+
+
+def test_team_invalidated_during_fetch_is_not_cached():
+    async def scenario(invalidate):
+        table, pubsub = FakeTeamTable(), FakePubSub()
+        teams = TeamCache(table, pubsub)
+
+        first = asyncio.ensure_future(teams.get('T1'))
+        while not table.reads:
+            await asyncio.sleep(0)
+
+        # The team reinstalls while its old row is being read.
+        table.token = 'xoxb-new'
+        await invalidate(teams, pubsub)
+        second = asyncio.ensure_future(teams.get('T1'))
+        await asyncio.sleep(0)
+
+        table.release.set()
+        assert (await first)['bot_access_token'] == 'xoxb-old'
+        # Callers after the invalidation don't share the stale read.
+        assert (await second)['bot_access_token'] == 'xoxb-new'
+        assert (await teams.get('T1'))['bot_access_token'] == 'xoxb-new'
+        assert table.reads == 2
+
+        await teams.close()
+
+    async def locally(teams, pubsub):
+        await teams.invalidate('T1')
+
+    async def from_another_process(teams, pubsub):
+        await pubsub.publish(TeamCache.CHANNEL, 'T1')
+        await asyncio.sleep(0)
+
+    run(scenario(locally))
+    run(scenario(from_another_process))
+
+
+def test_latencies_are_kept_per_endpoint():
+    """
+    Fast small calls on a host don't make its big download look slow and get hedged.
+    """
+    client = Client(settings)
+    resilience = client.resilience
+    resilience._hedge_min_samples = 3
+    requests = []
+
+    class Session(object):
+        async def get(self, url, **kwargs):
+            requests.append(url)
+            await asyncio.sleep(0.05 if url.endswith('/ticker/') else 0)
+            return FakeHttpResponse(200)
+
+    class Pool(object):
+        def session(self):
+            return Session()
+
+    client._pool = Pool()
+
+    async def calls():
+        for _ in range(60):
+            await client.get('https://api.example.com/v1/global/')
+        for _ in range(3):
+            await client.get('https://api.example.com/v1/ticker/', endpoint='ticker')
+        await client.get('https://api.example.com/v1/ticker/', endpoint='ticker', hedge=True)
+
+    run(calls())
+    assert len(resilience.latency('api.example.com/v1/global/')) == 60
+    assert len(resilience.latency('ticker')) == 4
+    assert resilience.stats()['hedges'] == 0
+    assert len(requests) == 64
+
+
+class FakeStreamResponse(FakeHttpResponse):
+    def __init__(self, body, chunk=97):
+        super().__init__(200)
+        self.body = body
+        self.chunk = chunk
+
+    @property
+    def content(self):
+        response = self
+
+        class Content(object):
+            async def iter_chunked(self, n):
+                for i in range(0, len(response.body), response.chunk):
+                    yield response.body[i:i + response.chunk]
+
+        return Content()
+
+
+def stream_world(redis, body):
+    return CryptoWorld(redis, FakeMarketClient(FakeStreamResponse(body)), stream_chunk_size=256)
+
+
+def test_streamed_ticker_end_to_end(monkeypatch):
+    coins = ticker_coins()
+    body = json.dumps(coins, ensure_ascii=False, indent=1).encode('utf-8')
+    redis = FakeRedis()
+    cw = stream_world(redis, body)
+
+    def from_raw(*args):
+        raise AssertionError('the streamed ticker was parsed again')
+
+    monkeypatch.setattr(TickerSnapshot, 'from_raw', from_raw)
+    run(cw.update_ticker(force=True))
+
+    # Streamed into temporary keys, renamed over the live ones, none left behind.
+    assert sorted(redis.data) == sorted(
+        [cw.REDIS_KEY_TICKER, cw.REDIS_KEY_TICKER_IDS, cw.REDIS_KEY_TICKER_SYMBOLS])
+    assert cache_codec.decode(redis.data[cw.REDIS_KEY_TICKER]) == coins
+    assert json.loads(redis.data[cw.REDIS_KEY_TICKER_IDS]['ethereum']) == coins[1]
+    assert redis.data[cw.REDIS_KEY_TICKER_SYMBOLS]['btc'] == b'bitcoin'
+
+    # update_ticker took the store the stream built.
+    assert len(cw.ticker.store) == 3
+    assert cw.ticker.version == TickerSnapshot.version_of(redis.data[cw.REDIS_KEY_TICKER])
+    assert cw.ticker.by_id['ethereum']['price_usd'] == coins[1]['price_usd']
+
+
+def test_streamed_ticker_failure_cleans_up():
+    good = ticker_coins()
+    redis = FakeRedis()
+    run(stream_world(redis, json.dumps(good).encode('utf-8')).update_ticker(force=True))
+    live = dict(redis.data)
+
+    # Cut off mid stream.
+    cw = stream_world(redis, json.dumps(good[:2]).encode('utf-8')[:-20])
+    with pytest.raises(ValueError):
+        run(cw.update_ticker(force=True))
+    assert redis.data == live
+
+    class ExpiringRedis(FakeRedis):
+        """
+        The temporary blob expires before the final rename.
+        """
+        async def exec(self, cmd, *args):
+            if cmd == 'rename' and ':tmp:' in args[0]:
+                self.data.pop(args[0], None)
+            return await super().exec(cmd, *args)
+
+    redis = ExpiringRedis()
+    redis.data.update(live)
+    cw = stream_world(redis, json.dumps(good[:2]).encode('utf-8'))
+    with pytest.raises(ReplyError):
+        run(cw.update_ticker(force=True))
+    assert not [k for k in redis.data if ':tmp:' in k]
+    assert cw.ticker.version is None
+
+
+class FakeTransactionConnection(object):
+    def __init__(self, replies):
+        self.replies = replies
+        self.commands = []
+
+    async def execute(self, *args):
+        self.commands.append(args[0])
+        return self.replies if args[0] == 'exec' else b'QUEUED'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class FakeTransactionPool(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+    async def _acquire(self):
+        return self.conn
+
+
+def test_redis_transaction_raises_command_errors():
+    redis = Redis(settings)
+
+    redis._pool = FakeTransactionPool(FakeTransactionConnection([b'OK', 1]))
+    assert run(redis.transaction(('set', 'a', 1), ('expire', 'a', 5))) == [b'OK', 1]
+
+    conn = FakeTransactionConnection([ReplyError('ERR no such key'), 1])
+    redis._pool = FakeTransactionPool(conn)
+    with pytest.raises(ReplyError):
+        run(redis.transaction(('rename', 'tmp', 'live'), ('expire', 'live', 5)))
+    assert conn.commands == ['multi', 'rename', 'expire', 'exec']